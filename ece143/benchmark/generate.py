@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from processing import constants
+from processing.airport import extract_us_airport
+
+# FLIGHT_COLUMNS specifies the columns of the yearly BTS flight csv files in the same order.
+FLIGHT_COLUMNS = ['FL_DATE', 'OP_CARRIER', 'OP_CARRIER_FL_NUM', 'ORIGIN', 'DEST', 'CRS_DEP_TIME', 'DEP_TIME',
+                  'DEP_DELAY', 'TAXI_OUT', 'WHEELS_OFF', 'WHEELS_ON', 'TAXI_IN', 'CRS_ARR_TIME', 'ARR_TIME',
+                  'ARR_DELAY', 'CANCELLED', 'CANCELLATION_CODE', 'DIVERTED', 'CRS_ELAPSED_TIME',
+                  'ACTUAL_ELAPSED_TIME', 'AIR_TIME', 'DISTANCE', 'CARRIER_DELAY', 'WEATHER_DELAY', 'NAS_DELAY',
+                  'SECURITY_DELAY', 'LATE_AIRCRAFT_DELAY', 'Unnamed: 27']
+# AIRPORT_COLUMNS specifies the columns of the OurAirports airport csv file.
+AIRPORT_COLUMNS = ['id', 'ident', 'type', 'name', 'latitude_deg', 'longitude_deg', 'elevation_ft', 'continent',
+                   'iso_country', 'iso_region', 'municipality', 'scheduled_service', 'gps_code', 'iata_code',
+                   'local_code', 'home_link', 'wikipedia_link', 'keywords']
+# relative traffic of the airport types
+TYPE_WEIGHTS = {'large_airport': 20.0, 'medium_airport': 4.0, 'small_airport': 1.0}
+MANIFEST_NAME = 'manifest.json'
+
+
+def generate_airports(data_dir, n_airports=400, seed=0):
+    """
+    This function writes a synthetic worldwide airport file `airports.csv` with the OurAirports schema and its cleaned
+    version `clean_airports.csv`. The US airports are spread over the states in us_regions_division.csv, and a few
+    non-US airports are added so that the cleaning has something to remove.
+    @param data_dir: the output data directory, which must contain us_regions_division.csv
+    @type data_dir: str
+    @param n_airports: number of US airports
+    @type n_airports: int
+    @param seed: the random seed
+    @type seed: int
+    @return: the cleaned US airport dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(data_dir, str)
+    assert isinstance(n_airports, int) and 0 < n_airports <= 26 ** 3
+    assert isinstance(seed, int)
+
+    rng = np.random.default_rng(seed)
+    states = pd.read_csv(os.path.join(data_dir, 'us_regions_division.csv'))['State Code'].to_numpy()
+    n_total = n_airports + 10
+    codes = np.array([chr(65 + k // 676) + chr(65 + k // 26 % 26) + chr(65 + k % 26) for k in range(n_total)])
+    rng.shuffle(codes)
+    df_airport = pd.DataFrame({
+        'id': np.arange(n_total),
+        'ident': np.char.add('K', codes),
+        'type': rng.choice(list(TYPE_WEIGHTS), n_total, p=[0.1, 0.3, 0.6]),
+        'name': np.char.add(codes, ' Airport'),
+        'latitude_deg': rng.uniform(25, 49, n_total),
+        'longitude_deg': rng.uniform(-124, -67, n_total),
+        'elevation_ft': rng.integers(-50, 7000, n_total),
+        'continent': 'NA',
+        'iso_country': ['US'] * n_airports + ['CA'] * (n_total - n_airports),
+        'iso_region': np.char.add('US-', rng.choice(states, n_total)),
+        'municipality': np.char.add(codes, ' City'),
+        'scheduled_service': 'yes',
+        'gps_code': np.char.add('K', codes),
+        'iata_code': codes,
+        'local_code': codes,
+        'home_link': '',
+        'wikipedia_link': '',
+        'keywords': '',
+    }, columns=AIRPORT_COLUMNS)
+    df_airport.to_csv(os.path.join(data_dir, 'airports.csv'), index=False)
+    df_us_airport = extract_us_airport(df_airport)
+    df_us_airport.to_csv(os.path.join(data_dir, 'clean_airports.csv'))
+    return df_us_airport
+
+
+def generate_flights(df_us_airport, year, n_rows, seed=0):
+    """
+    This function returns n_rows synthetic flights of the given year with the BTS schema. The airports are drawn from
+    the given airport data weighted by their type, the delays are skewed to the right, about 2% of the flights are
+    cancelled with the codes A-D, and the delay reason columns are filled for the flights which arrive 15 or more
+    minutes late, as in the BTS data.
+    @param df_us_airport: the cleaned US airport data
+    @type df_us_airport: pd.DataFrame
+    @param year: input year
+    @type year: int
+    @param n_rows: number of flights
+    @type n_rows: int
+    @param seed: the random seed
+    @type seed: int
+    @return: the flight dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_us_airport, pd.DataFrame)
+    assert isinstance(year, int)
+    assert isinstance(n_rows, int) and n_rows > 0
+    assert isinstance(seed, int)
+
+    rng = np.random.default_rng([seed, year, n_rows])
+    codes = df_us_airport['iata_code'].to_numpy()
+    weights = df_us_airport['type'].map(TYPE_WEIGHTS).fillna(1.0).to_numpy()
+    weights = weights / weights.sum()
+    lat = np.radians(df_us_airport['latitude_deg'].to_numpy())
+    lon = np.radians(df_us_airport['longitude_deg'].to_numpy())
+
+    n_days = 366 if pd.Timestamp(year=year, month=12, day=31).dayofyear == 366 else 365
+    days = pd.date_range(str(year) + '-01-01', periods=n_days).strftime('%Y-%m-%d').to_numpy()
+    origin = rng.choice(len(codes), n_rows, p=weights)
+    dest = (origin + rng.integers(1, len(codes), n_rows)) % len(codes)
+    carriers = np.array(list(constants.AIRLINE_FULLNAME_MAP))
+
+    # great-circle distance in miles
+    distance = 3959 * 2 * np.arcsin(np.sqrt(np.sin((lat[dest] - lat[origin]) / 2) ** 2 +
+                                            np.cos(lat[origin]) * np.cos(lat[dest]) *
+                                            np.sin((lon[dest] - lon[origin]) / 2) ** 2))
+    distance = np.maximum(np.round(distance), 30)
+    crs_elapsed = np.round(30 + distance / 8)
+    crs_dep = rng.integers(5 * 60, 23 * 60, n_rows)
+    dep_delay = np.round(rng.exponential(15, n_rows) - 8)
+    taxi_out = rng.integers(5, 40, n_rows).astype(float)
+    taxi_in = rng.integers(2, 20, n_rows).astype(float)
+    air_time = np.round(crs_elapsed - 20 + rng.normal(0, 8, n_rows))
+    actual_elapsed = taxi_out + air_time + taxi_in
+    arr_delay = dep_delay + actual_elapsed - crs_elapsed
+
+    cancelled = rng.random(n_rows) < 0.02
+    diverted = ~cancelled & (rng.random(n_rows) < 0.002)
+    flown = ~cancelled & ~diverted
+
+    def clock(minutes):
+        minutes = np.mod(minutes, 24 * 60)
+        return np.floor(minutes / 60) * 100 + np.mod(minutes, 60)
+
+    def when(mask, values):
+        return np.where(mask, values, np.nan)
+
+    df = pd.DataFrame({
+        'FL_DATE': days[rng.integers(0, n_days, n_rows)],
+        'OP_CARRIER': carriers[rng.integers(0, len(carriers), n_rows)],
+        'OP_CARRIER_FL_NUM': rng.integers(1, 7000, n_rows),
+        'ORIGIN': codes[origin],
+        'DEST': codes[dest],
+        'CRS_DEP_TIME': clock(crs_dep).astype(int),
+        'DEP_TIME': when(~cancelled, clock(crs_dep + dep_delay)),
+        'DEP_DELAY': when(~cancelled, dep_delay),
+        'TAXI_OUT': when(~cancelled, taxi_out),
+        'WHEELS_OFF': when(~cancelled, clock(crs_dep + dep_delay + taxi_out)),
+        'WHEELS_ON': when(flown, clock(crs_dep + dep_delay + taxi_out + air_time)),
+        'TAXI_IN': when(flown, taxi_in),
+        'CRS_ARR_TIME': clock(crs_dep + crs_elapsed).astype(int),
+        'ARR_TIME': when(flown, clock(crs_dep + dep_delay + actual_elapsed)),
+        'ARR_DELAY': when(flown, arr_delay),
+        'CANCELLED': cancelled.astype(float),
+        'CANCELLATION_CODE': np.where(cancelled, rng.choice(['A', 'B', 'C', 'D'], n_rows, p=[0.4, 0.35, 0.24, 0.01]),
+                                      None),
+        'DIVERTED': diverted.astype(float),
+        'CRS_ELAPSED_TIME': crs_elapsed,
+        'ACTUAL_ELAPSED_TIME': when(flown, actual_elapsed),
+        'AIR_TIME': when(flown, air_time),
+        'DISTANCE': distance,
+    })
+
+    # split the arrival delay of the late flights among the delay reasons
+    late = flown & (arr_delay >= 15)
+    shares = rng.dirichlet([3, 0.3, 2, 0.05, 3], n_rows)
+    shares[rng.random((n_rows, 5)) < 0.5] = 0
+    shares[:, 0] += shares.sum(axis=1) == 0
+    shares /= shares.sum(axis=1, keepdims=True)
+    reasons = np.round(shares * np.maximum(arr_delay, 0)[:, None])
+    for k, col in enumerate(constants.DELAY_REASON_COLS):
+        df[col] = when(late, reasons[:, k])
+    df['Unnamed: 27'] = np.nan
+    return df[FLIGHT_COLUMNS]
+
+
+def generate_dataset(data_dir, n_rows, years=None, n_airports=400, seed=0, chunk_size=1000000):
+    """
+    This function writes a synthetic dataset into data_dir: the airport files and one flight csv file per year with
+    n_rows flights each. The flights are generated and appended in chunks, so the memory is bounded by chunk_size for
+    any n_rows, e.g. from 10k to 100M. A manifest with the number of rows is written for the benchmarks.
+    @param data_dir: the output data directory
+    @type data_dir: str
+    @param n_rows: number of flights per year
+    @type n_rows: int
+    @param years: the years to generate, all of the years in constants.YEAR_LIST if it is None
+    @type years: list
+    @param n_airports: number of US airports
+    @type n_airports: int
+    @param seed: the random seed
+    @type seed: int
+    @param chunk_size: number of flights generated at a time
+    @type chunk_size: int
+    @return: the manifest
+    @rtype: dict
+    """
+    assert isinstance(data_dir, str)
+    assert isinstance(n_rows, int) and n_rows > 0
+    assert years is None or isinstance(years, list)
+    assert isinstance(chunk_size, int) and chunk_size > 0
+
+    if years is None:
+        years = constants.YEAR_LIST
+    os.makedirs(data_dir, exist_ok=True)
+    region_path = os.path.join(data_dir, 'us_regions_division.csv')
+    if not os.path.isfile(region_path):
+        source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+        pd.read_csv(os.path.join(source_dir, 'us_regions_division.csv')).to_csv(region_path, index=False)
+    df_us_airport = generate_airports(data_dir, n_airports, seed)
+
+    for year in years:
+        csv_file = os.path.join(data_dir, str(year) + '.csv')
+        for k, start in enumerate(range(0, n_rows, chunk_size)):
+            df = generate_flights(df_us_airport, year, min(chunk_size, n_rows - start), seed + k)
+            df.to_csv(csv_file, index=False, mode='w' if k == 0 else 'a', header=k == 0)
+        print('Generated', csv_file)
+
+    manifest = {'rows_per_year': n_rows, 'years': years, 'n_airports': n_airports, 'seed': seed}
+    with open(os.path.join(data_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic BTS flights dataset.')
+    parser.add_argument('--out', default='./benchmark/data/', help='the output data directory')
+    parser.add_argument('--rows', type=int, default=10000, help='number of flights per year')
+    parser.add_argument('--airports', type=int, default=400, help='number of US airports')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    args = parser.parse_args()
+    generate_dataset(args.out, args.rows, n_airports=args.airports, seed=args.seed, chunk_size=args.chunk_size)
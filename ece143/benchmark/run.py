@@ -0,0 +1,351 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from processing import constants
+
+BASELINE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+MANIFEST_NAME = 'manifest.json'
+# RESULT_POLL_SECONDS is how often the parent checks whether the benchmark process is still alive while it waits
+RESULT_POLL_SECONDS = 1.0
+
+
+def use_data_dir(data_dir):
+    """
+    This function points the file constants of the processing modules to the given data directory, and finds the
+    years of its flight files.
+    @param data_dir: the data directory with the flight and airport files
+    @type data_dir: str
+    """
+    assert isinstance(data_dir, str)
+    assert os.path.isdir(data_dir), "ERROR! The data directory does not exist"
+
+    constants.ROOT = os.path.join(data_dir, '')
+    constants.AIRPORT_DATA_PATH = constants.ROOT + 'airports.csv'
+    constants.CLEANED_AIRPORT_DATA_PATH = constants.ROOT + 'clean_airports.csv'
+    constants.US_REGION_DIVISION_DATA_PATH = constants.ROOT + 'us_regions_division.csv'
+    constants.CACHE_ROOT = constants.ROOT + 'cache/'
+    constants.YEAR_LIST = constants.find_years(constants.ROOT)
+
+
+def bench_data_prepare_count_yearly():
+    from processing.airport import data_prepare
+    data_prepare(constants.TARGET_COUNT, constants.DIRECTION_DEPARTURE, constants.TIME_YEAR)
+
+
+def bench_data_prepare_delay_monthly():
+    from processing.airport import data_prepare
+    data_prepare(constants.TARGET_DELAY, constants.DIRECTION_ARRIVAL, constants.TIME_MONTH)
+
+
+def bench_data_prepare_delay_monthly_partitioned():
+    from processing.airport import data_prepare
+    data_prepare(constants.TARGET_DELAY, constants.DIRECTION_ARRIVAL, constants.TIME_MONTH, chunk_rows=100000)
+
+
+def bench_data_prepare_all_yearly():
+    from processing.airport import data_prepare_all
+    data_prepare_all(constants.TIME_YEAR)
+
+
+def bench_prepare_airline_delay_data():
+    from processing.airline import prepare_airline_delay_data
+    prepare_airline_delay_data()
+
+
+def bench_count_cancellation_by_airline():
+    from processing.airline import count_cancellation_by_airline
+    count_cancellation_by_airline()
+
+
+def bench_count_cancellation_by_airport():
+    from processing.airport import count_cancellation_by_airport
+    count_cancellation_by_airport()
+
+
+def bench_count_cancellation_by_state():
+    from processing.cancellation import count_cancellation_by_state, get_cancellation_rate_matrix
+    get_cancellation_rate_matrix(count_cancellation_by_state())
+
+
+def bench_count_routes_by_region():
+    from processing.airline import count_routes_by_region
+    count_routes_by_region()
+
+
+def bench_build_route_network():
+    from processing.network import build_route_network, get_top_routes, get_airport_degrees
+    network = build_route_network(by='OP_CARRIER')
+    get_top_routes(network, 'flights', 10)
+    get_airport_degrees(network)
+
+
+def bench_build_sketches():
+    from processing.sketch import build_sketches, get_quantiles, get_distinct_counts
+    sketches = build_sketches()
+    get_quantiles(sketches, 'ORIGIN', 'DEP_DELAY')
+    get_distinct_counts(sketches, 'OP_CARRIER', ('ORIGIN', 'DEST'))
+
+
+def bench_build_delay_histograms():
+    from processing.histogram import build_delay_histograms, count_delays
+    histograms = build_delay_histograms(by='OP_CARRIER')
+    count_delays(histograms, 0)
+    count_delays(histograms, 500)
+
+
+def bench_stat_delay_frequency():
+    from plot.plot_DelayReason import StatDelayFrequency
+    StatDelayFrequency([constants.ROOT + str(year) + '.csv' for year in constants.YEAR_LIST])
+
+
+def bench_encode_delay_data():
+    from prediction.encode import GetAirportTable, EncodeFeatures, EncodeDelayLabel
+    from processing.operations import read_csv_file
+    df_airline = read_csv_file(constants.ROOT + str(constants.YEAR_LIST[-1]) + '.csv', constants.FLIGHT_SCHEMA)
+    features, valid = EncodeFeatures(df_airline, GetAirportTable(constants.AIRPORT_DATA_PATH))
+    EncodeDelayLabel(df_airline, valid)
+
+
+# BENCHMARKS maps the benchmark name to the function and the number of years of flights it reads, where None means all
+# of the years found in the data directory.
+BENCHMARKS = {
+    'data_prepare_count_yearly': (bench_data_prepare_count_yearly, None),
+    'data_prepare_delay_monthly': (bench_data_prepare_delay_monthly, None),
+    'data_prepare_delay_monthly_partitioned': (bench_data_prepare_delay_monthly_partitioned, None),
+    'data_prepare_all_yearly': (bench_data_prepare_all_yearly, None),
+    'prepare_airline_delay_data': (bench_prepare_airline_delay_data, None),
+    'count_cancellation_by_airline': (bench_count_cancellation_by_airline, None),
+    'count_cancellation_by_airport': (bench_count_cancellation_by_airport, None),
+    'count_cancellation_by_state': (bench_count_cancellation_by_state, None),
+    'count_routes_by_region': (bench_count_routes_by_region, None),
+    'build_route_network': (bench_build_route_network, None),
+    'build_sketches': (bench_build_sketches, None),
+    'build_delay_histograms': (bench_build_delay_histograms, None),
+    'stat_delay_frequency': (bench_stat_delay_frequency, None),
+    'encode_delay_data': (bench_encode_delay_data, 1),
+}
+
+
+# CHECK_PATHS maps the name of each alternative execution path of data_prepare to its keyword arguments. Each path must
+# return the same airports, states and values as the in-memory path, including on flights with missing delays.
+CHECK_PATHS = {
+    'partitioned': {'chunk_rows': 7777},
+    'cube': {'use_cube': True},
+}
+
+
+def normalize_frame(df):
+    """
+    This function sorts the rows of a data_prepare result by its airport or state column and converts the columns to
+    plain strings and floats, so that the results of different paths can be compared up to the row order and dtypes.
+    @param df: input dataFrame
+    @type df: pd.DataFrame
+    @return: the normalized dataFrame
+    @rtype: pd.DataFrame
+    """
+    df = df.copy()
+    for col in df.columns:
+        df[col] = df[col].astype(float) if df[col].dtype.kind in 'biuf' else df[col].astype(str)
+    key = 'iata_code' if 'iata_code' in df.columns else 'iso_region'
+    return df.sort_values(key, kind='stable').reset_index(drop=True)
+
+
+def check_data_prepare():
+    """
+    This function compares data_prepare of every target, direction and time with each path in CHECK_PATHS, and prints
+    the slices that differ from the in-memory path.
+    @return: the number of the slices that differ
+    @rtype: int
+    """
+    import pandas as pd
+    from processing.airport import data_prepare
+
+    n_diffs = 0
+    for target in [constants.TARGET_COUNT, constants.TARGET_DELAY, constants.TARGET_THROUGHPUT]:
+        for direction in [constants.DIRECTION_DEPARTURE, constants.DIRECTION_ARRIVAL]:
+            for dtime in [constants.TIME_YEAR, constants.TIME_MONTH]:
+                expected = data_prepare(target, direction, dtime)
+                for path, kwargs in CHECK_PATHS.items():
+                    actual = data_prepare(target, direction, dtime, **kwargs)
+                    for level, expected_frames, actual_frames in [('airports', expected[0], actual[0]),
+                                                                  ('states', expected[1], actual[1])]:
+                        for i, (df_expected, df_actual) in enumerate(zip(expected_frames, actual_frames)):
+                            try:
+                                pd.testing.assert_frame_equal(normalize_frame(df_expected), normalize_frame(df_actual))
+                            except AssertionError:
+                                n_diffs += 1
+                                print('%-12s %-8s %-10s %-6s %-9s %d differs' % (path, target, direction, dtime,
+                                                                                 level, i))
+    return n_diffs
+
+
+def peak_rss_mb():
+    """
+    This function returns the peak resident set size of this process in MB.
+    @return: peak RSS in MB
+    @rtype: float
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run_in_child(name, data_dir, result_queue):
+    """
+    This function runs one benchmark in a fresh process, so that the peak RSS only belongs to this benchmark.
+    @param name: the benchmark name
+    @type name: str
+    @param data_dir: the data directory
+    @type data_dir: str
+    @param result_queue: the queue to put the result into
+    @type result_queue: multiprocessing.Queue
+    """
+    use_data_dir(data_dir)
+    func = BENCHMARKS[name][0]
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        func()
+        error = None
+    except Exception as e:
+        error = type(e).__name__ + ': ' + str(e)
+    result_queue.put({'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb(),
+                      'startup_rss_mb': rss_before, 'error': error})
+
+
+def run_benchmark(name, data_dir, rows_per_year, cold=False, timeout=None):
+    """
+    This function runs one benchmark and returns its wall time, peak RSS and rows/sec. With cold, the cache directory
+    is removed first so that the csv files are parsed again. If the benchmark process dies without a result, e.g. it is
+    killed when out of memory, or runs longer than timeout seconds, the result records the error instead.
+    @param name: the benchmark name
+    @type name: str
+    @param data_dir: the data directory
+    @type data_dir: str
+    @param rows_per_year: number of flights per year in the dataset
+    @type rows_per_year: int
+    @param cold: whether we remove the cache before running
+    @type cold: bool
+    @param timeout: the maximum seconds the benchmark may run, no limit if it is None
+    @type timeout: float
+    @return: the result of the benchmark
+    @rtype: dict
+    """
+    assert name in BENCHMARKS
+
+    if cold:
+        shutil.rmtree(os.path.join(data_dir, 'cache'), ignore_errors=True)
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=run_in_child, args=(name, data_dir, result_queue))
+    process.start()
+    start = time.perf_counter()
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            if timeout is not None and time.perf_counter() - start > timeout:
+                process.terminate()
+                error = 'Timeout: the benchmark ran longer than %g seconds' % timeout
+            elif not process.is_alive():
+                # the result may arrive just after the process exits
+                try:
+                    result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+                    continue
+                except queue.Empty:
+                    error = 'Exited: the benchmark process exited with code %s' % process.exitcode
+            else:
+                continue
+            result = {'seconds': time.perf_counter() - start, 'peak_rss_mb': None, 'startup_rss_mb': None,
+                      'error': error}
+    process.join()
+    n_years = BENCHMARKS[name][1]
+    rows = rows_per_year * (len(constants.YEAR_LIST) if n_years is None else n_years)
+    result['rows'] = rows
+    result['rows_per_sec'] = rows / result['seconds'] if result['seconds'] > 0 else None
+    return result
+
+
+def compare(results, baseline, threshold=1.2):
+    """
+    This function compares the results with the baseline results and prints the time and memory ratios. A benchmark
+    is marked as a regression if it is slower or uses more memory than threshold times the baseline.
+    @param results: the mapping of the benchmark names to the results
+    @type results: dict
+    @param baseline: the mapping of the benchmark names to the baseline results
+    @type baseline: dict
+    @param threshold: the ratio above which we report a regression
+    @type threshold: float
+    @return: the names of the regressed benchmarks
+    @rtype: list
+    """
+    assert isinstance(results, dict)
+    assert isinstance(baseline, dict)
+
+    regressions = []
+    print('%-40s %10s %10s %8s' % ('benchmark', 'time x', 'rss x', ''))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or base.get('error') or result.get('error'):
+            print('%-40s %10s %10s' % (name, '-', '-'))
+            continue
+        time_ratio = result['seconds'] / base['seconds']
+        rss_ratio = result['peak_rss_mb'] / base['peak_rss_mb']
+        regressed = time_ratio > threshold or rss_ratio > threshold
+        if regressed:
+            regressions.append(name)
+        print('%-40s %10.2f %10.2f %8s' % (name, time_ratio, rss_ratio, 'SLOWER' if regressed else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the processing and prediction entry points.')
+    parser.add_argument('--data', default='./benchmark/data/', help='the data directory from generate.py')
+    parser.add_argument('--only', nargs='*', default=list(BENCHMARKS), help='the benchmarks to run')
+    parser.add_argument('--cold', action='store_true', help='remove the cache before each benchmark')
+    parser.add_argument('--save-baseline', metavar='NAME', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    parser.add_argument('--timeout', type=float, default=None, help='the maximum seconds of each benchmark')
+    parser.add_argument('--check', action='store_true',
+                        help='check that the execution paths in CHECK_PATHS return the same results instead')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.data, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    use_data_dir(os.path.abspath(args.data))
+    if args.check:
+        n_diffs = check_data_prepare()
+        print('%d slices differ' % n_diffs)
+        sys.exit(1 if n_diffs else 0)
+    results = {}
+    print('%-40s %10s %10s %14s' % ('benchmark', 'seconds', 'peak MB', 'rows/sec'))
+    for name in args.only:
+        result = run_benchmark(name, os.path.abspath(args.data), manifest['rows_per_year'], args.cold, args.timeout)
+        results[name] = result
+        if result['error']:
+            print('%-40s ERROR %s' % (name, result['error']))
+        else:
+            print('%-40s %10.3f %10.1f %14.0f' % (name, result['seconds'], result['peak_rss_mb'],
+                                                  result['rows_per_sec']))
+
+    output = {'manifest': manifest, 'cold': args.cold, 'results': results}
+    if args.save_baseline:
+        os.makedirs(BASELINE_ROOT, exist_ok=True)
+        with open(os.path.join(BASELINE_ROOT, args.save_baseline + '.json'), 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(os.path.join(BASELINE_ROOT, args.compare + '.json')) as f:
+            baseline = json.load(f)
+        if baseline['manifest'] != manifest:
+            print('WARNING! The baseline was recorded on a different dataset')
+        sys.exit(1 if compare(results, baseline['results'], args.threshold) else 0)
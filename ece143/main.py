@@ -1,97 +1,161 @@
-import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import argparse
+import os
 import processing.constants as constants
-from processing.airport import extract_us_airport, data_prepare, count_cancellation_by_airport
-from processing.airline import prepare_airline_delay_data, get_airline_route_by_state, count_cancellation_by_airline
-from processing.flight import get_flight_data_by_year
-from processing.operations import merge
+from processing.airport import data_prepare, data_prepare_all
+from processing.airline import prepare_airline_delay_data, count_routes_by_region, count_cancellation_by_airline
+from processing.cancellation import count_cancellation_by_state, get_cancellation_codes_by_year, \
+    get_cancellation_rate_matrix
+from processing.sketch import build_sketches, get_quantiles
+from processing.trace import traced
 
-from plot import plot_count, plot_delay, plot_cancellation, plot_DelayReason
+# plotly, matplotlib and tensorflow are imported inside the functions that use them, so that importing this module or
+# running one command does not load the stacks it never touches
 
 
-def plot_dep_count_by_airport_and_state_yearly():
+@traced
+def plot_dep_count_by_airport_and_state_yearly(export_path=None):
     """
     This function plots the yearly departure flight count from 2009-2018 for different airports and states
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_count
     df_dep_count_list_by_year, df_dep_count_by_state_list_by_year = data_prepare(constants.TARGET_COUNT,
                                                                                  constants.DIRECTION_DEPARTURE,
                                                                                  constants.TIME_YEAR)
 
     plot_count.plot_count(df_dep_count_list_by_year, df_dep_count_by_state_list_by_year, "ORIGIN_COUNT",
-               "US Domestic Airline Departure Count (Origin)")
+               "US Domestic Airline Departure Count (Origin)",
+               constants.TIME_YEAR, export_path=export_path)
 
 
-def plot_arr_count_by_airport_and_state_yearly():
+@traced
+def plot_arr_count_by_airport_and_state_yearly(export_path=None):
     """
     This function plots the yearly arrival flight count from 2009-2018 for different airports and states
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_count
     df_dep_count_list_by_year, df_dep_count_by_state_list_by_year = data_prepare(constants.TARGET_COUNT,
                                                                                  constants.DIRECTION_ARRIVAL,
                                                                                  constants.TIME_YEAR)
     plot_count.plot_count(df_dep_count_list_by_year, df_dep_count_by_state_list_by_year, "DEST_COUNT",
-               "US Domestic Airline Arrival Count (DEST)")
+               "US Domestic Airline Arrival Count (DEST)",
+               constants.TIME_YEAR, export_path=export_path)
 
 
-def plot_throughpupt_by_apiports_and_state_yearly():
+@traced
+def plot_throughpupt_by_apiports_and_state_yearly(export_path=None):
     """
     This function plots the throughput for different airports and states from 2009-2018.
-    :return:
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_count
     df_count_list, df_count_by_state_list = data_prepare(constants.TARGET_THROUGHPUT,
                                                          constants.DIRECTION_ARRIVAL,
                                                          constants.TIME_YEAR)
-    plot_count.plot_count(df_count_list, df_count_by_state_list, "COUNT", "US Domestic Airline Throughput")
+    plot_count.plot_count(df_count_list, df_count_by_state_list, "COUNT", "US Domestic Airline Throughput",
+               constants.TIME_YEAR, export_path=export_path)
 
 
-def plot_dep_delay_by_airports_and_state_yearly():
+@traced
+def plot_dep_delay_by_airports_and_state_yearly(export_path=None):
     """
     This function will plot the average yearly departure delay for airports and states
-    :return:
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_delay
     df_dep_delay_list_by_year, df_dep_delay_by_state_list_by_year = data_prepare(constants.TARGET_DELAY,
                                                                                  constants.DIRECTION_DEPARTURE,
                                                                                  constants.TIME_YEAR)
     plot_delay.plot_delay(df_dep_delay_list_by_year, df_dep_delay_by_state_list_by_year, "DEP_DELAY",
-               "US Domestic Airline Departure Delay (Origin)")
+               "US Domestic Airline Departure Delay (Origin)",
+               constants.TIME_YEAR, export_path=export_path)
 
 
-def plot_arr_delay_by_airports_and_state_yearly():
+@traced
+def plot_arr_delay_by_airports_and_state_yearly(export_path=None):
     """
     This function plots the average yearly arrival delay for airports and states
-    :return:
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_delay
     df_arr_delay_list_by_year, df_arr_delay_by_state_list_by_year = data_prepare(constants.TARGET_DELAY,
                                                                                  constants.DIRECTION_ARRIVAL,
                                                                                  constants.TIME_YEAR)
     plot_delay.plot_delay(df_arr_delay_list_by_year, df_arr_delay_by_state_list_by_year, "ARR_DELAY",
-               "US Domestic Airline ARR Delay (DEST)")
+               "US Domestic Airline ARR Delay (DEST)",
+               constants.TIME_YEAR, export_path=export_path)
 
 
-def plot_dep_delay_by_airports_and_state_monthly():
+@traced
+def plot_dep_delay_by_airports_and_state_monthly(export_path=None):
     """
     This function will plot the average monthly departure delay for airports and states
-    :return:
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_delay
     df_dep_delay_list_by_month, df_dep_delay_by_state_list_by_month = data_prepare(constants.TARGET_DELAY,
                                                                                    constants.DIRECTION_DEPARTURE,
                                                                                    constants.TIME_MONTH)
     plot_delay.plot_delay(df_dep_delay_list_by_month, df_dep_delay_by_state_list_by_month, "DEP_DELAY",
-               "US Domestic Airline Departure Delay (Origin)")
+               "US Domestic Airline Departure Delay (Origin)",
+               constants.TIME_MONTH, export_path=export_path)
 
 
-def plot_arr_delay_by_airports_and_state_monthly():
+@traced
+def plot_arr_delay_by_airports_and_state_monthly(export_path=None):
     """
     This function will plot the average monthly arrival delay for airports and states
-    :return:
+    :param export_path: the .html or .json file to export the graph to instead of showing it
+    :type export_path: str
     """
+    from plot import plot_delay
     df_arr_delay_list_by_month, df_arr_delay_by_state_list_by_month = data_prepare(constants.TARGET_DELAY,
                                                                                    constants.DIRECTION_ARRIVAL,
                                                                                    constants.TIME_MONTH)
     plot_delay.plot_delay(df_arr_delay_list_by_month, df_arr_delay_by_state_list_by_month, "ARR_DELAY",
-               "US Domestic Airline Arrival Delay (Dest)")
+               "US Domestic Airline Arrival Delay (Dest)",
+               constants.TIME_MONTH, export_path=export_path)
+
+
+@traced
+def plot_airports_and_state_dashboard_yearly(export_dir=None):
+    """
+    This function plots the yearly departure count, arrival count, throughput, departure delay and arrival delay for
+    airports and states. All of them are prepared in one pass over the flight data.
+    :param export_dir: the directory to export the graphs to as html files instead of showing them
+    :type export_dir: str
+    """
+    from plot import plot_count, plot_delay
+
+    def get_export_path(name):
+        return None if export_dir is None else os.path.join(export_dir, name + '.html')
 
+    results = data_prepare_all(constants.TIME_YEAR)
+    df_list, df_by_state_list = results[(constants.TARGET_COUNT, constants.DIRECTION_DEPARTURE)]
+    plot_count.plot_count(df_list, df_by_state_list, "ORIGIN_COUNT", "US Domestic Airline Departure Count (Origin)",
+                          constants.TIME_YEAR, export_path=get_export_path('dep-count'))
+    df_list, df_by_state_list = results[(constants.TARGET_COUNT, constants.DIRECTION_ARRIVAL)]
+    plot_count.plot_count(df_list, df_by_state_list, "DEST_COUNT", "US Domestic Airline Arrival Count (DEST)",
+                          constants.TIME_YEAR, export_path=get_export_path('arr-count'))
+    df_list, df_by_state_list = results[(constants.TARGET_THROUGHPUT, constants.DIRECTION_ARRIVAL)]
+    plot_count.plot_count(df_list, df_by_state_list, "COUNT", "US Domestic Airline Throughput",
+                          constants.TIME_YEAR, export_path=get_export_path('throughput'))
+    df_list, df_by_state_list = results[(constants.TARGET_DELAY, constants.DIRECTION_DEPARTURE)]
+    plot_delay.plot_delay(df_list, df_by_state_list, "DEP_DELAY", "US Domestic Airline Departure Delay (Origin)",
+                          constants.TIME_YEAR, export_path=get_export_path('dep-delay'))
+    df_list, df_by_state_list = results[(constants.TARGET_DELAY, constants.DIRECTION_ARRIVAL)]
+    plot_delay.plot_delay(df_list, df_by_state_list, "ARR_DELAY", "US Domestic Airline ARR Delay (DEST)",
+                          constants.TIME_YEAR, export_path=get_export_path('arr-delay'))
 
+
+@traced
 def plot_airline_history():
     """
     This function calls three functions and plots three graphs.
@@ -99,6 +163,7 @@ def plot_airline_history():
     It plots the average history delay for the 10 airlines that still work nowadays.
     :return:
     """
+    from plot import plot_count, plot_delay
     df_total_delay = prepare_airline_delay_data()
     carrier_list = constants.AIRLINE_CODES_STILL_WORKING
     plot_delay.plot_airline_history_delay(df_total_delay, carrier_list)
@@ -106,16 +171,15 @@ def plot_airline_history():
     plot_delay.plot_delay_top10_airlines(df_total_delay, carrier_list)
 
 
+@traced
 def plot_airline_routes():
     """
     This function plots the route distributions over states for all airlines.
     :return:
     """
-    df_airport = pd.read_csv(constants.AIRPORT_DATA_PATH)
-    df_us_airport = extract_us_airport(df_airport)
-    df_2018 = get_flight_data_by_year(2018, ['OP_CARRIER', 'ORIGIN', 'DEST'])
-    df_2018_origin = merge(df_us_airport, df_2018, 'iata_code', 'ORIGIN')
-    df_2018_dest = merge(df_us_airport, df_2018, 'iata_code', 'DEST')
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    df_route_cnts = count_routes_by_region([2018])
 
     fig = make_subplots(rows=3, cols=4,
                         specs=[[{"type": "domain"} for i in range(4)] for j in range(3)],
@@ -125,7 +189,7 @@ def plot_airline_routes():
                         )
 
     for idx, airline in enumerate(constants.AIRLINE_CODES_STILL_WORKING):
-        df_region_route_cnts = get_airline_route_by_state(df_2018_origin, df_2018_dest, airline)
+        df_region_route_cnts = df_route_cnts[df_route_cnts['OP_CARRIER'] == airline]
         fig.add_trace(
             go.Pie(
                 labels=df_region_route_cnts['Region'],
@@ -143,6 +207,21 @@ def plot_airline_routes():
     fig.show()
 
 
+@traced
+def plot_delay_quantiles():
+    """
+    This function plots the approximate median and 95th percentile of the departure and arrival delays of each airline,
+    which are answered from the delay sketches built in one pass over the flights.
+    :return:
+    """
+    from plot import plot_delay
+    sketches = build_sketches()
+    for delay_type in ['DEP_DELAY', 'ARR_DELAY']:
+        df_quantiles = get_quantiles(sketches, 'OP_CARRIER', delay_type, [0.5, 0.95])
+        plot_delay.plot_delay_quantiles(df_quantiles, delay_type, sketches['relative_error'])
+
+
+@traced
 def plot_cancellation_history():
     """
     This function calls internal functions and plots several graphs:
@@ -152,43 +231,128 @@ def plot_cancellation_history():
     4. plots the dynamic cancellation rate change over months for all states in US.
     :return:
     """
+    from plot import plot_cancellation
     # plot the cancellation history trend
     cancel_airline = count_cancellation_by_airline()
     carrier_list = constants.AIRLINE_CODES_STILL_WORKING
     plot_cancellation.plot_cancellation_history(cancel_airline, carrier_list)
 
     # plot the cancellation reasons
-    df_all, df_cancel, code_a, code_b, code_c, code_d = count_cancellation_by_airport()
-    plot_cancellation.plot_cancellation_reasons(code_a, code_b, code_c, code_d)
-
-    # plot cancellation rate with  respect to month and state¶
-    df_all_sum = df_all.groupby(['iso_region', 'month']).agg({'counts': sum}).rename_axis(
-        ['iso_region', 'month']).reset_index()
-    df_cancel_clean = df_cancel[['FL_DATE', 'iso_region']]
-    df_cancel_clean['month'] = df_cancel_clean['FL_DATE'].str.split('-').str[1]
-    df_cancel_clean = df_cancel_clean.drop(columns=['FL_DATE'])
-    df_cancel_clean = df_cancel_clean.groupby(['iso_region', 'month']).size().reset_index(name='count')
-    df_cancel_clean = df_cancel_clean.groupby(['iso_region', 'month']).agg({'count': sum}).rename_axis(
-        ['iso_region', 'month']).reset_index()
-    df_cancel_stat = pd.merge(df_all_sum, df_cancel_clean, on=['iso_region', 'month'])
-    df_cancel_stat['count'] /= df_cancel_stat['counts']
-
-    state_list = sorted(list(set(df_cancel['iso_region'].to_list())))
-    data = [[] for i in range(12)]
-    for i in range(df_cancel_stat.shape[0]):
-        month = int(df_cancel_stat.iloc[i, 1])
-        if df_cancel_stat.iloc[i, 0] not in state_list:
-            data[month - 1].append(0)
-        else:
-            data[month - 1].append(df_cancel_stat.iloc[i, 3])
-
-    plot_cancellation.plot_cancellation_heatmap_with_states(data, state_list)
-    plot_cancellation.plot_cancellation_by_state_and_month(df_cancel_stat)
+    df_stats = count_cancellation_by_state()
+    df_codes = get_cancellation_codes_by_year(df_stats)
+    plot_cancellation.plot_cancellation_reasons(df_codes['A'].to_list(), df_codes['B'].to_list(),
+                                                df_codes['C'].to_list(), df_codes['D'].to_list())
 
+    # plot cancellation rate with respect to month and state
+    rates, state_list = get_cancellation_rate_matrix(df_stats)
+    plot_cancellation.plot_cancellation_heatmap_with_states(rates, state_list)
+    plot_cancellation.plot_cancellation_by_state_and_month(rates, state_list)
 
+
+@traced
 def plot_delay_reasons_distributions():
     """
     This function is used to plot the distributions for different delay reasons.
     :return:
     """
+    from plot import plot_DelayReason
     plot_DelayReason.PlotPieDemon()
+
+
+# COMMANDS maps the command line names to the plot functions
+COMMANDS = {
+    'dep-count': plot_dep_count_by_airport_and_state_yearly,
+    'arr-count': plot_arr_count_by_airport_and_state_yearly,
+    'throughput': plot_throughpupt_by_apiports_and_state_yearly,
+    'dep-delay': plot_dep_delay_by_airports_and_state_yearly,
+    'arr-delay': plot_arr_delay_by_airports_and_state_yearly,
+    'dep-delay-monthly': plot_dep_delay_by_airports_and_state_monthly,
+    'arr-delay-monthly': plot_arr_delay_by_airports_and_state_monthly,
+    'dashboard': plot_airports_and_state_dashboard_yearly,
+    'airline-history': plot_airline_history,
+    'airline-routes': plot_airline_routes,
+    'delay-quantiles': plot_delay_quantiles,
+    'cancellation-history': plot_cancellation_history,
+    'delay-reasons': plot_delay_reasons_distributions,
+}
+# COMMAND_HELP is the short help of each command in COMMANDS shown by --help
+COMMAND_HELP = {
+    'dep-count': 'plot the yearly departure count of the airports and states',
+    'arr-count': 'plot the yearly arrival count of the airports and states',
+    'throughput': 'plot the yearly throughput of the airports and states',
+    'dep-delay': 'plot the yearly average departure delay of the airports and states',
+    'arr-delay': 'plot the yearly average arrival delay of the airports and states',
+    'dep-delay-monthly': 'plot the monthly average departure delay of the airports and states',
+    'arr-delay-monthly': 'plot the monthly average arrival delay of the airports and states',
+    'dashboard': 'plot the yearly counts, throughput and delays of the airports and states in one pass',
+    'airline-history': 'plot the delay and flight count history of the airlines',
+    'airline-routes': 'plot the route distribution of each airline over the regions',
+    'delay-quantiles': 'plot the approximate median and 95th percentile delay of each airline',
+    'cancellation-history': 'plot the cancellation rates and reasons of the airlines and states',
+    'delay-reasons': 'plot the distribution of the delay reasons',
+}
+# EXPORT_COMMANDS are the animated map commands that can export a compact html or json file instead of showing the graph
+EXPORT_COMMANDS = ['dep-count', 'arr-count', 'throughput', 'dep-delay', 'arr-delay', 'dep-delay-monthly',
+                   'arr-delay-monthly', 'dashboard']
+
+
+def build_parser():
+    """
+    This function builds the command line parser with one sub command for each plot function in COMMANDS, the refresh
+    sub command for the stored partial results, and the predict and serve sub commands for the prediction models.
+    :return: the command line parser
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description='The analysis of the US domestic flight delay and cancellation.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+    for name in COMMANDS:
+        command = subparsers.add_parser(name, help=COMMAND_HELP[name])
+        if name == 'dashboard':
+            command.add_argument('--export', metavar='DIR', default=None,
+                                 help='write the graphs as compact html files to DIR instead of showing them')
+        elif name in EXPORT_COMMANDS:
+            command.add_argument('--export', metavar='PATH', default=None,
+                                 help='write the graph as a compact .html or .json file instead of showing it')
+
+    predict = subparsers.add_parser('predict', help='modify the data, train or test the prediction models')
+    predict.add_argument('mode', choices=['modify_data', 'train', 'train_stream', 'test'])
+
+    refresh = subparsers.add_parser('refresh', help='scan only the new or changed yearly flight files')
+    refresh.add_argument('--workers', type=int, default=None, help='the number of worker processes')
+    refresh.add_argument('--no-month', action='store_true', help='do not build the month partitions')
+
+    serve = subparsers.add_parser('serve', help='serve the delay and cancellation predictions over http')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8143)
+    serve.add_argument('--delay-model', default='./model/delay/model_delay_99')
+    serve.add_argument('--cancel-model', default='./model/cancel/model_cancel_99')
+    return parser
+
+
+def run(argv=None):
+    """
+    This function runs the command given in argv, e.g. ['airline-history']. The plotting and machine learning packages
+    are only imported by the commands that use them.
+    :param argv: the command line arguments, sys.argv[1:] if it is None
+    :type argv: list
+    """
+    args = build_parser().parse_args(argv)
+    if args.command == 'predict':
+        from prediction.train_test import RunMode
+        RunMode(args.mode)
+    elif args.command == 'refresh':
+        from processing.refresh import refresh
+        years = refresh(args.workers, not args.no_month)
+        print('Scanned years: ' + (', '.join(str(year) for year in years) if years else 'none'))
+    elif args.command == 'serve':
+        from prediction.server import RunServer
+        RunServer(args.host, args.port, args.delay_model, args.cancel_model)
+    elif args.command in EXPORT_COMMANDS:
+        COMMANDS[args.command](args.export)
+    else:
+        COMMANDS[args.command]()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,214 @@
+import os
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from processing import constants
+from plot.hover import HOVER_COLUMNS, get_hover_data, get_hover_template, get_marker_size
+
+# EXPORT_SIZE_BUDGET is the default maximum size in bytes of an exported animation
+EXPORT_SIZE_BUDGET = 2 * 2 ** 20
+EXPORT_FORMATS = ['.html', '.json']
+
+
+def get_frame_titles(dtime, n_frames, text):
+    """
+    This function returns the title of each frame, which is the month of monthly graphs and the year of yearly graphs.
+    :param dtime: whether the frames are months or years, constants.TIME_MONTH or constants.TIME_YEAR
+    :type dtime: str
+    :param n_frames: the number of frames
+    :type n_frames: int
+    :param text: the text of the graph
+    :type text: str
+    :return: the list of titles
+    :rtype: list
+    """
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
+    assert isinstance(n_frames, int)
+    assert isinstance(text, str)
+
+    if dtime == constants.TIME_MONTH:
+        return [constants.MONTH_ENG_LIST[i] + " (" + constants.MONTH_LIST[i] + ") " + text for i in range(n_frames)]
+    return [str(constants.YEAR_LIST[i]) + " " + text for i in range(n_frames)]
+
+
+def align_values(df, key, value_col, keys, decimals, fill_value=np.nan):
+    """
+    This function aligns the values of one frame to the static keys and trims their precision. The keys missing in
+    the frame get fill_value, where NaN is written as null and not drawn by plotly.
+    :param df: input dataFrame of one frame
+    :type df: pd.DataFrame
+    :param key: the key column, e.g. 'iata_code'
+    :type key: str
+    :param value_col: the value column
+    :type value_col: str
+    :param keys: the static keys
+    :type keys: pd.Index
+    :param decimals: the number of decimals kept
+    :type decimals: int
+    :param fill_value: the value of the missing keys
+    :type fill_value: float
+    :return: the list of values aligned to keys
+    :rtype: list
+    """
+    values = df.drop_duplicates(key).set_index(key)[value_col].reindex(keys, fill_value=fill_value) \
+               .to_numpy(dtype=np.float64)
+    values = np.round(values, decimals)
+    if decimals == 0:
+        return [np.nan if np.isnan(value) else int(value) for value in values]
+    return values.tolist()
+
+
+def build_compact_map(by_airports, by_states, airport_col, state_col, text, state_title, state_range, airport_range,
+                      decimals=1, show_airport_scale=True, dtime=constants.TIME_YEAR):
+    """
+    This function builds the animated airport and state map of plot_count and plot_delay in a compact form. The airport
+    locations and hover information and the state codes are stored once in the base traces, and each frame only
+    carries the changing state values and airport marker sizes and colors, rounded to the given decimals.
+    :param by_airports: the list of airport dataFrames, one for each frame
+    :type by_airports: list
+    :param by_states: the list of state dataFrames, one for each frame
+    :type by_states: list
+    :param airport_col: the airport value column, e.g. 'ORIGIN_COUNT'
+    :type airport_col: str
+    :param state_col: the state value column
+    :type state_col: str
+    :param text: the text of the graph
+    :type text: str
+    :param state_title: the colorbar title of the states
+    :type state_title: str
+    :param state_range: the (min, max) of the state colors
+    :type state_range: tuple
+    :param airport_range: the (min, max) of the airport colors
+    :type airport_range: tuple
+    :param decimals: the number of decimals kept for the values
+    :type decimals: int
+    :param show_airport_scale: whether we show the colorbar of the airports
+    :type show_airport_scale: bool
+    :param dtime: whether the frames are months or years, constants.TIME_MONTH or constants.TIME_YEAR
+    :type dtime: str
+    :return: the figure
+    :rtype: go.Figure
+    """
+    assert isinstance(by_airports, list)
+    assert isinstance(by_states, list)
+    assert len(by_airports) == len(by_states) > 0
+    assert isinstance(decimals, int) and decimals >= 0
+
+    airport_cols = HOVER_COLUMNS + ['latitude_deg', 'longitude_deg']
+    df_airports = pd.concat([df[airport_cols] for df in by_airports], ignore_index=True) \
+                    .drop_duplicates('iata_code') \
+                    .reset_index(drop=True)
+    airports = pd.Index(df_airports['iata_code'])
+    states = pd.Index(sorted(set().union(*[df['iso_region'].dropna() for df in by_states])))
+    titles = get_frame_titles(dtime, len(by_states), text)
+
+    state_values = [align_values(df, 'iso_region', state_col, states, decimals) for df in by_states]
+    # the airports missing in a frame get the marker size 0, which hides them
+    marker_size = get_marker_size(df_airports)
+    sizes = [np.where(airports.isin(df['iata_code']), marker_size, 0).tolist() for df in by_airports]
+    # the hidden airports get the lowest color instead of null, which plotly.io.read_json rejects for marker colors
+    colors = [align_values(df, 'iata_code', airport_col, airports, decimals, airport_range[0]) for df in by_airports]
+
+    fig = go.Figure(
+        data=[
+            go.Choropleth(
+                locations=list(states),
+                z=state_values[0],
+                locationmode='USA-states',
+                colorscale='Portland',
+                autocolorscale=False,
+                marker_line_color='white',
+                colorbar=dict(x=1.15),
+                colorbar_title=state_title,
+                zmin=state_range[0],
+                zmax=state_range[1]
+            ),
+            go.Scattergeo(
+                locationmode='USA-states',
+                lon=np.round(df_airports['longitude_deg'].to_numpy(dtype=np.float64), 3).tolist(),
+                lat=np.round(df_airports['latitude_deg'].to_numpy(dtype=np.float64), 3).tolist(),
+                mode='markers',
+                customdata=get_hover_data(df_airports),
+                hovertemplate=get_hover_template(color_name=airport_col),
+                name='',
+                marker=dict(
+                    size=sizes[0],
+                    colorscale='Portland',
+                    color=colors[0],
+                    colorbar=dict(x=1.0),
+                    line_color='rgb(255,255,255)',
+                    line_width=0.5,
+                    cmin=airport_range[0],
+                    cmax=airport_range[1],
+                    showscale=show_airport_scale
+                ),
+            )
+        ],
+        layout=go.Layout(
+            title=titles[0],
+            geo=dict(
+                scope='usa',
+                projection=go.layout.geo.Projection(type='albers usa'),
+                showlakes=False,
+            ),
+            updatemenus=[dict(
+                type="buttons",
+                buttons=[dict(label="Play",
+                              method="animate",
+                              args=[None]),
+                         dict(label="Pause",
+                              method='animate',
+                              args=['', {'mode': 'immediate'}]),
+                         ])]
+        ),
+        frames=[go.Frame(
+            name=str(i),
+            data=[dict(type='choropleth', z=state_values[i]),
+                  dict(type='scattergeo', marker=dict(size=sizes[i], color=colors[i]))],
+            traces=[0, 1],
+            layout=go.Layout(title_text=titles[i]),
+        ) for i in range(len(by_states))]
+    )
+    return fig
+
+
+def export_figure(build_figure, export_path, size_budget=EXPORT_SIZE_BUDGET, decimals=2):
+    """
+    This function writes the figure built by build_figure(decimals) to a standalone html file, which loads plotly.js
+    from the CDN, or to a plotly json file, by the extension of export_path. If the output is larger than size_budget
+    bytes, the figure is rebuilt with fewer decimals, and it fails if the output is still larger with 0 decimals.
+    :param build_figure: the function that builds the figure with the given number of decimals
+    :type build_figure: function
+    :param export_path: the output file path ending with .html or .json
+    :type export_path: str
+    :param size_budget: the maximum size of the output in bytes
+    :type size_budget: int
+    :param decimals: the largest number of decimals tried
+    :type decimals: int
+    :return: the size of the output in bytes
+    :rtype: int
+    """
+    assert callable(build_figure)
+    assert isinstance(export_path, str)
+    assert os.path.splitext(export_path)[1] in EXPORT_FORMATS, "ERROR! The export path must end with .html or .json"
+    assert isinstance(size_budget, int) and size_budget > 0
+    assert isinstance(decimals, int) and decimals >= 0
+
+    for n_decimals in range(decimals, -1, -1):
+        fig = build_figure(n_decimals)
+        if export_path.endswith('.json'):
+            output = fig.to_json()
+        else:
+            output = fig.to_html(include_plotlyjs='cdn', full_html=True, auto_play=False)
+        data = output.encode('utf-8')
+        if len(data) <= size_budget:
+            break
+    assert len(data) <= size_budget, "ERROR! The figure has %d bytes, over the budget of %d bytes" % (len(data),
+                                                                                                    size_budget)
+
+    directory = os.path.dirname(export_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(export_path, 'wb') as f:
+        f.write(data)
+    return len(data)
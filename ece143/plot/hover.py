@@ -0,0 +1,65 @@
+import pandas as pd
+from processing import constants
+
+# HOVER_COLUMNS are the airport columns shown in the hover box, in the order of the customdata columns
+HOVER_COLUMNS = ['name', 'iata_code', 'type', 'municipality', 'iso_region']
+# TYPE_NAMES maps the airport types to their display names, e.g. 'large_airport' to 'Large Airport'
+TYPE_NAMES = {airport_type: airport_type.replace('_', ' ').title() for airport_type in constants.TYPES}
+DELAY_NAMES = {'DEP_DELAY': 'Departure Delay (Min)', 'ARR_DELAY': 'Arrive Delay (Min)'}
+
+
+def get_marker_size(df):
+    """
+    This function returns the marker size of each airport by its type.
+    :param df: input airport dataFrame with the column 'type'
+    :type df: pd.DataFrame
+    :return: the marker sizes
+    :rtype: np.ndarray
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    return df['type'].map(constants.TYPES).to_numpy()
+
+
+def get_hover_data(df, value_cols=()):
+    """
+    This function returns the customdata of the airport markers, which has the columns HOVER_COLUMNS followed by
+    value_cols. The hover box is formatted by plotly from it with the template of get_hover_template, so no hover
+    string is built for each airport.
+    :param df: input airport dataFrame
+    :type df: pd.DataFrame
+    :param value_cols: the value columns shown after the airport information, e.g. ['ORIGIN_COUNT', 'DEP_DELAY']
+    :type value_cols: list
+    :return: the customdata with one row per airport
+    :rtype: np.ndarray
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    df_hover = df[HOVER_COLUMNS + list(value_cols)]
+    return df_hover.assign(type=df_hover['type'].map(TYPE_NAMES)).to_numpy(dtype=object)
+
+
+def get_hover_template(value_names=(), value_format=None, color_name=None):
+    """
+    This function returns the hovertemplate of the airport markers for the customdata of get_hover_data.
+    :param value_names: the names shown for the value columns of the customdata, e.g. ['Flights']
+    :type value_names: list
+    :param value_format: the d3 format of the last value, e.g. '.2f'
+    :type value_format: str
+    :param color_name: the name shown for the marker color if it is shown, e.g. when the frames only change the colors
+    :type color_name: str
+    :return: the hovertemplate
+    :rtype: str
+    """
+    template = 'Airport Name: %{customdata[0]} (%{customdata[1]})' + \
+               '<br>' + 'Type: %{customdata[2]}' + \
+               '<br>' + 'Municipality: %{customdata[3]}' + \
+               '<br>' + 'State: %{customdata[4]}'
+    for i, value_name in enumerate(value_names):
+        value = '%{customdata[' + str(len(HOVER_COLUMNS) + i) + ']'
+        if value_format is not None and i == len(value_names) - 1:
+            value += ':' + value_format
+        template += '<br>' + value_name + ': ' + value + '}'
+    if color_name is not None:
+        template += '<br>' + color_name + ': %{marker.color}'
+    return template + '<extra></extra>'
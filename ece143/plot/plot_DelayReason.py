@@ -1,66 +1,39 @@
-import csv
-from collections import defaultdict
-
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
-import matplotlib as plt
+from processing import constants
+from processing.histogram import build_delay_histograms, count_delays
 
 
-def StatDelayFrequency(data_files):
+def StatDelayFrequency(data_files, threshold=500, histograms=None):
     ''' This function is implemented for counting delay frequency for different delay reasons.
-    It reads the csv file listed in data_files, then counts delay frequency independently for delay
-    less than 500 mins or more than 500 mins. The counts will be stored in delay_sum, delay_500
-    and delay_less. 
+    It counts the positive delays of each delay reason in the csv files listed in data_files, and splits them into
+    the delays more than threshold mins and the delays up to threshold mins. The counts come from the delay
+    histograms of processing.histogram, so another threshold can be split from the same histograms without
+    reading the files again.
     @param data_files: data files path
     @type data_files: list of str
+    @param threshold: the delay threshold in mins
+    @type threshold: int
+    @param histograms: the delay histograms of build_delay_histograms(data_files), built if it is None
+    @type histograms: dict
     @return: tuple of percentages.
     @rtype: list of numpy array.
     '''
 
     assert isinstance(data_files, list)
-    n_carrier_delay = 0
-    n_weather_delay = 0
-    n_nas_delay = 0
-    n_security_delay = 0
-    n_late_delay = 0
-
-    n_carrier_500 = 0
-    n_weather_500 = 0
-    n_nas_500 = 0
-    n_security_500 = 0
-    n_late_500 = 0
-    for name in data_files:
-        df_airline = pd.read_csv(name)
-        carrier_delay = df_airline['CARRIER_DELAY'].dropna()
-        weather_delay = df_airline['WEATHER_DELAY'].dropna()
-        nas_delay = df_airline['NAS_DELAY'].dropna()
-        security_delay = df_airline['SECURITY_DELAY'].dropna()
-        late_delay = df_airline['LATE_AIRCRAFT_DELAY'].dropna()
-
-        n_carrier_delay += len(carrier_delay[0 < carrier_delay])
-        n_carrier_500 += len(carrier_delay[carrier_delay > 500])
-
-        n_weather_delay += len(weather_delay[0 < weather_delay])
-        n_weather_500 += len(weather_delay[weather_delay > 500])
-
-        n_nas_delay += len(nas_delay[0 < nas_delay])
-        n_nas_500 += len(nas_delay[nas_delay > 500])
-
-        n_security_delay += len(security_delay[0 < security_delay])
-        n_security_500 += len(security_delay[security_delay > 500])
-
-        n_late_delay += len(late_delay[0 < late_delay])
-        n_late_500 += len(late_delay[late_delay > 500])
-
-    delay_sum = n_carrier_delay + n_weather_delay + n_nas_delay + n_security_delay + n_late_delay
-    delay_500 = n_carrier_500 + n_weather_500 + n_nas_500 + n_security_500 + n_late_500
-    percent_all = np.array([n_carrier_delay, n_weather_delay, n_nas_delay, n_security_delay, n_late_delay]) / delay_sum
-    percent_500 = np.array([n_carrier_500, n_weather_500, n_nas_500, n_security_500, n_late_500]) / delay_500
-    percent_less = np.array([n_carrier_delay, n_weather_delay, n_nas_delay, n_security_delay, n_late_delay]) - np.array(
-        [n_carrier_500, n_weather_500, n_nas_500, n_security_500, n_late_500])
-    return [percent_all, percent_500, percent_less]
+    assert isinstance(threshold, int) and threshold > 0
+
+    if histograms is None:
+        histograms = build_delay_histograms(data_files)
+    n_delay = count_delays(histograms, 0).to_numpy()
+    n_more = count_delays(histograms, threshold).to_numpy()
+
+    percent_all = n_delay / n_delay.sum()
+    percent_more = n_more / n_more.sum()
+    percent_less = n_delay - n_more
+    return [percent_all, percent_more, percent_less]
 
 
 def PlotPie(percent_500, percent_less):
@@ -98,10 +71,7 @@ def PlotPieDemon():
     @return: None
     '''
     #     data_files = ['./data/2009.csv']
-    root = './data'
-    data_files = []
-    for i in range(10):
-        data_files.append(root + '/' + str(2009 + i) + '.csv')
+    data_files = [constants.ROOT + str(year) + '.csv' for year in constants.YEAR_LIST]
 
     [percent_all, percent_500, percent_less] = StatDelayFrequency(data_files)
     PlotPie(percent_500, percent_less)
@@ -111,10 +81,7 @@ if __name__ == '__main__':
     ''' The main section of plot delay reasons distribution. It loads all flight info
     from csv files. Then run StatDelayFrequency to count flight delay.
     '''
-    root = './data'
-    data_files = []
-    for i in range(10):
-        data_files.append(root + '/' + str(2009 + i) + '.csv')
+    data_files = [constants.ROOT + str(year) + '.csv' for year in constants.YEAR_LIST]
 
     [percent_all, percent_500, percent_less] = StatDelayFrequency(data_files)
 
@@ -1,5 +1,6 @@
 from processing import constants
 import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
 
 
@@ -65,22 +66,22 @@ def plot_cancellation_reasons(code_a, code_b, code_c, code_d):
 
     fig = go.Figure()
     fig.add_trace(go.Bar(
-        x=list(range(2009, 2019)),
+        x=constants.YEAR_LIST,
         y=code_a,
         name='Airline/Carrier',
     ))
     fig.add_trace(go.Bar(
-        x=list(range(2009, 2019)),
+        x=constants.YEAR_LIST,
         y=code_b,
         name='Weather',
     ))
     fig.add_trace(go.Bar(
-        x=list(range(2009, 2019)),
+        x=constants.YEAR_LIST,
         y=code_c,
         name='National Air System',
     ))
     fig.add_trace(go.Bar(
-        x=list(range(2009, 2019)),
+        x=constants.YEAR_LIST,
         y=code_d,
         name='Security',
     ))
@@ -99,16 +100,16 @@ def plot_cancellation_reasons(code_a, code_b, code_c, code_d):
 def plot_cancellation_heatmap_with_states(data, state_list):
     """
     This function is used to plot the heat map of cancellation rates in terms of different states and months.
-    :param data: the input cancellation data for different months and states
-    :type data: list
+    :param data: the input 12 x N_states cancellation rate matrix, the row i is the ith month and the column j is the
+    jth state in state_list
+    :type data: np.ndarray
     :param state_list: the input state list that we will follow
     :type state_list: list
     :return:
     """
-    assert isinstance(data, list)
-    for i in data:
-        assert isinstance(i, list)
+    assert isinstance(data, np.ndarray)
     assert isinstance(state_list, list)
+    assert data.shape == (len(constants.MONTH_LIST), len(state_list))
     for s in state_list:
         assert isinstance(s, str)
 
@@ -142,20 +143,25 @@ def plot_cancellation_heatmap_with_states(data, state_list):
     fig.show()
 
 
-def plot_cancellation_by_state_and_month(df_cancel_stat):
+def plot_cancellation_by_state_and_month(data, state_list):
     """
     This function is to plot the dynamic cancellation map graph for different states in different months.
-    :param df_cancel_stat: input cancellation data frame
-    :type df_cancel_stat: pd.DataFrame
+    :param data: the input 12 x N_states cancellation rate matrix, the row i is the ith month and the column j is the
+    jth state in state_list
+    :type data: np.ndarray
+    :param state_list: the input state list that we will follow
+    :type state_list: list
     :return:
     """
-    assert isinstance(df_cancel_stat, pd.DataFrame)
+    assert isinstance(data, np.ndarray)
+    assert isinstance(state_list, list)
+    assert data.shape == (len(constants.MONTH_LIST), len(state_list))
 
     fig = go.Figure(data=
     [
         go.Choropleth(
-            locations=df_cancel_stat[df_cancel_stat['month'] == constants.MONTH_LIST[0]]['iso_region'].to_list(),
-            z=df_cancel_stat[df_cancel_stat['month'] == constants.MONTH_LIST[0]]['count'].to_list(),
+            locations=state_list,
+            z=data[0],
             locationmode='USA-states',
             colorscale='Portland',
             autocolorscale=False,
@@ -182,8 +188,8 @@ def plot_cancellation_by_state_and_month(df_cancel_stat):
         ),
 
         frames=[go.Frame(data=[go.Choropleth(
-            locations=df_cancel_stat[df_cancel_stat['month'] == constants.MONTH_LIST[0]]['iso_region'].to_list(),
-            z=df_cancel_stat[df_cancel_stat['month'] == constants.MONTH_LIST[i]]['count'],
+            locations=state_list,
+            z=data[i],
             locationmode='USA-states',
             colorscale='Portland',
             autocolorscale=False,
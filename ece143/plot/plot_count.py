@@ -1,16 +1,18 @@
 from processing import constants
 import plotly.graph_objects as go
 import pandas as pd
+from plot.export import build_compact_map, export_figure, get_frame_titles, EXPORT_SIZE_BUDGET
+from plot.hover import get_hover_data, get_hover_template, get_marker_size
 
 
-def plot_count(count_by_airports, count_by_states, count_type, text):
+def plot_count(count_by_airports, count_by_states, count_type, text, dtime=constants.TIME_YEAR, export_path=None,
+               size_budget=EXPORT_SIZE_BUDGET):
     """
     This function plots the dynamic flight count graph with the given flight number count data in terms of airports and states.
     Note the count_by_airports is a list of dataFrames, and each dataFrame represents the flight count data for all airports in
     different years/months. Each dataFrame in this list has the columns as
     ['name', 'type', 'municipality', 'iso_region', 'iata_code',
-       'latitude_deg', 'longitude_deg', 'ORIGIN', 'ORIGIN_COUNT'or'DEST_COUNT', 'DEP_DELAY' or 'ARR_DELAY',
-       'text', 'size']
+       'latitude_deg', 'longitude_deg', 'ORIGIN', 'ORIGIN_COUNT'or'DEST_COUNT', 'DEP_DELAY' or 'ARR_DELAY']
     the count_by_states is a list of input dataFrame with the column as
     ['iso_region', 'ORIGIN_COUNT' or 'DEST_COUNT]
     *******************************************
@@ -26,14 +28,28 @@ def plot_count(count_by_airports, count_by_states, count_type, text):
     @type count_type: str
     @param text: input text in the graph
     @type text: str
-    @return: None
-    @rtype: None
+    @param dtime: whether the lists are by month or by year, constants.TIME_MONTH or constants.TIME_YEAR
+    @type dtime: str
+    @param export_path: the .html or .json file to write a compact version of the graph to instead of showing it
+    @type export_path: str
+    @param size_budget: the maximum size of the exported file in bytes
+    @type size_budget: int
+    @return: the size of the exported file in bytes if export_path is given, None otherwise
+    @rtype: int
     """
     assert isinstance(count_by_airports, list)
     assert isinstance(count_by_states, list)
     assert isinstance(count_type, str)
     assert isinstance(text, str)
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
 
+    if export_path is not None:
+        def build_figure(decimals):
+            return build_compact_map(count_by_airports, count_by_states, count_type, count_type, text, "By State",
+                                     (0, 7 * 10 ** 5), (0, 4 * 10 ** 5), decimals, dtime=dtime)
+        return export_figure(build_figure, export_path, size_budget)
+
+    titles = get_frame_titles(dtime, len(count_by_states), text)
     fig = go.Figure(data=
     [
         go.Choropleth(
@@ -53,11 +69,12 @@ def plot_count(count_by_airports, count_by_states, count_type, text):
             lon=count_by_airports[0]['longitude_deg'],
             lat=count_by_airports[0]['latitude_deg'],
             mode='markers',
-            text=count_by_airports[0]['text'],
+            customdata=get_hover_data(count_by_airports[0], [count_type]),
+            hovertemplate=get_hover_template(['Flights']),
             name='',
             marker=
             dict(
-                size=count_by_airports[0]['size'],
+                size=get_marker_size(count_by_airports[0]),
                 colorscale='Portland',
                 color=count_by_airports[0][count_type],
                 colorbar=dict(x=1.0),
@@ -70,8 +87,7 @@ def plot_count(count_by_airports, count_by_states, count_type, text):
         )
     ],
         layout=go.Layout(
-            title=constants.MONTH_ENG_LIST[0] + " (" + constants.MONTH_LIST[0] + ") " + text if len(count_by_states) == 12 else str(
-                constants.YEAR_LIST[0]) + " " + text,
+            title=titles[0],
             geo=dict(
                 scope='usa',
                 projection=go.layout.geo.Projection(type='albers usa'),
@@ -106,11 +122,12 @@ def plot_count(count_by_airports, count_by_states, count_type, text):
                     lon=count_by_airports[i]['longitude_deg'],
                     lat=count_by_airports[i]['latitude_deg'],
                     mode='markers',
-                    text=count_by_airports[i]['text'],
+                    customdata=get_hover_data(count_by_airports[i], [count_type]),
+                    hovertemplate=get_hover_template(['Flights']),
                     name='',
                     marker=
                     dict(
-                        size=count_by_airports[i]['size'],
+                        size=get_marker_size(count_by_airports[i]),
                         colorscale='Portland',
                         color=count_by_airports[i][count_type],
                         colorbar=dict(x=1.0),
@@ -122,9 +139,7 @@ def plot_count(count_by_airports, count_by_states, count_type, text):
                     ),
 
                 )],
-                layout=go.Layout(title_text=
-                                 constants.MONTH_ENG_LIST[i] + " (" + constants.MONTH_LIST[i] + ") " + text if len(count_by_states) == 12
-                                 else str(2009 + i) + " " + text),
+                layout=go.Layout(title_text=titles[i]),
             ) for i in range(len(count_by_states))
         ])
 
@@ -1,6 +1,8 @@
 from processing import constants
 import plotly.graph_objects as go
 import pandas as pd
+from plot.export import build_compact_map, export_figure, get_frame_titles, EXPORT_SIZE_BUDGET
+from plot.hover import get_hover_data, get_hover_template, get_marker_size, DELAY_NAMES
 
 ann_x = [2011, 2017, 2014, 2018, 2011, 2018, 2018,
              2018, 2008, 2009, 2009, 2013, 2009, 2018,
@@ -11,14 +13,14 @@ ann_y = [9.7, 11.8, 1.3, 26.5, 15.7, 7.08, 20.4, 33, 26.5, 22.6, -1, 22, 22.7, 1
          14.3, 7.4, 10]
 
 
-def plot_delay(delay_by_airports, delay_by_states, delay_type, text):
+def plot_delay(delay_by_airports, delay_by_states, delay_type, text, dtime=constants.TIME_YEAR, export_path=None,
+               size_budget=EXPORT_SIZE_BUDGET):
     """
     This function plots the dynamic delay graph with the given delay data in terms of airports and states.
     Note the delay_by_airports is a list of dataFrames, and each dataFrame represents the delay data for all airports in
     different years/months. Each dataFrame in this list has the columns as
     ['name', 'type', 'municipality', 'iso_region', 'iata_code',
-       'latitude_deg', 'longitude_deg', 'ORIGIN', 'ORIGIN_COUNT', 'DEP_DELAY',
-       'text', 'size']
+       'latitude_deg', 'longitude_deg', 'ORIGIN', 'ORIGIN_COUNT', 'DEP_DELAY']
     the delay_by_states is a list of input dataFrame with the column as
     ['iso_region', 'DEP_DELAY', 'ORIGIN_COUNT']
     *******************************************
@@ -34,15 +36,30 @@ def plot_delay(delay_by_airports, delay_by_states, delay_type, text):
     @type delay_type: str
     @param text: input text in the graph
     @type text: str
-    @return: None
-    @rtype: None
+    @param dtime: whether the lists are by month or by year, constants.TIME_MONTH or constants.TIME_YEAR
+    @type dtime: str
+    @param export_path: the .html or .json file to write a compact version of the graph to instead of showing it
+    @type export_path: str
+    @param size_budget: the maximum size of the exported file in bytes
+    @type size_budget: int
+    @return: the size of the exported file in bytes if export_path is given, None otherwise
+    @rtype: int
     """
     assert isinstance(delay_by_airports, list)
     assert isinstance(delay_by_states, list)
     assert isinstance(delay_type, str)
     assert delay_type in ["DEP_DELAY", "ARR_DELAY"]
     assert isinstance(text, str)
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
 
+    if export_path is not None:
+        def build_figure(decimals):
+            return build_compact_map(delay_by_airports, delay_by_states, delay_type, delay_type, text,
+                                     delay_type + " (min)", (0, 25), (0, 25), decimals, False, dtime)
+        return export_figure(build_figure, export_path, size_budget)
+
+    count_col = "ORIGIN_COUNT" if delay_type == "DEP_DELAY" else "DEST_COUNT"
+    titles = get_frame_titles(dtime, len(delay_by_states), text)
     fig = go.Figure(
         data=
         [
@@ -62,11 +79,12 @@ def plot_delay(delay_by_airports, delay_by_states, delay_type, text):
                 lon=delay_by_airports[0]['longitude_deg'],
                 lat=delay_by_airports[0]['latitude_deg'],
                 mode='markers',
-                text=delay_by_airports[0]['text'],
+                customdata=get_hover_data(delay_by_airports[0], [count_col, delay_type]),
+                hovertemplate=get_hover_template(['Flights', DELAY_NAMES[delay_type]], '.2f'),
                 name='',
                 marker=
                 dict(
-                    size=delay_by_airports[0]['size'],
+                    size=get_marker_size(delay_by_airports[0]),
                     colorscale='Portland',
                     color=delay_by_airports[0][delay_type],
                     colorbar=dict(x=1.0),
@@ -79,8 +97,7 @@ def plot_delay(delay_by_airports, delay_by_states, delay_type, text):
             )
         ],
         layout=go.Layout(
-            title=constants.MONTH_ENG_LIST[0] + " (" + constants.MONTH_LIST[0] + ") " + text if len(delay_by_states) == 2
-            else str(constants.YEAR_LIST[0]) + " " + text,
+            title=titles[0],
             geo=dict(
                 scope='usa',
                 projection=go.layout.geo.Projection(type='albers usa'),
@@ -113,11 +130,12 @@ def plot_delay(delay_by_airports, delay_by_states, delay_type, text):
                     lon=delay_by_airports[i]['longitude_deg'],
                     lat=delay_by_airports[i]['latitude_deg'],
                     mode='markers',
-                    text=delay_by_airports[i]['text'],
+                    customdata=get_hover_data(delay_by_airports[i], [count_col, delay_type]),
+                    hovertemplate=get_hover_template(['Flights', DELAY_NAMES[delay_type]], '.2f'),
                     name='',
                     marker=
                     dict(
-                        size=delay_by_airports[i]['size'],
+                        size=get_marker_size(delay_by_airports[i]),
                         colorscale='Portland',
                         color=delay_by_airports[i][delay_type],
                         colorbar=dict(x=1.0),
@@ -129,9 +147,7 @@ def plot_delay(delay_by_airports, delay_by_states, delay_type, text):
                     ),
                 )],
             baseframe='0',
-            layout=go.Layout(title_text=
-                             constants.MONTH_ENG_LIST[i] + " (" + constants.MONTH_LIST[i] + ") " + text if len(delay_by_states) == 3
-                             else str(2009 + i) + " " + text),
+            layout=go.Layout(title_text=titles[i]),
         ) for i in range(len(delay_by_states))]
 
     )
@@ -209,4 +225,40 @@ def plot_delay_top10_airlines(df_total_delay, carrier_list):
     fig.update_layout(
         title_text='10 US Domestic Airlines Average Delay Box Plot',
     )
-    fig.show()
\ No newline at end of file
+    fig.show()
+
+
+def plot_delay_quantiles(df_quantiles, delay_type, relative_error):
+    """
+    This function plots the median and the 95th percentile of the delay of each airline as a grouped bar graph. The
+    quantiles are approximate, and the graph states their error bound.
+    :param df_quantiles: the input quantiles indexed by the airlines, with the columns 'p50' and 'p95'
+    :type df_quantiles: pd.DataFrame
+    :param delay_type: input type with value in ["DEP_DELAY", "ARR_DELAY"]
+    :type delay_type: str
+    :param relative_error: the relative error of the quantiles, e.g. 0.01
+    :type relative_error: float
+    :return:
+    """
+    assert isinstance(df_quantiles, pd.DataFrame)
+    assert delay_type in ["DEP_DELAY", "ARR_DELAY"]
+
+    names = [constants.AIRLINE_FULLNAME_MAP.get(carrier, carrier) for carrier in df_quantiles.index]
+    fig = go.Figure()
+    for col, name in [('p50', 'Median'), ('p95', '95th Percentile')]:
+        fig.add_trace(go.Bar(
+            x=names,
+            y=df_quantiles[col],
+            name=name,
+            hovertemplate='%{x}<br>' + name + ': %{y:.1f} min<extra></extra>',
+        ))
+    fig.update_layout(
+        barmode='group',
+        title_text=str(constants.YEAR_LIST[0]) + '-' + str(constants.YEAR_LIST[-1]) + ' US Domestic Airlines ' +
+                   DELAY_NAMES[delay_type].replace(' (Min)', '') +
+                   ' Quantiles (within ' + format(100 * relative_error, 'g') + '%)',
+        yaxis=dict(
+            title=DELAY_NAMES[delay_type]
+        ),
+    )
+    fig.show()
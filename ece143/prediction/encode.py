@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from processing import constants
+
+# AIRLINE_SET specifies the position of each airline in the one-hot code.
+AIRLINE_SET = {'F9': 0, 'B6': 1, 'EV': 2, 'OO': 3, 'UA': 4, 'AA': 5, 'WN': 6, 'DL': 7, 'HA': 8, 'AS': 9}
+# The feature layout is [encoded_airline (10), origin lat/longitude/elevation_ft (3), dest lat/longitude/elevation_ft (3),
+# month-day (1)].
+N_FEATURES = len(AIRLINE_SET) + 3 + 3 + 1
+
+
+def GetAirportTable(airport_path=constants.AIRPORT_DATA_PATH):
+    '''Get airport info from data and save them into an array table indexed by the iata code.
+    The elevation is set to 0 when it is missing or negative, and the last airport wins when
+    several airports share the same iata code.
+    @param airport_path: the worldwide airport csv file path
+    @type airport_path: str
+    @return: airport table with columns [latitude_deg, longitude_deg, elevation_ft]
+    @rtype: pd.DataFrame
+    '''
+    assert isinstance(airport_path, str)
+
+    df_airport = pd.read_csv(airport_path, usecols=['iata_code', 'latitude_deg', 'longitude_deg', 'elevation_ft'])
+    df_airport = df_airport.dropna(subset=['iata_code']).drop_duplicates('iata_code', keep='last')
+    df_airport['elevation_ft'] = df_airport['elevation_ft'].where(df_airport['elevation_ft'] > 0, 0)
+    df_airport = df_airport.set_index('iata_code')[['latitude_deg', 'longitude_deg', 'elevation_ft']]
+    return df_airport.astype(np.float64)
+
+
+def EncodeMonthDay(dates):
+    '''Change the FL_DATE column to the month-day feature, e.g. 2009-04-26 => 426. The dates
+    are split once per distinct date instead of once per row. It raises ValueError if a date
+    is missing.
+    @param dates: FL_DATE column
+    @type dates: pd.Series
+    @return: array of month-day
+    @rtype: np.ndarray
+    '''
+    assert isinstance(dates, pd.Series)
+
+    dates = dates.astype('category')
+    if (dates.cat.codes.to_numpy() < 0).any():
+        raise ValueError('ERROR! FL_DATE is missing')
+    parts = dates.cat.categories.astype(str).str.split('-')
+    month_day = (parts.str[1] + parts.str[2]).astype(int).to_numpy()
+    return month_day[dates.cat.codes.to_numpy()]
+
+
+def EncodeFeatures(df_airline, airport_table):
+    '''Change the dataframe to the matrix of features in one pass over the columns. The
+    month-day feature uses the integer month and day columns of the flight cache if they are
+    present, and FL_DATE otherwise, e.g. for the raw flights of a prediction request. The rows
+    whose airline is not in AIRLINE_SET, or whose airports are not in airport_table, are
+    dropped, and the mask of the kept rows is returned to select the labels.
+    @param df_airline: data frame of flights
+    @type df_airline: pd.DataFrame
+    @param airport_table: airport table from GetAirportTable
+    @type airport_table: pd.DataFrame
+    @return: feature matrix and mask of the kept rows
+    @rtype: tuple of np.ndarray
+    '''
+    assert isinstance(df_airline, pd.DataFrame)
+    assert isinstance(airport_table, pd.DataFrame)
+    assert {'OP_CARRIER', 'ORIGIN', 'DEST'}.issubset(df_airline.columns)
+    assert 'FL_DATE' in df_airline.columns or {'month', 'day'}.issubset(df_airline.columns)
+
+    carrier_idx = pd.Index(list(AIRLINE_SET)).get_indexer(np.asarray(df_airline['OP_CARRIER'], dtype=object))
+    out_idx = airport_table.index.get_indexer(np.asarray(df_airline['ORIGIN'], dtype=object))
+    in_idx = airport_table.index.get_indexer(np.asarray(df_airline['DEST'], dtype=object))
+    valid = (carrier_idx >= 0) & (out_idx >= 0) & (in_idx >= 0)
+
+    n_airline = len(AIRLINE_SET)
+    airport_values = airport_table.to_numpy(dtype=np.float64)
+    features = np.zeros((int(valid.sum()), N_FEATURES), dtype=np.float64)
+    features[np.arange(len(features)), carrier_idx[valid]] = 1
+    features[:, n_airline:n_airline + 3] = airport_values[out_idx[valid]]
+    features[:, n_airline + 3:n_airline + 6] = airport_values[in_idx[valid]]
+    if {'month', 'day'}.issubset(df_airline.columns):
+        month_day = df_airline['month'].to_numpy(dtype=np.int64)*100+df_airline['day'].to_numpy(dtype=np.int64)
+    else:
+        month_day = EncodeMonthDay(df_airline['FL_DATE'])
+    features[:, n_airline + 6] = month_day[valid]
+    return features, valid
+
+
+def EncodeDelayLabel(df_airline, valid):
+    '''Compute whether the flights delay for any of the delay reasons.
+    @param df_airline: data frame of flights
+    @type df_airline: pd.DataFrame
+    @param valid: mask of the kept rows from EncodeFeatures
+    @type valid: np.ndarray
+    @return: array of labels
+    @rtype: np.ndarray
+    '''
+    assert isinstance(df_airline, pd.DataFrame)
+    assert isinstance(valid, np.ndarray)
+
+    delays = df_airline[constants.DELAY_REASON_COLS].to_numpy(dtype=np.float64)
+    return (delays > 0).any(axis=1)[valid].astype(np.int64)
+
+
+def EncodeCancelLabel(df_airline, valid):
+    '''Get whether the flights are cancelled.
+    @param df_airline: data frame of flights
+    @type df_airline: pd.DataFrame
+    @param valid: mask of the kept rows from EncodeFeatures
+    @type valid: np.ndarray
+    @return: array of labels
+    @rtype: np.ndarray
+    '''
+    assert isinstance(df_airline, pd.DataFrame)
+    assert isinstance(valid, np.ndarray)
+
+    return df_airline['CANCELLED'].to_numpy()[valid]
@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prediction.encode import GetAirportTable, EncodeFeatures
+
+# fields of a flight in the request, which are the same as the columns used by EncodeDelayData
+REQUEST_FIELDS = ['FL_DATE', 'OP_CARRIER', 'ORIGIN', 'DEST']
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    '''The http server which handles each request in a thread.'''
+    daemon_threads = True
+
+
+class MicroBatcher(object):
+    '''The class merges concurrent prediction requests into micro-batches. A background
+    thread waits for the first request, then collects more requests until the batch has
+    max_batch_size rows or max_latency seconds have passed, and calls predict_fn once for
+    the whole batch.
+    '''
+    def __init__(self, predict_fn, max_batch_size=512, max_latency=0.005):
+        '''Initialize the batcher and start the background thread.
+        @param predict_fn: function that maps a feature matrix to a dict of prediction arrays
+        @type predict_fn: function
+        @param max_batch_size: maximum number of rows in a batch
+        @type max_batch_size: int
+        @param max_latency: maximum seconds a request waits for the batch to fill
+        @type max_latency: float
+        @return: None
+        '''
+        assert callable(predict_fn)
+        assert isinstance(max_batch_size, int)
+        assert max_batch_size>0
+        assert isinstance(max_latency, float)
+        assert max_latency>=0
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+    def Submit(self, features):
+        '''Submit the features of one request.
+        @param features: feature matrix of the request
+        @type features: np.ndarray
+        @return: future of the dict of prediction arrays for the rows of the request
+        @rtype: Future
+        '''
+        assert isinstance(features, np.ndarray)
+        assert features.ndim==2
+
+        future = Future()
+        self.requests.put((features, future))
+        return future
+
+    def Close(self):
+        '''Stop the background thread after the pending requests are done.
+        @return: None
+        '''
+        self.requests.put(None)
+        self.thread.join()
+
+    def Run(self):
+        '''Background loop that collects and runs the micro-batches.
+        @return: None
+        '''
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            batch = [item]
+            n_rows = len(item[0])
+            deadline = time.monotonic()+self.max_latency
+            while n_rows<self.max_batch_size:
+                timeout = deadline-time.monotonic()
+                if timeout<=0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.RunBatch(batch)
+                    return
+                batch.append(item)
+                n_rows += len(item[0])
+            self.RunBatch(batch)
+
+    def RunBatch(self, batch):
+        '''Run predict_fn once for the batch and split the results to the requests.
+        @param batch: list of (features, future)
+        @type batch: list
+        @return: None
+        '''
+        try:
+            predictions = self.predict_fn(np.concatenate([features for features, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for features, future in batch:
+            end = start+len(features)
+            future.set_result({name: values[start:end] for name, values in predictions.items()})
+            start = end
+
+
+def LoadPredictFn(delay_model_path, cancel_model_path):
+    '''Load the delay and cancel models once and return the function that scores a batch
+    with both models.
+    @param delay_model_path: the path of the delay model
+    @type delay_model_path: str
+    @param cancel_model_path: the path of the cancel model
+    @type cancel_model_path: str
+    @return: function that maps a feature matrix to the delay and cancel probabilities
+    @rtype: function
+    '''
+    assert isinstance(delay_model_path, str)
+    assert isinstance(cancel_model_path, str)
+
+    from keras.models import load_model
+    delay_model = load_model(delay_model_path)
+    cancel_model = load_model(cancel_model_path)
+
+    def PredictFn(features):
+        return {'delay': np.asarray(delay_model.predict_on_batch(features))[:, 1],
+                'cancel': np.asarray(cancel_model.predict_on_batch(features))[:, 1]}
+    return PredictFn
+
+
+def EncodeRequest(flights, airport_table):
+    '''Encode the raw flight fields of a request with the same layout as EncodeDelayData.
+    @param flights: list of flights, each is a dict with the non-empty str fields in REQUEST_FIELDS
+    @type flights: list of dict
+    @param airport_table: airport table from GetAirportTable
+    @type airport_table: pd.DataFrame
+    @return: feature matrix and mask of the flights that can be encoded
+    @rtype: tuple of np.ndarray
+    '''
+    assert isinstance(flights, list)
+    for flight in flights:
+        assert isinstance(flight, dict)
+        assert all(isinstance(flight.get(field), str) and flight[field] for field in REQUEST_FIELDS)
+
+    df_flight = pd.DataFrame(flights, columns=REQUEST_FIELDS).astype(str)
+    features, valid = EncodeFeatures(df_flight, airport_table)
+    return features.astype(np.float32), valid
+
+
+def MakeHandler(batcher, airport_table):
+    '''Make the http request handler class. The handler accepts POST /predict with a json
+    flight or a json list of flights, e.g.
+    {"FL_DATE": "2018-01-01", "OP_CARRIER": "AA", "ORIGIN": "SAN", "DEST": "JFK"}
+    and answers a json list of {"delay": p, "cancel": p}, or null for the flights whose
+    airline or airports are unknown.
+    @param batcher: the micro-batcher
+    @type batcher: MicroBatcher
+    @param airport_table: airport table from GetAirportTable
+    @type airport_table: pd.DataFrame
+    @return: the handler class
+    @rtype: type
+    '''
+    class PredictHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path!='/predict':
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                flights = body if isinstance(body, list) else [body]
+                features, valid = EncodeRequest(flights, airport_table)
+            except (ValueError, AssertionError):
+                self.send_error(400, 'Invalid flights')
+                return
+            try:
+                scores = batcher.Submit(features).result() if len(features) else {}
+            except Exception:
+                self.send_error(500, 'Prediction failed')
+                return
+            results = [None]*len(flights)
+            for k, row in enumerate(np.flatnonzero(valid)):
+                results[row] = {name: float(values[k]) for name, values in scores.items()}
+            data = json.dumps(results).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # one log line per request is too slow at thousands of requests per second
+            pass
+
+    return PredictHandler
+
+
+def RunServer(host, port, delay_model_path, cancel_model_path, max_batch_size=512, max_latency=0.005):
+    '''Load the models once and serve the predictions over local http until interrupted.
+    @param host: the host to bind
+    @type host: str
+    @param port: the port to bind
+    @type port: int
+    @param delay_model_path: the path of the delay model
+    @type delay_model_path: str
+    @param cancel_model_path: the path of the cancel model
+    @type cancel_model_path: str
+    @param max_batch_size: maximum number of rows in a batch
+    @type max_batch_size: int
+    @param max_latency: maximum seconds a request waits for the batch to fill
+    @type max_latency: float
+    @return: None
+    '''
+    batcher = MicroBatcher(LoadPredictFn(delay_model_path, cancel_model_path), max_batch_size, max_latency)
+    server = ThreadingHTTPServer((host, port), MakeHandler(batcher, GetAirportTable()))
+    print('Serving predictions on http://%s:%d/predict' %(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.Close()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Serve the delay and cancellation predictions.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8143)
+    parser.add_argument('--delay-model', default='./model/delay/model_delay_99')
+    parser.add_argument('--cancel-model', default='./model/cancel/model_cancel_99')
+    parser.add_argument('--max-batch-size', type=int, default=512)
+    parser.add_argument('--max-latency-ms', type=float, default=5.0)
+    args = parser.parse_args()
+    RunServer(args.host, args.port, args.delay_model, args.cancel_model,
+              args.max_batch_size, args.max_latency_ms/1000)
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+# The encoded training data is stored as binary shards, e.g. ./data/delay/train_set_0.x.npy for the features and
+# ./data/delay/train_set_0.y.npy for the labels. The features are float32 and the labels are int8.
+SHARD_ROOT = './data'
+FEATURE_DTYPE = np.float32
+LABEL_DTYPE = np.int8
+
+
+def GetShardPath(mode, file_id):
+    '''Get the path prefix of the shard.
+    @param mode: predict is delay or cancel
+    @type mode: str
+    @param file_id: the shard id
+    @type file_id: int
+    @return: shard path prefix
+    @rtype: str
+    '''
+    assert mode in ['delay', 'cancel']
+    assert isinstance(file_id, int)
+    assert file_id >= 0
+
+    return os.path.join(SHARD_ROOT, mode, 'train_set_%d' % file_id)
+
+
+def SaveShard(mode, file_id, data_set, label):
+    '''Save the encoded features and labels as one shard. Each array is written once to a
+    temporary file and then renamed, so a reader never sees a partial shard.
+    @param mode: predict is delay or cancel
+    @type mode: str
+    @param file_id: the shard id
+    @type file_id: int
+    @param data_set: feature matrix
+    @type data_set: np.ndarray
+    @param label: label array
+    @type label: np.ndarray
+    @return: None
+    '''
+    assert isinstance(data_set, np.ndarray)
+    assert isinstance(label, np.ndarray)
+    assert len(data_set) == len(label)
+
+    shard_path = GetShardPath(mode, file_id)
+    os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+    for suffix, array, dtype in [('.x.npy', data_set, FEATURE_DTYPE), ('.y.npy', label, LABEL_DTYPE)]:
+        tmp_path = shard_path + suffix + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array, dtype=dtype))
+        os.replace(tmp_path, shard_path + suffix)
+
+
+def LoadShard(mode, file_id):
+    '''Load the shard through np.memmap. Slicing the returned arrays only reads the rows
+    of the slice from the disk.
+    @param mode: predict is delay or cancel
+    @type mode: str
+    @param file_id: the shard id
+    @type file_id: int
+    @return: features and labels
+    @rtype: tuple of np.memmap
+    '''
+    shard_path = GetShardPath(mode, file_id)
+    data_set = np.load(shard_path + '.x.npy', mmap_mode='r')
+    label = np.load(shard_path + '.y.npy', mmap_mode='r')
+    assert len(data_set) == len(label)
+    return data_set, label
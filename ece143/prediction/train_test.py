@@ -1,14 +1,22 @@
-import csv
 import os
 import sys
-from collections import defaultdict
 
 import numpy as np
 import pandas as pd
 
-import tensorflow as tf
-from tensorflow.keras import layers
-from keras.models import load_model
+# tensorflow and keras are imported inside the functions that build, load or feed the models,
+# so that encoding the data does not pay their import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from processing import constants
+from processing.cache import read_cached_csv_file
+from prediction.encode import GetAirportTable, EncodeFeatures, EncodeDelayLabel, EncodeCancelLabel, N_FEATURES
+from prediction.shard import SaveShard, LoadShard
+
+# columns of the flight data used by the delay and cancellation encoders
+DELAY_USED_COLS = ['month', 'day', 'OP_CARRIER', 'ORIGIN', 'DEST'] + constants.DELAY_REASON_COLS
+CANCEL_USED_COLS = ['month', 'day', 'OP_CARRIER', 'ORIGIN', 'DEST', 'CANCELLED']
+# modes of this script
+MODES = ['modify_data', 'train', 'train_stream', 'test']
 
 class PredictModel(object):
     '''The class of machine learning model. It was implemented for initializing
@@ -39,12 +47,15 @@ class PredictModel(object):
                 os.mkdir(self.model_path)
         else:
             assert isinstance(model_path, str)
+            from keras.models import load_model
             self.model = load_model(model_path)
         
     def InitialModel(self):
         '''Model initialization. Make a 3 full-connected layers then sequencing them.
         @return: None
         '''
+        import tensorflow as tf
+        from tensorflow.keras import layers
         model = tf.keras.Sequential([
             layers.Dense(256, activation='relu', input_shape=(self.input_size,)),
             layers.Dense(1024, activation='relu'),
@@ -82,6 +93,32 @@ class PredictModel(object):
         self.model.fit(train_set, train_label, epochs=sub_epochs,validation_split=0.2)
         model_name = self.model_path+'/model_'+str(model_id)
         self.model.save(model_name)
+
+    def TrainModelOnDataset(self, dataset, model_id, sub_epochs=1, validation_data=None):
+        '''Tuning model parameters with a streaming tf.data pipeline, e.g. from MakeShardDataset,
+        so that the training data does not need to fit in memory. The model is saved in model
+        dir after training.
+        @param dataset: batched dataset of (features, labels)
+        @type dataset: tf.data.Dataset
+        @param model_id: the model id/trained epoches
+        @type model_id: int
+        @param sub_epochs: number of passes over the dataset.
+        @type sub_epochs: int
+        @param validation_data: batched dataset of (features, labels) for validation
+        @type validation_data: tf.data.Dataset
+        @return: None
+        '''
+        import tensorflow as tf
+
+        assert isinstance(dataset, tf.data.Dataset)
+        assert isinstance(model_id, int)
+        assert model_id>=0
+        assert isinstance(sub_epochs, int)
+        assert sub_epochs>0
+
+        self.model.fit(dataset, epochs=sub_epochs, validation_data=validation_data)
+        model_name = self.model_path+'/model_'+str(model_id)
+        self.model.save(model_name)
     
     def Predict(self, input_data):
         '''Predict whether the flight will delay/cancel.
@@ -93,142 +130,45 @@ class PredictModel(object):
         assert isinstance(input_data, np.ndarray)
         return self.model.predict(input_data)
 
-def EncodeAirline(airline):
-    '''Change the classes to one-hot code.
-    @param airline: airline code.
-    @type airline: str
-    @return: array of one-hot key
-    @rtype: list
-    '''
-    
-    assert isinstance(airline, str)
-    airline_set = {'F9':0, 'B6':1, 'EV':2, 'OO':3, 'UA':4, 'AA':5, 'WN':6, 'DL':7, 'HA':8, 'AS':9}
-    assert airline in airline_set
-    airline_hotkey = [0]*len(airline_set)
-    if airline in airline_set:
-        airline_hotkey[airline_set[airline]] += 1
-    return airline_hotkey
-    
-    
-def EncodeDelayData(df_airline, airport_info):
-    ''''Change the dataframe to array of training set. The format of input feature is 
-    [encoded_airline, lat, longtitude, elevation_ft, month-day].
+def EncodeDelayData(df_airline, airport_table):
+    '''Change the dataframe to array of training set. The format of input feature is 
+    [encoded_airline, lat, longtitude, elevation_ft, month-day]. The rows whose airline or
+    airports are unknown are dropped.
     
-    @param df_airline: data frame of 
-    @type airline: pd.DataFrame
-    @param df_airline: airport information 
-    @type airline: dict
+    @param df_airline: data frame of flights
+    @type df_airline: pd.DataFrame
+    @param airport_table: airport table from GetAirportTable
+    @type airport_table: pd.DataFrame
     @return: train set and label
-    @rtype: tuple of list
+    @rtype: tuple of np.ndarray
     '''
     assert isinstance(df_airline, pd.DataFrame)
-    assert isinstance(airport, dict)
-    
-    train_set = []
-    test_set = []
-    label_train = []
-    label_test = []
-    N_data = len(df_airline)
-    delay_types=['WEATHER_DELAY','CARRIER_DELAY','NAS_DELAY','SECURITY_DELAY','LATE_AIRCRAFT_DELAY']
-    airline_set = {'F9':0, 'B6':1, 'EV':2, 'OO':3, 'UA':4, 'AA':5, 'WN':6, 'DL':7, 'HA':8, 'AS':9}
-    for k in range(N_data):
-        carrier = df_airline['OP_CARRIER'][k]
-        if carrier not in airline_set: continue
-        date = df_airline['FL_DATE'][k].split('-')
-        month = [int(date[1]+date[2])]
-        airport_out = df_airline['ORIGIN'][k]
-        airport_in = df_airline['DEST'][k]
-        airport_out_info = airport_info[airport_out]
-        airport_in_info = airport_info[airport_in]
-        carrier_hotkey = EncodeAirline(carrier)
-        data_row = carrier_hotkey+airport_out_info+airport_in_info+month
-        train_set.append(data_row)
-        y = int(any(df_airline[delay_type][k]>0 for delay_type in delay_types))
-        label_train.append(y)
-        
+    assert isinstance(airport_table, pd.DataFrame)
+
+    train_set, valid = EncodeFeatures(df_airline, airport_table)
+    label_train = EncodeDelayLabel(df_airline, valid)
     return (train_set, label_train)
     
-def EncodeCancelData(df_airline, airport_info):
+def EncodeCancelData(df_airline, airport_table):
     '''Change the dataframe to array of training set. The format of input feature is 
-    [encoded_airline, lat, longtitude, elevation_ft, month-day] .
+    [encoded_airline, lat, longtitude, elevation_ft, month-day]. The rows whose airline or
+    airports are unknown are dropped.
     
-    @param df_airline: data frame of 
-    @type airline: pd.DataFrame
-    @param df_airline: airport information 
-    @type airline: dict
+    @param df_airline: data frame of flights
+    @type df_airline: pd.DataFrame
+    @param airport_table: airport table from GetAirportTable
+    @type airport_table: pd.DataFrame
     @return: train set and label
-    @rtype: tuple of list
+    @rtype: tuple of np.ndarray
     '''
-    
-    train_set = []
-    test_set = []
-    label_train = []
-    label_test = []
-    N_data = len(df_airline)
-    delay_types=['WEATHER_DELAY','CARRIER_DELAY','NAS_DELAY','SECURITY_DELAY','LATE_AIRCRAFT_DELAY']
-    airline_set = {'F9':0, 'B6':1, 'EV':2, 'OO':3, 'UA':4, 'AA':5, 'WN':6, 'DL':7, 'HA':8, 'AS':9}
-    for k in range(N_data):
-        carrier = df_airline['OP_CARRIER'][k]
-        if carrier not in airline_set: continue
-        date = df_airline['FL_DATE'][k].split('-')
-        month = [int(date[1]+date[2])]
-        airport_out = df_airline['ORIGIN'][k]
-        airport_in = df_airline['DEST'][k]
-        airport_out_info = airport_info[airport_out]
-        airport_in_info = airport_info[airport_in]
-        carrier_hotkey = EncodeAirline(carrier)
-        data_row = carrier_hotkey+airport_out_info+airport_in_info+month
-        if len(data_row)<16: continue
-        train_set.append(data_row)
-        y = df_airline['CANCELLED'][k]
-        label_train.append(y)
-        
+    assert isinstance(df_airline, pd.DataFrame)
+    assert isinstance(airport_table, pd.DataFrame)
+
+    train_set, valid = EncodeFeatures(df_airline, airport_table)
+    label_train = EncodeCancelLabel(df_airline, valid)
     return (train_set, label_train)
     
     
-def GetAirportInfo():
-    '''Get airport info from data and save them into dict.
-    @return: airport information
-    @rtype: dict
-    '''
-    
-    df_airport = pd.read_csv('./data/airports.csv')
-    airport_info = defaultdict(list)
-    airline_name = {'9E':'Endeavor Air',
-                    'AA':'American Airlines', 
-                    'AS':'Alaska Airlines',
-                    'B6':'JetBlue', 
-                    'CO':'Continental Airlines', 
-                    'DL':'Delta Air Lines', 
-                    'EV':'Atlantic Southeast Airlines', 
-                    'F9':'Frontier Airlines', 
-                    'FL':'AirTran', 
-                    'G4':'Allegiant Air',
-                    'HA':'Hawaiian Airlines',
-                    'MQ':'Envoy Air', 
-                    'NK':'Spirit Airlines', 
-                    'NW':'Northwest Airlines', 
-                    'OH':'Comair',
-                    'OO':'SKYWEST',
-                    'UA':'United Airlines',
-                    'US':'US Airways', 
-                    'VX':'Virgin America', 
-                    'WN':'Southwest Airlines',
-                    'XE':'ExpressJet', 
-                    'YV':'Mesa Airlines',
-                    'YX':'Midwest Express', 
-                   }
-
-    hasiata = df_airport['iata_code'].notnull()
-    for k in range(len(df_airport)):
-        if not hasiata[k]: continue 
-        iata = df_airport['iata_code'][k]
-        elevation = df_airport['elevation_ft'][k] if df_airport['elevation_ft'][k]>0 else 0
-        airport_info[iata] = [float(df_airport['latitude_deg'][k]),
-                                float(df_airport['longitude_deg'][k]),
-                                elevation]
-    return airport_info
-
 def ModifyDelayData(data_files):
     '''Read the raw data from data_files and convert them into ml training format.
      
@@ -239,21 +179,12 @@ def ModifyDelayData(data_files):
  
     assert isinstance(data_files, list)
     
-    airport_info = GetAirportInfo()
+    airport_table = GetAirportTable()
     for file_id in range(len(data_files)):
         print('File Name:', data_files[file_id])
-        df_airline = pd.read_csv(data_files[file_id])
-        if not os.path.exists('./data'):
-            os.mkdir('./data')
-        if not os.path.exists('./data/delay'):
-            os.mkdir('./data/delay')
-        mldata_path = './data/delay/train_set_%d.csv' %file_id
-        data_set, label = EncodeDelayData(df_airline, airport_info)
-        pd.DataFrame(data_set).to_csv(mldata_path)
-        with open(mldata_path, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile, delimiter=',')
-            for k, row in enumerate(data_set):
-                csv_writer.writerow(row+[label[k]])
+        df_airline = read_cached_csv_file(data_files[file_id], DELAY_USED_COLS, constants.FLIGHT_SCHEMA, True)
+        data_set, label = EncodeDelayData(df_airline, airport_table)
+        SaveShard('delay', file_id, data_set, label)
                 
 def ModifyCancelData(data_files):
     '''Read the raw data from data_files and convert them into ml training format.
@@ -264,21 +195,12 @@ def ModifyCancelData(data_files):
     '''
     
     assert isinstance(data_files, list)
-    airport_info = GetAirportInfo()
+    airport_table = GetAirportTable()
     for file_id in range(len(data_files)):
         print('File Name:', data_files[file_id])
-        df_airline = pd.read_csv(data_airline[file_id])
-        if not os.path.exists('./data'):
-            os.mkdir('./data')
-        if not os.path.exists('./data/cancel'):
-            os.mkdir('./data/cancel')
-        mldata_path = './data/cancel/train_set_%d.csv' %file_id
-        data_set, label = EncodeCancelData(df_airline, airport_info)
-        pd.DataFrame(data_set).to_csv(mldata_path)
-        with open(mldata_path, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile,  delimiter=',')
-            for k, row in enumerate(data_set):
-                csv_writer.writerow(row+[label[k]])
+        df_airline = read_cached_csv_file(data_files[file_id], CANCEL_USED_COLS, constants.FLIGHT_SCHEMA, True)
+        data_set, label = EncodeCancelData(df_airline, airport_table)
+        SaveShard('cancel', file_id, data_set, label)
 
 def TrainDelayModel(model_path=None):
     '''Train delay prediction model. If model_path is not None, load the pre-trained
@@ -301,20 +223,15 @@ def TrainDelayModel(model_path=None):
     for epoch in range(100):
         file_id = epoch%10
         print('Total Epoch=', epoch)
-        mldata_path = './data/delay/train_set_%d.csv' %file_id
-        
-        data_set = pd.read_csv(mldata_path, header=None)
+        data_set, data_label = LoadShard('delay', file_id)
         n_data = len(data_set)
-        train_set = np.array(data_set.iloc[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1),0:17])
-        
-        label = np.array(data_set.iloc[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1),17])
-        
-        train_set = train_set[~np.isnan(label)]
-        label = label[~np.isnan(label)]
+        # only the rows of this slice are read from the memory-mapped shard
+        train_set = np.asarray(data_set[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1)])
+        label = np.asarray(data_label[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1)])
         delay_agent.TrainModel(train_set, label, model_id=epoch, sub_epochs=1)
     return delay_agent
     
-def TrainCancelModel():
+def TrainCancelModel(model_path=None):
     '''Train cancel prediction model. If model_path is not None, load the pre-trained
     model from model_path.
     @param model_path: folder to save model 
@@ -335,18 +252,116 @@ def TrainCancelModel():
     for epoch in range(100):
         file_id = epoch%10
         print('Total Epoch=', epoch)
-        mldata_path = './data/cancel/train_set_%d.csv' %file_id
-        
-        data_set = pd.read_csv(mldata_path, header=None)
+        data_set, data_label = LoadShard('cancel', file_id)
         n_data = len(data_set)
-        train_set = np.array(data_set.iloc[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1),0:17])
-        
-        label = np.array(data_set.iloc[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1),17])
-        
-        train_set = train_set[~np.isnan(label)]
-        label = label[~np.isnan(label)]
+        # only the rows of this slice are read from the memory-mapped shard
+        train_set = np.asarray(data_set[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1)])
+        label = np.asarray(data_label[(n_data//10)*(epoch//10):(n_data//10)*(epoch//10+1)])
         cancel_agent.TrainModel(train_set, label, model_id=epoch, sub_epochs=1)
 
+def ShardChunks(mode, file_id, chunk_size, shuffle):
+    '''Yield the rows of one memory-mapped shard in chunks. With shuffle, the chunks are
+    visited in a random order and the rows are permuted inside each chunk.
+    @param mode: predict is delay or cancel
+    @type mode: str or bytes
+    @param file_id: the shard id
+    @type file_id: int
+    @param chunk_size: number of rows in each chunk
+    @type chunk_size: int
+    @param shuffle: whether we shuffle the chunks and rows
+    @type shuffle: bool
+    @return: generator of features and labels
+    @rtype: generator
+    '''
+    # tf.data passes the generator arguments as numpy values
+    if isinstance(mode, bytes):
+        mode = mode.decode()
+    data_set, label = LoadShard(mode, int(file_id))
+    starts = np.arange(0, len(data_set), int(chunk_size))
+    if shuffle:
+        np.random.shuffle(starts)
+    for start in starts:
+        x = np.asarray(data_set[start:start+chunk_size])
+        y = np.asarray(label[start:start+chunk_size])
+        if shuffle:
+            order = np.random.permutation(len(x))
+            x, y = x[order], y[order]
+        yield x, y
+
+def MakeShardDataset(mode, file_ids, batch_size=1024, shuffle=True, shuffle_buffer=65536, chunk_size=65536):
+    '''Build a streaming input pipeline over the encoded shards. The shards are read in chunks
+    by parallel interleaved readers, shuffled through a bounded buffer, batched, and prefetched
+    so that loading overlaps with training. The memory is bounded by the buffer and chunk sizes
+    instead of the number of shards.
+    @param mode: predict is delay or cancel
+    @type mode: str
+    @param file_ids: the shard ids
+    @type file_ids: list of int
+    @param batch_size: number of rows in each batch
+    @type batch_size: int
+    @param shuffle: whether we shuffle the rows
+    @type shuffle: bool
+    @param shuffle_buffer: number of rows in the shuffling buffer
+    @type shuffle_buffer: int
+    @param chunk_size: number of rows read from a shard at a time
+    @type chunk_size: int
+    @return: batched dataset of (features, labels)
+    @rtype: tf.data.Dataset
+    '''
+    assert mode in ['delay', 'cancel']
+    assert isinstance(file_ids, list)
+    assert len(file_ids)>0
+    assert isinstance(batch_size, int)
+    assert batch_size>0
+    assert isinstance(shuffle_buffer, int)
+    assert shuffle_buffer>0
+    assert isinstance(chunk_size, int)
+    assert chunk_size>0
+
+    import tensorflow as tf
+    spec = (tf.TensorSpec(shape=(None, N_FEATURES), dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int8))
+    files = tf.data.Dataset.from_tensor_slices(np.array(file_ids, dtype=np.int64))
+    if shuffle:
+        files = files.shuffle(len(file_ids), reshuffle_each_iteration=True)
+    dataset = files.interleave(
+        lambda file_id: tf.data.Dataset.from_generator(
+            ShardChunks, args=(mode, file_id, chunk_size, shuffle), output_signature=spec),
+        cycle_length=min(len(file_ids), 4),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle)
+    dataset = dataset.unbatch()
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(lambda x, y: (x, tf.cast(y, tf.int32)), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def TrainStreamingModel(mode='delay', epochs=10, batch_size=1024):
+    '''Train the delay/cancel prediction model over all training shards (0-8) with the
+    streaming input pipeline. Shard 9 is used for validation, which is the same as TestModel.
+    @param mode: predict is delay or cancel
+    @type mode: str
+    @param epochs: number of passes over the training shards
+    @type epochs: int
+    @param batch_size: number of rows in each batch
+    @type batch_size: int
+    @return: tensorflow neural network
+    @rtype: PredictModel class
+    '''
+    assert mode in ['delay', 'cancel']
+    assert isinstance(epochs, int)
+    assert epochs>0
+
+    agent = PredictModel(N_FEATURES)
+    agent.model.summary()
+    train_data = MakeShardDataset(mode, list(range(9)), batch_size=batch_size)
+    validation_data = MakeShardDataset(mode, [9], batch_size=batch_size, shuffle=False)
+    for epoch in range(epochs):
+        print('Total Epoch=', epoch)
+        agent.TrainModelOnDataset(train_data, model_id=epoch, sub_epochs=1, validation_data=validation_data)
+    return agent
+
 def TestModel(agent, mode='delay'):
     '''Get the tensorflow network. Test the model with 2018 flight data.
     
@@ -359,22 +374,19 @@ def TestModel(agent, mode='delay'):
     '''
     
     assert mode in ['delay', 'cancel']
-    test_set_path = os.path.join('./data',mode,'train_set_9.csv')
-    data_set = pd.read_csv(test_set_path, header=None)
-    n_data = len(data_set)
-    test_set = np.array(data_set.iloc[0:n_data,0:17])
-    label = np.array(data_set.iloc[0:n_data,17])
-    test_set = test_set[~np.isnan(label)]
-    label = label[~np.isnan(label)]
+    test_set, label = LoadShard(mode, 9)
     y_predict = np.argmax(agent.model.predict(test_set), axis=1)
     accuracy = sum(label==y_predict)/len(label)
     return accuracy
     
-if __name__=='__main__':
+def RunMode(mode):
+    '''Run one of the modes of this script: modify_data, train, train_stream or test.
+    @param mode: the mode to run
+    @type mode: str
+    @return: None
+    '''
+    assert mode in MODES, 'MODE ERROR'
 
-    if len(sys.argv)<2:
-        print('You should provide the mode!')
-    mode = sys.argv[1]
     if mode=='modify_data':
         root = './data'
         data_files = []
@@ -390,6 +402,12 @@ if __name__=='__main__':
         print('--- Training The Cancellation Model ---')
         cancel_agent = TrainCancelModel()
 
+    elif mode=='train_stream':
+        print('--- Training The Delay Model (Streaming) ---')
+        delay_agent = TrainStreamingModel('delay')
+        print('--- Training The Cancellation Model (Streaming) ---')
+        cancel_agent = TrainStreamingModel('cancel')
+
     elif mode=='test':
         print('--- Test Delay Model ---')
         try:
@@ -407,5 +425,12 @@ if __name__=='__main__':
         cancel_accuracy = TestModel(cancel_agent, mode='cancel')
         print('Your cancellation model accuracy is %f' %cancel_accuracy)
 
+if __name__=='__main__':
+
+    if len(sys.argv)<2:
+        print('You should provide the mode!')
+    mode = sys.argv[1]
+    if mode in MODES:
+        RunMode(mode)
     else:
         print('MODE ERROR')
@@ -1,23 +1,51 @@
+import numpy as np
 import pandas as pd
 from processing import constants
-from processing.operations import count, aggregate, average, merge, read_csv_file
+from processing.operations import count, aggregate, average, merge, accumulate
 from processing.airport import get_flight_data_by_year, extract_us_airport
+from processing.parallel import map_in_order
+from processing.reference import get_us_airports, get_us_regions, get_iata_lookup, get_airport_positions
+from processing.cube import build_cube, rollup
+from processing.trace import traced
 
 
-def prepare_airline_delay_data():
+@traced
+def prepare_airline_delay_by_year(year, use_cube=False):
     """
-    This function returns the delay data for different airlines.
+    This function returns the delay data for different airlines in the given year.
+    @param year: input year
+    @type year: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
     @return: the delay dataFrame
     @rtype: pd.DataFrame
     """
-    df = pd.DataFrame()
-    used_cols = []
-    for year in constants.YEAR_LIST:
+    assert isinstance(year, int)
+
+    if use_cube:
+        df_delay = total_delay_from_cube(build_cube(year))
+    else:
+        used_cols = []
         curr = get_flight_data_by_year(year, used_cols)
         df_delay = total_delay(curr)
-        df_delay['year'] = str(year)
-        df = df.append(df_delay)
-    return df
+    df_delay['year'] = str(year)
+    return df_delay
+
+
+@traced
+def prepare_airline_delay_data(workers=None, use_cube=False):
+    """
+    This function returns the delay data for different airlines. With workers > 1, the years are prepared in a pool of
+    worker processes. With use_cube, the data is answered from the aggregate cube.
+    @param workers: the number of worker processes, the data is prepared in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the delay dataFrame
+    @rtype: pd.DataFrame
+    """
+    results = map_in_order(prepare_airline_delay_by_year, [(year, use_cube) for year in constants.YEAR_LIST], workers)
+    return accumulate(results)
 
 
 def total_delay(df):
@@ -46,6 +74,22 @@ def total_delay(df):
     return df_airline_avg_delay
 
 
+def total_delay_from_cube(df_cube):
+    """
+    This function is the same as total_delay, but it answers from the aggregate cube.
+    @param df_cube: input aggregate cube dataFrame
+    @type df_cube: pd.DataFrame
+    @return: the dataFrame which shows the average the delay for different airlines
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+
+    df_airline_merge_delay = rollup(df_cube, ['OP_CARRIER'], {'flown': 'counts', 'total_delay_sum': 'total delay'})
+    df_airline_merge_delay = df_airline_merge_delay.sort_values('counts', ascending=False, kind='stable')
+    df_airline_avg_delay = average(df_airline_merge_delay, 'total delay', 'counts')
+    return df_airline_avg_delay[['OP_CARRIER', 'total delay', 'counts']].reset_index(drop=True)
+
+
 def get_airline_route_by_state(df_origin, df_dest, airline):
     """
     This function takes all of the origin flights and destination flights as input. It calculates the distribution of
@@ -64,8 +108,8 @@ def get_airline_route_by_state(df_origin, df_dest, airline):
     assert isinstance(df_dest, pd.DataFrame)
     assert isinstance(airline, str)
 
-    us_division = read_csv_file(constants.US_REGION_DIVISION_DATA_PATH)
-    df_us_airport = read_csv_file(constants.CLEANED_AIRPORT_DATA_PATH)
+    us_division = get_us_regions()
+    df_us_airport = get_us_airports()
 
     df_airport_origin_cnts  = df_origin[df_origin['OP_CARRIER']==airline]['ORIGIN']\
         .value_counts().rename_axis('iata_code').reset_index(name='origin_counts')
@@ -81,24 +125,115 @@ def get_airline_route_by_state(df_origin, df_dest, airline):
     return df_region_route_cnts
 
 
-def count_cancellation_by_airline():
+@traced
+def count_routes_by_region_and_year(year, use_cube=False):
     """
-    This function returns the statistics for cancellation reasons and cancellation records for
-    different airlines
-    @return: None
-    @rtype: None
+    This function counts the flight routes of every airline in every region in the given year, where a flight counts
+    once for the region of its origin airport and once for the region of its destination airport, as in
+    get_airline_route_by_state. The airlines and the airport regions are coded as integers and all of the
+    (airline, region) counts are summed by one bincount, so the cost does not grow with the number of airlines. It is a
+    module-level function so that it can run in a worker process.
+    @param year: input year
+    @type year: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the dataFrame with the columns ['OP_CARRIER', 'Region', 'route_counts']
+    @rtype: pd.DataFrame
     """
-    cancel_airline = pd.DataFrame()
-    for year in constants.YEAR_LIST:
-        df_cur = get_flight_data_by_year(year, [])
+    assert isinstance(year, int)
+
+    if use_cube:
+        df_routes = rollup(build_cube(year), ['OP_CARRIER', 'ORIGIN', 'DEST'], {'flights': 'flights'})
+        weights = df_routes['flights'].to_numpy(dtype=np.float64)
+    else:
+        df_routes = get_flight_data_by_year(year, ['OP_CARRIER', 'ORIGIN', 'DEST'])
+        weights = np.ones(len(df_routes))
+
+    carrier_codes, carriers = pd.factorize(df_routes['OP_CARRIER'], sort=True)
+    iata_index, _, airport_regions = get_iata_lookup()
+    region_codes, regions = pd.factorize(airport_regions, sort=True)
+    route_counts = np.zeros(len(carriers) * len(regions))
+    for airport_type in ['ORIGIN', 'DEST']:
+        airport_idx = get_airport_positions(df_routes[airport_type], iata_index)
+        region = np.where(airport_idx >= 0, region_codes[airport_idx], -1)
+        known = (region >= 0) & (carrier_codes >= 0)
+        route_counts += np.bincount(carrier_codes[known] * len(regions) + region[known], weights=weights[known],
+                                    minlength=len(route_counts))
 
-        df_airline = df_cur['OP_CARRIER'].value_counts().rename_axis('OP_CARRIER').reset_index(name='total_cnts')
+    df_route_cnts = pd.DataFrame({'OP_CARRIER': np.repeat(np.asarray(carriers, dtype=object), len(regions)),
+                                  'Region': np.tile(np.asarray(regions, dtype=object), len(carriers)),
+                                  'route_counts': route_counts.astype(np.int64)})
+    return df_route_cnts[df_route_cnts['route_counts'] > 0].reset_index(drop=True)
+
+
+@traced
+def count_routes_by_region(years=None, workers=None, use_cube=False):
+    """
+    This function returns the route counts of count_routes_by_region_and_year for all airlines and regions summed over
+    the given years. With workers > 1, the years are counted in a pool of worker processes.
+    For example, the 2018 route distribution of "AA" over the regions is
+    df_routes = count_routes_by_region([2018])
+    df_routes[df_routes['OP_CARRIER'] == 'AA']
+    @param years: the years, all of the years in constants.YEAR_LIST if it is None
+    @type years: list
+    @param workers: the number of worker processes, the data is counted in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the dataFrame with the columns ['OP_CARRIER', 'Region', 'route_counts'] sorted by the airline and region
+    @rtype: pd.DataFrame
+    """
+    if years is None:
+        years = constants.YEAR_LIST
+    assert isinstance(years, list)
+
+    results = map_in_order(count_routes_by_region_and_year, [(year, use_cube) for year in years], workers)
+    df_route_cnts = accumulate(results, keys=['OP_CARRIER', 'Region'])
+    return df_route_cnts.sort_values(['OP_CARRIER', 'Region']).reset_index(drop=True)
+
+
+def count_cancellation_by_airline_and_year(year, use_cube=False):
+    """
+    This function returns the statistics for cancellation records for different airlines in the given year.
+    @param year: input year
+    @type year: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the cancellation rate dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(year, int)
+
+    if use_cube:
+        df_cube = build_cube(year)
+        df_airline = rollup(df_cube, ['OP_CARRIER'], {'flights': 'total_cnts'}) \
+            .sort_values('total_cnts', ascending=False, kind='stable')
+        df_cancel_airline = rollup(df_cube, ['OP_CARRIER'], {'cancelled': 'cancellation_cnts'}) \
+            .sort_values('cancellation_cnts', ascending=False, kind='stable')
+    else:
+        df_cur = get_flight_data_by_year(year, [])
+        df_airline = count(df_cur, 'OP_CARRIER', 'total_cnts')
         df_cancel = df_cur[df_cur['CANCELLED'] != 0]
-        df_cancel_airline = df_cancel['OP_CARRIER'].value_counts().rename_axis('OP_CARRIER').reset_index(
-            name='cancellation_cnts')
-        df_cancel_rate_airline = pd.merge(df_airline, df_cancel_airline, on='OP_CARRIER')
-        df_cancel_rate_airline['cancellation_ratio'] = df_cancel_rate_airline['cancellation_cnts'] / \
-                                                       df_cancel_rate_airline['total_cnts']
-        df_cancel_rate_airline['year'] = year
-        cancel_airline = cancel_airline.append(df_cancel_rate_airline.reset_index(drop=True))
-    return cancel_airline
\ No newline at end of file
+        df_cancel_airline = count(df_cancel, 'OP_CARRIER', 'cancellation_cnts')
+    df_cancel_rate_airline = pd.merge(df_airline, df_cancel_airline, on='OP_CARRIER')
+    df_cancel_rate_airline['cancellation_ratio'] = df_cancel_rate_airline['cancellation_cnts'] / \
+                                                   df_cancel_rate_airline['total_cnts']
+    df_cancel_rate_airline['year'] = year
+    return df_cancel_rate_airline.reset_index(drop=True)
+
+
+def count_cancellation_by_airline(workers=None, use_cube=False):
+    """
+    This function returns the statistics for cancellation reasons and cancellation records for
+    different airlines. With workers > 1, the years are counted in a pool of worker processes. With use_cube, the
+    statistics are answered from the aggregate cube.
+    @param workers: the number of worker processes, the data is counted in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the cancellation rate dataFrame
+    @rtype: pd.DataFrame
+    """
+    results = map_in_order(count_cancellation_by_airline_and_year,
+                           [(year, use_cube) for year in constants.YEAR_LIST], workers)
+    return accumulate(results)
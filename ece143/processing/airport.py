@@ -1,7 +1,15 @@
 from processing import constants
+import numpy as np
 import pandas as pd
-from processing.operations import count, aggregate, average, merge,read_csv_file
-from processing.flight import get_flight_data_by_year, get_flight_data_by_month
+from processing.operations import count, aggregate, average, merge, accumulate, count_partitioned, \
+    count_and_aggregate_partitioned
+from processing.flight import get_flight_data_by_year, get_flight_data_by_month, build_month_store, \
+    iter_flight_data_by_year, iter_flight_data_by_month
+from processing.cache import HAS_PARQUET
+from processing.reference import get_us_airports
+from processing.cube import load_cube, build_cube, rollup
+from processing.parallel import map_in_order
+from processing.trace import traced
 
 
 def extract_us_airport(df):
@@ -26,6 +34,7 @@ def extract_us_airport(df):
     return df_airport
 
 
+@traced
 def prepare_delay(df, direction):
     """
     This function is used to prepare delay data used for flight analysis in terms of airports and states. Specially, the
@@ -51,7 +60,6 @@ def prepare_delay(df, direction):
         count_type = "DEST_COUNT"
 
     df_delay = df[df['CANCELLED'] != 1]
-    df_us_airport = read_csv_file(constants.CLEANED_AIRPORT_DATA_PATH)
 
     # ORIGIN counts_origin
     df_cnts = count(df_delay, airport_type, count_type)
@@ -61,6 +69,34 @@ def prepare_delay(df, direction):
 
     # ORIGIN DEP_DELAY counts_origin
     df_delay_cnts = merge(df_cnts, df_delay_cnts, airport_type, airport_type)
+    return summarize_delay(df_delay_cnts, direction)
+
+
+def summarize_delay(df_delay_cnts, direction):
+    """
+    This function takes the flight counts and the total delay of each airport, and returns the average delay data for
+    the airports and states. It is shared by prepare_delay and prepare_delay_from_cube.
+    @param df_delay_cnts: input dataFrame with the airport, count and total delay columns, e.g.
+    ['ORIGIN', 'ORIGIN_COUNT', 'DEP_DELAY']
+    @type df_delay_cnts: pd.DataFrame
+    @param direction: input direction for analysis
+    @type direction: str
+    @return: delay dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_delay_cnts, pd.DataFrame)
+    assert direction == constants.DIRECTION_ARRIVAL or direction == constants.DIRECTION_DEPARTURE
+
+    if direction == constants.DIRECTION_DEPARTURE:
+        airport_type = 'ORIGIN'
+        delay_type = 'DEP_DELAY'
+        count_type = "ORIGIN_COUNT"
+    elif direction == constants.DIRECTION_ARRIVAL:
+        airport_type = 'DEST'
+        delay_type = 'ARR_DELAY'
+        count_type = "DEST_COUNT"
+
+    df_us_airport = get_us_airports()
     # flights>50
     df_delay_cnts = df_delay_cnts[df_delay_cnts[count_type] > 50]
 
@@ -68,12 +104,12 @@ def prepare_delay(df, direction):
     df_delay_by_airport = merge(df_us_airport, df_delay_cnts, 'iata_code', airport_type).dropna()
     # state total DEP_DELAY
     df_delay_by_state = df_delay_by_airport.groupby(['iso_region']) \
-        .agg({delay_type: sum}) \
+        .agg({delay_type: 'sum'}) \
         .rename_axis('iso_region') \
         .reset_index()
     # state flights
     df_cnts_by_state = df_delay_by_airport.groupby(['iso_region']) \
-        .agg({count_type: sum}) \
+        .agg({count_type: 'sum'}) \
         .rename_axis('iso_region') \
         .reset_index()
 
@@ -89,6 +125,7 @@ def prepare_delay(df, direction):
     return df_delay_by_airport, df_delay_by_state
 
 
+@traced
 def prepare_count(df, direction):
     """
     This function is used to prepare flight count data used for flight analysis in terms of airports and states.
@@ -112,14 +149,39 @@ def prepare_count(df, direction):
         count_type = "DEST_COUNT"
 
     df_delay = df[df['CANCELLED'] != 1]
-    df_us_airport = read_csv_file(constants.CLEANED_AIRPORT_DATA_PATH)
 
     df_origin_counts = count(df_delay, airport_type, count_type)
+    return summarize_count(df_origin_counts, direction)
+
+
+def summarize_count(df_origin_counts, direction):
+    """
+    This function takes the flight counts of each airport, and returns the flight count data for the airports and
+    states. It is shared by prepare_count and prepare_count_from_cube.
+    @param df_origin_counts: input dataFrame with the airport and count columns, e.g. ['ORIGIN', 'ORIGIN_COUNT']
+    @type df_origin_counts: pd.DataFrame
+    @param direction: input direction for analysis
+    @type direction: str
+    @return: count dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_origin_counts, pd.DataFrame)
+    assert direction == constants.DIRECTION_ARRIVAL or direction == constants.DIRECTION_DEPARTURE
+
+    if direction == constants.DIRECTION_DEPARTURE:
+        airport_type = 'ORIGIN'
+        count_type = "ORIGIN_COUNT"
+    elif direction == constants.DIRECTION_ARRIVAL:
+        airport_type = 'DEST'
+        count_type = "DEST_COUNT"
+
+    df_us_airport = get_us_airports()
     df_origin = merge(df_us_airport, df_origin_counts, 'iata_code', airport_type).dropna()
     df_origin_by_state = aggregate(df_origin, 'iso_region', count_type)
     return df_origin, df_origin_by_state
 
 
+@traced
 def prepare_throughput(df):
     """
     This function is used to prepare throughput count data used for flight analysis in terms of airports and states.
@@ -132,6 +194,25 @@ def prepare_throughput(df):
 
     df_dep_cnts_by_airport, df_dep_cnts_by_state = prepare_count(df, constants.DIRECTION_DEPARTURE)
     df_arr_cnts_by_airport, df_arr_cnts_by_state = prepare_count(df, constants.DIRECTION_ARRIVAL)
+    return summarize_throughput(df_dep_cnts_by_airport, df_dep_cnts_by_state,
+                                df_arr_cnts_by_airport, df_arr_cnts_by_state)
+
+
+def summarize_throughput(df_dep_cnts_by_airport, df_dep_cnts_by_state, df_arr_cnts_by_airport, df_arr_cnts_by_state):
+    """
+    This function combines the departure and arrival flight count data into the throughput data for the airports and
+    states.
+    @param df_dep_cnts_by_airport: departure flight count data for the airports
+    @type df_dep_cnts_by_airport: pd.DataFrame
+    @param df_dep_cnts_by_state: departure flight count data for the states
+    @type df_dep_cnts_by_state: pd.DataFrame
+    @param df_arr_cnts_by_airport: arrival flight count data for the airports
+    @type df_arr_cnts_by_airport: pd.DataFrame
+    @param df_arr_cnts_by_state: arrival flight count data for the states
+    @type df_arr_cnts_by_state: pd.DataFrame
+    @return: throughput dataFrame
+    @rtype: pd.DataFrame
+    """
     df_throughput_by_state = pd.merge(df_dep_cnts_by_state, df_arr_cnts_by_state, on='iso_region')
     df_throughput_by_state[constants.TARGET_COUNT] = df_throughput_by_state['ORIGIN_COUNT'] + df_throughput_by_state['DEST_COUNT']
 
@@ -141,18 +222,291 @@ def prepare_throughput(df):
     return df_throughput, df_throughput_by_state
 
 
-def data_prepare(target, direction, dtime):
+@traced
+def prepare_delay_from_cube(df_cube, direction):
+    """
+    This function is the same as prepare_delay, but it answers from the aggregate cube of the time slice instead of
+    the raw flights.
+    @param df_cube: input aggregate cube dataFrame
+    @type df_cube: pd.DataFrame
+    @param direction: input direction for analysis
+    @type direction: str
+    @return: delay dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+    assert direction == constants.DIRECTION_ARRIVAL or direction == constants.DIRECTION_DEPARTURE
+
+    if direction == constants.DIRECTION_DEPARTURE:
+        df_delay_cnts = rollup(df_cube, ['ORIGIN'], {'flown': 'ORIGIN_COUNT', 'dep_delay_sum': 'DEP_DELAY'})
+    elif direction == constants.DIRECTION_ARRIVAL:
+        df_delay_cnts = rollup(df_cube, ['DEST'], {'flown': 'DEST_COUNT', 'arr_delay_sum': 'ARR_DELAY'})
+    return summarize_delay(df_delay_cnts, direction)
+
+
+@traced
+def prepare_count_from_cube(df_cube, direction):
+    """
+    This function is the same as prepare_count, but it answers from the aggregate cube of the time slice instead of
+    the raw flights.
+    @param df_cube: input aggregate cube dataFrame
+    @type df_cube: pd.DataFrame
+    @param direction: input direction for analysis
+    @type direction: str
+    @return: count dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+    assert direction == constants.DIRECTION_ARRIVAL or direction == constants.DIRECTION_DEPARTURE
+
+    if direction == constants.DIRECTION_DEPARTURE:
+        df_origin_counts = rollup(df_cube, ['ORIGIN'], {'flown': 'ORIGIN_COUNT'})
+    elif direction == constants.DIRECTION_ARRIVAL:
+        df_origin_counts = rollup(df_cube, ['DEST'], {'flown': 'DEST_COUNT'})
+    return summarize_count(df_origin_counts, direction)
+
+
+@traced
+def prepare_throughput_from_cube(df_cube):
+    """
+    This function is the same as prepare_throughput, but it answers from the aggregate cube of the time slice instead
+    of the raw flights.
+    @param df_cube: input aggregate cube dataFrame
+    @type df_cube: pd.DataFrame
+    @return: throughput dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+
+    df_dep_cnts_by_airport, df_dep_cnts_by_state = prepare_count_from_cube(df_cube, constants.DIRECTION_DEPARTURE)
+    df_arr_cnts_by_airport, df_arr_cnts_by_state = prepare_count_from_cube(df_cube, constants.DIRECTION_ARRIVAL)
+    return summarize_throughput(df_dep_cnts_by_airport, df_dep_cnts_by_state,
+                                df_arr_cnts_by_airport, df_arr_cnts_by_state)
+
+
+def get_cube_time_slice(df_cube, dtime, i):
+    """
+    This function selects the ith year or month of the aggregate cube.
+    @param df_cube: input aggregate cube dataFrame of all years
+    @type df_cube: pd.DataFrame
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param i: the year or month index
+    @type i: int
+    @return: the cube dataFrame of the time slice
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
+    assert isinstance(i, int)
+
+    if dtime == constants.TIME_YEAR:
+        return df_cube[df_cube['year'] == constants.YEAR_LIST[i]]
+    return df_cube[df_cube['month'] == constants.MONTH_LIST[i]]
+
+
+@traced
+def prepare_time_slice(target, direction, dtime, i, df_cube=None, chunk_rows=None):
+    """
+    This function prepares the data of the ith year or month for data_prepare. It is a module-level function so that
+    it can run in a worker process.
+    @param target: the input target str specifying which target we want to get data for: delay, count, throughput
+    @type target: str
+    @param direction: the input direction specifying whether we want to get data for "DEPARTURE" or "ARRIVAL" flights.
+    @type direction: str
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param i: the year or month index
+    @type i: int
+    @param df_cube: the aggregate cube of all years, the raw flights are read if it is None
+    @type df_cube: pd.DataFrame
+    @param chunk_rows: the number of flights read at a time by prepare_time_slice_partitioned, the whole time slice is
+    read at once if it is None
+    @type chunk_rows: int
+    @return: the airport dataFrame and the state dataFrame
+    @rtype: tuple
+    """
+    assert isinstance(i, int)
+    assert df_cube is None or isinstance(df_cube, pd.DataFrame)
+
+    if df_cube is None and chunk_rows is not None:
+        return prepare_time_slice_partitioned(target, direction, dtime, i, chunk_rows)
+    if df_cube is not None:
+        df_cube_slice = get_cube_time_slice(df_cube, dtime, i)
+    else:
+        df_flight = get_flight_time_slice(dtime, i)
+
+    # decide which target we need analyze
+    if df_cube is not None and target == constants.TARGET_DELAY:
+        df, df_state = prepare_delay_from_cube(df_cube_slice, direction)
+    elif df_cube is not None and target == constants.TARGET_COUNT:
+        df, df_state = prepare_count_from_cube(df_cube_slice, direction)
+    elif df_cube is not None and target == constants.TARGET_THROUGHPUT:
+        df, df_state = prepare_throughput_from_cube(df_cube_slice)
+    elif target == constants.TARGET_DELAY:
+        df, df_state = prepare_delay(df_flight, direction)
+    elif target == constants.TARGET_COUNT:
+        df, df_state = prepare_count(df_flight, direction)
+    elif target == constants.TARGET_THROUGHPUT:
+        df, df_state = prepare_throughput(df_flight)
+    else:
+        print('ERROR!')
+
+    return df, df_state
+
+
+def get_flight_time_slice(dtime, i):
+    """
+    This function reads the flights of the ith year or month with the columns used by the airport analysis.
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param i: the year or month index
+    @type i: int
+    @return: flight dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
+    assert isinstance(i, int)
+
+    used_cols = ['FL_DATE', 'ORIGIN', 'DEST', 'DEP_DELAY', 'ARR_DELAY', 'CANCELLED']
+    if dtime == constants.TIME_YEAR:
+        return get_flight_data_by_year(constants.YEAR_LIST[i], used_cols)
+    return get_flight_data_by_month(i, used_cols)
+
+
+def iter_flown_time_slice(dtime, i, chunk_rows):
+    """
+    This function yields the flights not cancelled of the ith year or month in chunks of at most chunk_rows flights.
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param i: the year or month index
+    @type i: int
+    @param chunk_rows: the maximum number of flights of each chunk
+    @type chunk_rows: int
+    @return: generator of flight dataFrames
+    @rtype: generator
+    """
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
+    assert isinstance(i, int)
+
+    used_cols = ['ORIGIN', 'DEST', 'DEP_DELAY', 'ARR_DELAY', 'CANCELLED']
+    if dtime == constants.TIME_YEAR:
+        chunks = iter_flight_data_by_year(constants.YEAR_LIST[i], used_cols, chunk_rows)
+    else:
+        chunks = iter_flight_data_by_month(i, used_cols, chunk_rows)
+    for df in chunks:
+        yield df[df['CANCELLED'] != 1]
+
+
+@traced
+def prepare_time_slice_partitioned(target, direction, dtime, i, chunk_rows):
+    """
+    This function is the same as prepare_time_slice, but it streams the flights of the ith year or month in chunks of
+    chunk_rows flights and only keeps the counts and the delay sums of each airport, so the memory is bounded by the
+    chunk size instead of the time slice. The results are the same as prepare_time_slice up to the order of the
+    airports with the same count. The throughput streams the flights once for each direction.
+    @param target: the input target str specifying which target we want to get data for: delay, count, throughput
+    @type target: str
+    @param direction: the input direction specifying whether we want to get data for "DEPARTURE" or "ARRIVAL" flights.
+    @type direction: str
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param i: the year or month index
+    @type i: int
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: the airport dataFrame and the state dataFrame
+    @rtype: tuple
+    """
+    assert isinstance(chunk_rows, int) and chunk_rows > 0
+
+    if direction == constants.DIRECTION_DEPARTURE:
+        airport_type, delay_type, count_type = 'ORIGIN', 'DEP_DELAY', 'ORIGIN_COUNT'
+    elif direction == constants.DIRECTION_ARRIVAL:
+        airport_type, delay_type, count_type = 'DEST', 'ARR_DELAY', 'DEST_COUNT'
+
+    if target == constants.TARGET_DELAY:
+        df_delay_cnts = count_and_aggregate_partitioned(iter_flown_time_slice(dtime, i, chunk_rows), airport_type,
+                                                        delay_type, count_type)
+        return summarize_delay(df_delay_cnts, direction)
+    if target == constants.TARGET_COUNT:
+        df_cnts = count_partitioned(iter_flown_time_slice(dtime, i, chunk_rows), airport_type, count_type)
+        return summarize_count(df_cnts, direction)
+    df_dep_cnts = count_partitioned(iter_flown_time_slice(dtime, i, chunk_rows), 'ORIGIN', 'ORIGIN_COUNT')
+    df_arr_cnts = count_partitioned(iter_flown_time_slice(dtime, i, chunk_rows), 'DEST', 'DEST_COUNT')
+    return summarize_throughput(*summarize_count(df_dep_cnts, constants.DIRECTION_DEPARTURE),
+                                *summarize_count(df_arr_cnts, constants.DIRECTION_ARRIVAL))
+
+
+@traced
+def prepare_all_time_slice(dtime, i, df_cube=None):
+    """
+    This function prepares the data of all targets and both directions for the ith year or month in one scan of the
+    flights. The flights not cancelled are counted and their delays summed once for each direction, and the
+    throughput is combined from the two count results.
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param i: the year or month index
+    @type i: int
+    @param df_cube: the aggregate cube of all years, the raw flights are read if it is None
+    @type df_cube: pd.DataFrame
+    @return: the mapping of (target, direction) to the airport dataFrame and the state dataFrame
+    @rtype: dict
+    """
+    assert isinstance(i, int)
+    assert df_cube is None or isinstance(df_cube, pd.DataFrame)
+
+    if df_cube is not None:
+        df_cube_slice = get_cube_time_slice(df_cube, dtime, i)
+    else:
+        df_flight = get_flight_time_slice(dtime, i)
+        df_flown = df_flight[df_flight['CANCELLED'] != 1]
+
+    results = {}
+    counts = {}
+    for direction, airport_type, delay_type, count_type, delay_sum in [
+            (constants.DIRECTION_DEPARTURE, 'ORIGIN', 'DEP_DELAY', 'ORIGIN_COUNT', 'dep_delay_sum'),
+            (constants.DIRECTION_ARRIVAL, 'DEST', 'ARR_DELAY', 'DEST_COUNT', 'arr_delay_sum')]:
+        if df_cube is not None:
+            df_delay_cnts = rollup(df_cube_slice, [airport_type], {'flown': count_type, delay_sum: delay_type})
+            df_cnts = df_delay_cnts[[airport_type, count_type]]
+        else:
+            df_cnts = count(df_flown, airport_type, count_type)
+            df_delay_cnts = merge(df_cnts, aggregate(df_flown, airport_type, delay_type), airport_type, airport_type)
+        counts[direction] = summarize_count(df_cnts, direction)
+        results[(constants.TARGET_COUNT, direction)] = counts[direction]
+        results[(constants.TARGET_DELAY, direction)] = summarize_delay(df_delay_cnts, direction)
+
+    df_throughput, df_throughput_by_state = summarize_throughput(*counts[constants.DIRECTION_DEPARTURE],
+                                                                 *counts[constants.DIRECTION_ARRIVAL])
+    for direction in [constants.DIRECTION_DEPARTURE, constants.DIRECTION_ARRIVAL]:
+        results[(constants.TARGET_THROUGHPUT, direction)] = (df_throughput.copy(), df_throughput_by_state.copy())
+    return results
+
+
+@traced
+def data_prepare(target, direction, dtime, workers=None, use_cube=False, chunk_rows=None):
     """
     This function is the interface function for the client to use to get data when specifying different parameters.
     For example:
     delay_airports, delay_states = data_prepare(constants.TARGET_DELAY, constants.DIRECTION_DEPARTURE, constants.TIME_YEAR)
     will return the yearly delay data for both the airports and states.
+    With workers > 1, the years or months are prepared in a pool of worker processes, and the lists keep the same order.
+    With use_cube, the data is answered from the pre-aggregated cube (see processing.cube), which is built once per
+    version of the flight files, instead of the raw flights. With chunk_rows, the raw flights are streamed in chunks of
+    chunk_rows flights instead of loading each year or month, which bounds the memory of each worker.
     @param target: the input target str specifying which target we want to get data for: delay, count, throughput
     @type target: str
     @param direction: the input direction specifying whether we want to get data for "DEPARTURE" or "ARRIVAL" flights.
     @type direction: str
     @param dtime: specifying whether we want to get yearly data or monthly data
     @type dtime: str
+    @param workers: the number of worker processes, the data is prepared in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @param chunk_rows: the number of flights read at a time, the whole year or month is read at once if it is None
+    @type chunk_rows: int
     @return: dataFrame
     @rtype: pd.DataFrame
     """
@@ -163,87 +517,173 @@ def data_prepare(target, direction, dtime):
     assert direction == constants.DIRECTION_ARRIVAL or direction == constants.DIRECTION_DEPARTURE
     assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
 
-    df_by_airport = []
-    df_by_state = []
-    used_cols = ['FL_DATE', 'ORIGIN', 'DEST', 'DEP_DELAY', 'ARR_DELAY', 'CANCELLED']
-    if direction == constants.DIRECTION_DEPARTURE:
-        count_type = "ORIGIN_COUNT"
-    elif direction == constants.DIRECTION_ARRIVAL:
-        count_type = "DEST_COUNT"
-
     if dtime == constants.TIME_YEAR:
-        max_iter = 10
+        max_iter = len(constants.YEAR_LIST)
     else:
-        max_iter = 12
-    for i in range(max_iter):
-        if dtime == constants.TIME_YEAR:
-            df_flight = get_flight_data_by_year(i + constants.YEAR_LIST[0], used_cols)
-        else:
-            df_flight = get_flight_data_by_month(i, used_cols)
-
-        # decide which target we need analyze
-        if target == constants.TARGET_DELAY:
-            df, df_state = prepare_delay(df_flight, direction)
-        elif target == constants.TARGET_COUNT:
-            df, df_state = prepare_count(df_flight, direction)
-        elif target == constants.TARGET_THROUGHPUT:
-            df, df_state = prepare_throughput(df_flight)
-        else:
-            print('ERROR!')
-
-        # add information for hover text
-        df['text'] = 'Airport Name: ' + df['name'] + ' (' + df['iata_code'] + ')' + \
-                     '<br>' + 'Type: ' + df['type'].str.replace('_', ' ').str.title() + \
-                     '<br>' + 'Municipality: ' + df['municipality'] + \
-                     '<br>' + 'State: ' + df['iso_region'] + \
-                     '<br>' + 'Flights: ' + df[count_type].astype(str)
-        if target == constants.TARGET_DELAY and direction == constants.DIRECTION_DEPARTURE:
-            df['text'] = df['text'] + '<br>' + 'Departure Delay (Min): ' + round(df['DEP_DELAY'], 2).astype(str)
-        elif target == constants.TARGET_DELAY and direction == constants.DIRECTION_ARRIVAL:
-            df['text'] = df['text'] + '<br>' + 'Arrive Delay (Min): ' + round(df['ARR_DELAY'], 2).astype(str)
-        df['size'] = list(map(lambda x: constants.TYPES[x], df['type']))
-        df_by_airport.append(df)
-        df_by_state.append(df_state)
+        max_iter = len(constants.MONTH_LIST)
+    if use_cube:
+        # the cube is small, so the slices are prepared in this process
+        df_cube = load_cube(workers=workers)
+        results = [prepare_time_slice(target, direction, dtime, i, df_cube) for i in range(max_iter)]
+    else:
+        if dtime == constants.TIME_MONTH and workers and workers > 1 and HAS_PARQUET and constants.USE_FLIGHT_CACHE \
+                and chunk_rows is None:
+            # build the month partitions once instead of in every worker
+            build_month_store(workers)
+        results = map_in_order(prepare_time_slice, [(target, direction, dtime, i, None, chunk_rows)
+                                                    for i in range(max_iter)], workers)
+    df_by_airport = [df for df, _ in results]
+    df_by_state = [df_state for _, df_state in results]
     return df_by_airport, df_by_state
 
 
-def count_cancellation_by_airport():
-    """
-    This function returns the statistics for cancellation reasons and cancellation records for different airports
-    """
-    code_a = []
-    code_b = []
-    code_c = []
-    code_d = []
-    all_records = pd.DataFrame()
-    cancel_records = pd.DataFrame()
-
-    df_us_airport = read_csv_file(constants.CLEANED_AIRPORT_DATA_PATH)
-
-    for year in constants.YEAR_LIST:
-        df_cur = get_flight_data_by_year(year, [])
-
-        df_all = df_cur[['FL_DATE', 'ORIGIN']]
-        df_all['month'] = df_all['FL_DATE'].str.split('-').str[1]
-        df_all = merge(df_us_airport, df_all, 'iata_code', 'ORIGIN')
-        df_all = df_all[['iso_region', 'month']].dropna()
-        df_all = df_all.groupby(['iso_region', 'month']).size().reset_index(name='counts')
-        all_records = all_records.append(df_all)
-        del df_all
-
-        df_cancel = df_cur[df_cur['CANCELLED'] != 0]
-        df_cancel = merge(df_us_airport, df_cancel, 'iata_code', 'ORIGIN')
-        df_cancel = df_cancel[['FL_DATE', 'iso_region', 'CANCELLATION_CODE']].dropna()
-        df_cancel['FL_DATE'] = df_cancel['FL_DATE'].str.rsplit(pat='-', n=1).str[0]
-
-        a = df_cancel[df_cancel['CANCELLATION_CODE'] == 'A'].shape[0]
-        b = df_cancel[df_cancel['CANCELLATION_CODE'] == 'B'].shape[0]
-        c = df_cancel[df_cancel['CANCELLATION_CODE'] == 'C'].shape[0]
-        d = df_cancel[df_cancel['CANCELLATION_CODE'] == 'D'].shape[0]
-        code_a.append(a)
-        code_b.append(b)
-        code_c.append(c)
-        code_d.append(d)
-        cancel_records = cancel_records.append(df_cancel.reset_index(drop=True))
+def to_month_string(month):
+    """
+    This function maps the integer month column to the month strings in constants.MONTH_LIST, e.g. 1 => '01'.
+    @param month: the integer month column
+    @type month: pd.Series
+    @return: the month string column
+    @rtype: pd.Series
+    """
+    assert isinstance(month, pd.Series)
+
+    return pd.Series(np.array(constants.MONTH_LIST, dtype=object)[month.to_numpy(dtype=np.int64) - 1],
+                     index=month.index)
+
+
+def count_cancellation_by_airport_and_year(year, df_us_airport, use_cube=False):
+    """
+    This function returns the statistics for cancellation reasons and cancellation records for different airports in
+    the given year.
+    @param year: input year
+    @type year: int
+    @param df_us_airport: the cleaned US airport data
+    @type df_us_airport: pd.DataFrame
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: all records, cancellation records and the counts of the cancellation codes A, B, C and D. The month columns
+    are the strings in constants.MONTH_LIST, and the FL_DATE column of the cancellation records is e.g. '2009-01'.
+    @rtype: tuple
+    """
+    assert isinstance(year, int)
+    assert isinstance(df_us_airport, pd.DataFrame)
+
+    if use_cube:
+        return count_cancellation_by_airport_from_cube(build_cube(year), year, df_us_airport)
+
+    df_cur = get_flight_data_by_year(year, ['ORIGIN', 'month', 'CANCELLED', 'CANCELLATION_CODE'])
+
+    df_all = merge(df_us_airport, df_cur[['ORIGIN', 'month']], 'iata_code', 'ORIGIN')
+    df_all = df_all[['iso_region', 'month']].dropna()
+    df_all = df_all.groupby(['iso_region', 'month']).size().reset_index(name='counts')
+    df_all['month'] = to_month_string(df_all['month'])
+
+    df_cancel = df_cur[df_cur['CANCELLED'] != 0]
+    df_cancel = merge(df_us_airport, df_cancel, 'iata_code', 'ORIGIN')
+    df_cancel = df_cancel[['month', 'iso_region', 'CANCELLATION_CODE']].dropna()
+    df_cancel['month'] = to_month_string(df_cancel['month'])
+    df_cancel.insert(0, 'FL_DATE', str(year) + '-' + df_cancel['month'].astype(str))
+    df_cancel = df_cancel[['FL_DATE', 'iso_region', 'CANCELLATION_CODE', 'month']]
+
+    # count the four codes in one pass
+    code_counts = df_cancel['CANCELLATION_CODE'].value_counts()
+    a, b, c, d = [int(code_counts.get(code, 0)) for code in ['A', 'B', 'C', 'D']]
+    return df_all, df_cancel.reset_index(drop=True), a, b, c, d
+
+
+def count_cancellation_by_airport_from_cube(df_cube, year, df_us_airport):
+    """
+    This function is the same as count_cancellation_by_airport_and_year, but it answers from the aggregate cube of the
+    given year. The cancellation records are expanded from the cube cells, so they are the same as the raw records
+    up to the row order.
+    @param df_cube: input aggregate cube dataFrame of the year
+    @type df_cube: pd.DataFrame
+    @param year: input year
+    @type year: int
+    @param df_us_airport: the cleaned US airport data
+    @type df_us_airport: pd.DataFrame
+    @return: all records, cancellation records and the counts of the cancellation codes A, B, C and D
+    @rtype: tuple
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+    assert isinstance(year, int)
+    assert isinstance(df_us_airport, pd.DataFrame)
+
+    codes = ['A', 'B', 'C', 'D']
+    df_region = df_us_airport[['iata_code', 'iso_region']].dropna()
+
+    df_all = rollup(df_cube, ['ORIGIN', 'month'], {'flights': 'counts'})
+    df_all = pd.merge(df_region, df_all, left_on='iata_code', right_on='ORIGIN')
+    df_all = df_all.groupby(['iso_region', 'month'])['counts'].sum().reset_index()
+
+    measures = {'cancelled': 'cancelled'}
+    measures.update({'code_' + code: code for code in codes})
+    df_codes = rollup(df_cube, ['ORIGIN', 'month'], measures)
+    df_codes = pd.merge(df_region, df_codes, left_on='iata_code', right_on='ORIGIN')
+    df_cancel = df_codes.melt(id_vars=['iso_region', 'month'], value_vars=codes,
+                              var_name='CANCELLATION_CODE', value_name='n')
+    df_cancel = df_cancel.loc[df_cancel.index.repeat(df_cancel['n'])]
+    df_cancel['FL_DATE'] = str(year) + '-' + df_cancel['month']
+    df_cancel = df_cancel[['FL_DATE', 'iso_region', 'CANCELLATION_CODE', 'month']].reset_index(drop=True)
+
+    a, b, c, d = [int(df_codes[code].sum()) for code in codes]
+    return df_all, df_cancel, a, b, c, d
+
+
+def count_cancellation_by_airport(workers=None, use_cube=False):
+    """
+    This function returns the statistics for cancellation reasons and cancellation records for different airports.
+    With workers > 1, the years are counted in a pool of worker processes. With use_cube, the statistics are answered
+    from the aggregate cube.
+    @param workers: the number of worker processes, the data is counted in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    """
+    df_us_airport = get_us_airports()
+
+    results = map_in_order(count_cancellation_by_airport_and_year,
+                           [(year, df_us_airport, use_cube) for year in constants.YEAR_LIST], workers)
+    df_all_list, df_cancel_list, code_a, code_b, code_c, code_d = [list(item) for item in zip(*results)]
+    # the flight counts of the years are summed by state and month as they are collected
+    all_records = accumulate(df_all_list, keys=['iso_region', 'month'])
+    cancel_records = accumulate(df_cancel_list)
     return all_records, cancel_records, code_a, code_b, code_c, code_d
 
+
+@traced
+def data_prepare_all(dtime, workers=None, use_cube=False):
+    """
+    This function is the same as calling data_prepare for all targets and both directions, but it scans the flights
+    of each year or month only once. For example:
+    results = data_prepare_all(constants.TIME_YEAR)
+    delay_airports, delay_states = results[(constants.TARGET_DELAY, constants.DIRECTION_DEPARTURE)]
+    @param dtime: specifying whether we want to get yearly data or monthly data
+    @type dtime: str
+    @param workers: the number of worker processes, the data is prepared in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the mapping of (target, direction) to the list of airport dataFrames and the list of state dataFrames
+    @rtype: dict
+    """
+    assert isinstance(dtime, str)
+    assert dtime == constants.TIME_MONTH or dtime == constants.TIME_YEAR
+
+    if dtime == constants.TIME_YEAR:
+        max_iter = len(constants.YEAR_LIST)
+    else:
+        max_iter = len(constants.MONTH_LIST)
+    if use_cube:
+        df_cube = load_cube(workers=workers)
+        slices = [prepare_all_time_slice(dtime, i, df_cube) for i in range(max_iter)]
+    else:
+        if dtime == constants.TIME_MONTH and workers and workers > 1 and HAS_PARQUET and constants.USE_FLIGHT_CACHE:
+            build_month_store(workers)
+        slices = map_in_order(prepare_all_time_slice, [(dtime, i) for i in range(max_iter)], workers)
+
+    results = {}
+    for key in slices[0]:
+        results[key] = ([results_slice[key][0] for results_slice in slices],
+                        [results_slice[key][1] for results_slice in slices])
+    return results
@@ -0,0 +1,315 @@
+import hashlib
+import os
+import re
+import pandas as pd
+import processing.constants as constants
+from processing.operations import read_csv_file, iter_csv_file, add_date_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def file_signature(csv_file):
+    """
+    This function returns the signature of the given source file, which is the tuple of its absolute path, size and
+    modification time. Any change of the source file changes the signature and thus invalidates the cache.
+    @param csv_file: input csv file path
+    @type csv_file: str
+    @return: the signature of the file
+    @rtype: tuple
+    """
+    assert isinstance(csv_file, str)
+    assert os.path.isfile(csv_file), "ERROR! The csv file does not exist"
+
+    stat = os.stat(csv_file)
+    return os.path.abspath(csv_file), stat.st_size, stat.st_mtime_ns
+
+
+def get_cache_path(csv_file, suffix='.parquet', schema=None):
+    """
+    This function returns the path of the columnar cache file for the given source csv file. The cache file name is
+    made of the source file name and a hash of its signature and read schema, e.g.
+    `./data/cache/2009-1a2b3c4d5e6f.parquet`.
+    @param csv_file: input csv file path
+    @type csv_file: str
+    @param suffix: the suffix of the cache file
+    @type suffix: str
+    @param schema: the schema used to read the csv file
+    @type schema: dict
+    @return: the cache file path
+    @rtype: str
+    """
+    assert isinstance(csv_file, str)
+    assert isinstance(suffix, str)
+    assert schema is None or isinstance(schema, dict)
+
+    key = (file_signature(csv_file), sorted(schema.items()) if schema else None)
+    digest = hashlib.md5(repr(key).encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(csv_file))[0]
+    return constants.CACHE_ROOT + name + '-' + digest + suffix
+
+
+def remove_stale_cache(cache_path):
+    """
+    This function removes the cache files built from older versions of the same source file.
+    @param cache_path: the up-to-date cache file path
+    @type cache_path: str
+    """
+    assert isinstance(cache_path, str)
+
+    cache_dir, cache_name = os.path.split(cache_path)
+    match = re.match(r'^(.*)-[0-9a-f]{12}(\..*)$', cache_name)
+    assert match, "ERROR! Not a cache file path"
+    pattern = re.compile('^' + re.escape(match.group(1)) + r'-[0-9a-f]{12}' + re.escape(match.group(2)) + '$')
+    for name in os.listdir(cache_dir):
+        if name != cache_name and pattern.match(name):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                # removed by another process at the same time
+                pass
+
+
+def write_cache(df, cache_path, partition_col=None):
+    """
+    This function writes the dataFrame to the given cache path. The file is first written to a temporary file and then
+    renamed so that a concurrent reader never sees a partially written cache. If partition_col is given, the rows are
+    written as one parquet row group per value of that column, so that a filtered read only touches the matching rows.
+    @param df: input DataFrame
+    @type df: pd.DataFrame
+    @param cache_path: the cache file path
+    @type cache_path: str
+    @param partition_col: the column by which we will partition the rows
+    @type partition_col: str
+    """
+    assert isinstance(df, pd.DataFrame)
+    assert isinstance(cache_path, str)
+    assert partition_col is None or partition_col in df.columns
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    if partition_col is None:
+        df.to_parquet(tmp_path, index=False)
+    else:
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for _, df_part in df.groupby(partition_col, sort=True):
+                writer.write_table(pa.Table.from_pandas(df_part, schema=schema, preserve_index=False))
+    os.replace(tmp_path, cache_path)
+    remove_stale_cache(cache_path)
+
+
+def get_stored_schema(schema, with_dates):
+    """
+    This function returns the schema of the cached table, which is the read schema plus constants.DATE_SCHEMA when the
+    date columns are derived. It is a part of the cache key, so the cache files are rebuilt when it changes.
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @param with_dates: whether the date columns are derived
+    @type with_dates: bool
+    @return: the schema of the cached table
+    @rtype: dict
+    """
+    assert schema is None or isinstance(schema, dict)
+
+    if not with_dates:
+        return schema
+    stored_schema = dict(schema) if schema else {}
+    stored_schema.update(constants.DATE_SCHEMA)
+    return stored_schema
+
+
+def read_csv_with_dates(csv_file, used_cols=[], schema=None, with_dates=False):
+    """
+    This function parses the given columns of the csv file, and derives the requested date columns in
+    constants.DATE_SCHEMA from `FL_DATE` if with_dates is True.
+    @param csv_file: input csv file path
+    @type csv_file: str
+    @param used_cols: the input columns list, all of the columns are returned if it is empty
+    @type used_cols: list
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @param with_dates: whether we derive the date columns
+    @type with_dates: bool
+    @return: the dataFrame with the given columns
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(used_cols, list)
+
+    if not with_dates:
+        return read_csv_file(csv_file, schema, used_cols if used_cols else None)
+    if not used_cols:
+        return add_date_columns(read_csv_file(csv_file, schema))
+    read_cols = [col for col in used_cols if col not in constants.DATE_SCHEMA]
+    if len(read_cols) == len(used_cols):
+        return read_csv_file(csv_file, schema, used_cols)
+    df = add_date_columns(read_csv_file(csv_file, schema, list(dict.fromkeys(read_cols + ['FL_DATE']))))
+    return df[used_cols]
+
+
+def read_cached_csv_file(csv_file, used_cols=[], schema=None, with_dates=False):
+    """
+    This function reads the csv file through the columnar cache. On the first read, the whole csv file is parsed with
+    the given schema and written to a parquet file next to the other cache files, which keeps the compact dtypes. With
+    with_dates, the integer date columns in constants.DATE_SCHEMA are derived from `FL_DATE` once and stored in the
+    cache too. Later reads only load the given columns from the parquet file. If the source file or the schema changes,
+    the cache is rebuilt. Without pyarrow, or when the cache is disabled by constants.USE_FLIGHT_CACHE, it falls back to
+    parsing only the given columns of the csv file.
+    @param csv_file: input csv file path
+    @type csv_file: str
+    @param used_cols: the input columns list, all of the columns are returned if it is empty
+    @type used_cols: list
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @param with_dates: whether we derive the date columns
+    @type with_dates: bool
+    @return: the dataFrame with the given columns
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(csv_file, str)
+    assert isinstance(used_cols, list)
+
+    if not (HAS_PARQUET and constants.USE_FLIGHT_CACHE):
+        return read_csv_with_dates(csv_file, used_cols, schema, with_dates)
+
+    cache_path = get_cache_path(csv_file, schema=get_stored_schema(schema, with_dates))
+    if os.path.isfile(cache_path):
+        return pd.read_parquet(cache_path, columns=used_cols if used_cols else None)
+
+    df = read_csv_with_dates(csv_file, [], schema, with_dates)
+    write_cache(df, cache_path)
+    return df[used_cols] if used_cols else df
+
+
+def iter_cached_csv_file(csv_file, used_cols=[], schema=None, with_dates=False,
+                         chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function yields the given columns of the csv file in dataFrames of at most chunk_rows rows, so the memory is
+    bounded by the chunk size instead of the file size. If the columnar cache of read_cached_csv_file exists, the
+    chunks are read from its row batches, otherwise the csv file is parsed in chunks and the cache is not built. With
+    with_dates, the date columns in constants.DATE_SCHEMA can be used like the other columns.
+    @param csv_file: input csv file path
+    @type csv_file: str
+    @param used_cols: the input columns list, all of the columns are returned if it is empty
+    @type used_cols: list
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @param with_dates: whether we derive the date columns
+    @type with_dates: bool
+    @param chunk_rows: the maximum number of rows of each chunk
+    @type chunk_rows: int
+    @return: generator of the dataFrames with the given columns
+    @rtype: generator
+    """
+    assert isinstance(csv_file, str)
+    assert isinstance(used_cols, list)
+
+    if HAS_PARQUET and constants.USE_FLIGHT_CACHE:
+        cache_path = get_cache_path(csv_file, schema=get_stored_schema(schema, with_dates))
+        if os.path.isfile(cache_path):
+            for batch in pq.ParquetFile(cache_path).iter_batches(batch_size=chunk_rows,
+                                                                  columns=used_cols if used_cols else None):
+                yield batch.to_pandas()
+            return
+
+    read_cols = [col for col in used_cols if col not in constants.DATE_SCHEMA]
+    derive_dates = with_dates and (not used_cols or len(read_cols) < len(used_cols))
+    if derive_dates and used_cols:
+        read_cols = list(dict.fromkeys(read_cols + ['FL_DATE']))
+    for df in iter_csv_file(csv_file, schema, read_cols if used_cols else None, chunk_rows):
+        if derive_dates:
+            df = add_date_columns(df)
+        yield df[used_cols] if used_cols else df
+
+
+def build_month_partitions(csv_file, schema=None):
+    """
+    This function builds the month-partitioned cache for the given yearly flight csv file in one pass. The rows of each
+    month, by the derived integer `month` column, are stored as one row group.
+    @param csv_file: input yearly flight csv file path
+    @type csv_file: str
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @return: the month-partitioned cache file path
+    @rtype: str
+    """
+    assert isinstance(csv_file, str)
+    assert HAS_PARQUET, "ERROR! pyarrow is required for the month partitions"
+
+    cache_path = get_cache_path(csv_file, '.month.parquet', get_stored_schema(schema, True))
+    if not os.path.isfile(cache_path):
+        df = read_cached_csv_file(csv_file, schema=schema, with_dates=True)
+        write_cache(df, cache_path, partition_col='month')
+    return cache_path
+
+
+def read_cached_month(csv_file, month, used_cols=[], schema=None):
+    """
+    This function reads the flight data of the given month from the given yearly csv file. With the month-partitioned
+    cache, only the row group of that month is read. The returned dataFrame always contains the integer `month` column.
+    @param csv_file: input yearly flight csv file path
+    @type csv_file: str
+    @param month: the month string in constants.MONTH_LIST, e.g. '01'
+    @type month: str
+    @param used_cols: the input columns list, all of the columns are returned if it is empty
+    @type used_cols: list
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @return: the dataFrame of the given month
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(csv_file, str)
+    assert month in constants.MONTH_LIST
+    assert isinstance(used_cols, list)
+
+    cols = used_cols + ['month'] if used_cols and 'month' not in used_cols else used_cols
+    if not (HAS_PARQUET and constants.USE_FLIGHT_CACHE):
+        df = read_csv_with_dates(csv_file, cols, schema, True)
+        return df[df['month'] == int(month)]
+
+    cache_path = build_month_partitions(csv_file, schema)
+    return pd.read_parquet(cache_path, columns=cols if cols else None, filters=[('month', '==', int(month))])
+
+
+def iter_cached_month(csv_file, month, used_cols=[], schema=None, chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function is the same as read_cached_month, but it yields the flights of the given month in dataFrames of at
+    most chunk_rows rows. If the month-partitioned cache exists, only its row groups of that month are read, otherwise
+    the yearly file is streamed by iter_cached_csv_file and filtered by month, and no cache is built.
+    @param csv_file: input yearly flight csv file path
+    @type csv_file: str
+    @param month: the month string in constants.MONTH_LIST, e.g. '01'
+    @type month: str
+    @param used_cols: the input columns list, all of the columns are returned if it is empty
+    @type used_cols: list
+    @param schema: the mapping of the column names to the dtypes
+    @type schema: dict
+    @param chunk_rows: the maximum number of rows of each chunk
+    @type chunk_rows: int
+    @return: generator of the dataFrames of the given month
+    @rtype: generator
+    """
+    assert isinstance(csv_file, str)
+    assert month in constants.MONTH_LIST
+    assert isinstance(used_cols, list)
+
+    cols = used_cols + ['month'] if used_cols and 'month' not in used_cols else used_cols
+    cache_path = get_cache_path(csv_file, '.month.parquet', get_stored_schema(schema, True))
+    if HAS_PARQUET and constants.USE_FLIGHT_CACHE and os.path.isfile(cache_path):
+        parquet_file = pq.ParquetFile(cache_path)
+        month_idx = parquet_file.schema_arrow.get_field_index('month')
+        row_groups = []
+        for i in range(parquet_file.num_row_groups):
+            stats = parquet_file.metadata.row_group(i).column(month_idx).statistics
+            if stats is None or not stats.has_min_max or stats.min <= int(month) <= stats.max:
+                row_groups.append(i)
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(
+            batch_size=chunk_rows, row_groups=row_groups, columns=cols if cols else None))
+    else:
+        chunks = iter_cached_csv_file(csv_file, cols, schema, True, chunk_rows)
+    for df in chunks:
+        yield df[df['month'] == int(month)]
@@ -0,0 +1,112 @@
+from processing import constants
+import numpy as np
+import pandas as pd
+from processing.flight import get_flight_data_by_year
+from processing.reference import get_iata_lookup
+from processing.cube import build_cube, rollup
+from processing.operations import accumulate
+from processing.parallel import map_in_order
+from processing.trace import traced
+
+CANCELLATION_CODES = ['A', 'B', 'C', 'D']
+# the measures counted for each state and month
+CANCELLATION_MEASURES = ['flights', 'cancelled'] + ['code_' + code for code in CANCELLATION_CODES]
+
+
+def count_cancellation_by_state_and_year(year, use_cube=False):
+    """
+    This function counts the flights, the cancelled flights and the cancellations of each code A, B, C and D by the
+    state of the origin airport and the month in the given year. The airports are mapped to their states by an index
+    lookup and all of the counts are summed in one grouped pass. It is a module-level function so that it can run in a
+    worker process.
+    @param year: input year
+    @type year: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the dataFrame with the columns ['iso_region', 'month'] + CANCELLATION_MEASURES, where month is 1-12
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(year, int)
+
+    if use_cube:
+        df_cells = rollup(build_cube(year), ['ORIGIN', 'month'], {measure: measure for measure in CANCELLATION_MEASURES})
+        month = df_cells['month'].astype(int).to_numpy()
+    else:
+        df_cur = get_flight_data_by_year(year, ['ORIGIN', 'month', 'CANCELLED', 'CANCELLATION_CODE'])
+        cancelled = (df_cur['CANCELLED'] != 0).to_numpy()
+        code = np.asarray(df_cur['CANCELLATION_CODE'], dtype=object)
+        df_cells = pd.DataFrame({'ORIGIN': df_cur['ORIGIN'].to_numpy(),
+                                 'flights': np.ones(len(df_cur), dtype=np.int64),
+                                 'cancelled': cancelled.astype(np.int64)})
+        for reason in CANCELLATION_CODES:
+            df_cells['code_' + reason] = (cancelled & (code == reason)).astype(np.int64)
+        month = df_cur['month'].to_numpy()
+
+    iata_index, states, _ = get_iata_lookup()
+    airport_idx = iata_index.get_indexer(np.asarray(df_cells['ORIGIN'], dtype=object))
+    known = airport_idx >= 0
+    state = states[airport_idx[known]]
+    known_state = pd.notna(state)
+    df_state = pd.DataFrame({'iso_region': state[known_state], 'month': month[known][known_state].astype(np.int8)})
+    for measure in CANCELLATION_MEASURES:
+        df_state[measure] = df_cells[measure].to_numpy()[known][known_state]
+    return df_state.groupby(['iso_region', 'month'], sort=True)[CANCELLATION_MEASURES].sum().reset_index()
+
+
+@traced
+def count_cancellation_by_state(workers=None, use_cube=False):
+    """
+    This function returns the cancellation counts of count_cancellation_by_state_and_year for all of the years in
+    constants.YEAR_LIST, with a `year` column. With workers > 1, the years are counted in a pool of worker processes.
+    @param workers: the number of worker processes, the data is counted in this process if it is None
+    @type workers: int
+    @param use_cube: whether we answer from the aggregate cube
+    @type use_cube: bool
+    @return: the cancellation counts dataFrame
+    @rtype: pd.DataFrame
+    """
+    results = map_in_order(count_cancellation_by_state_and_year,
+                           [(year, use_cube) for year in constants.YEAR_LIST], workers)
+    for year, df_state in zip(constants.YEAR_LIST, results):
+        df_state.insert(0, 'year', year)
+    return accumulate(results).reset_index(drop=True)
+
+
+def get_cancellation_codes_by_year(df_stats):
+    """
+    This function returns the number of cancellations of each code A, B, C and D in each year.
+    @param df_stats: input cancellation counts from count_cancellation_by_state
+    @type df_stats: pd.DataFrame
+    @return: the dataFrame indexed by the years with the columns A, B, C and D
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_stats, pd.DataFrame)
+    assert {'year'}.union(CANCELLATION_MEASURES).issubset(df_stats.columns)
+
+    df_codes = df_stats.groupby('year')[['code_' + code for code in CANCELLATION_CODES]].sum()
+    df_codes.columns = CANCELLATION_CODES
+    return df_codes.reindex(constants.YEAR_LIST, fill_value=0)
+
+
+def get_cancellation_rate_matrix(df_stats):
+    """
+    This function pivots the cancellation counts into the dense matrix of the cancellation rates over all years, where
+    the row i is the month constants.MONTH_LIST[i] and the column j is the jth state. The states with flights but no
+    cancellation in a month have the rate 0, and so do the months without flights.
+    @param df_stats: input cancellation counts from count_cancellation_by_state
+    @type df_stats: pd.DataFrame
+    @return: the 12 x N_states rate matrix and the sorted list of the states of its columns
+    @rtype: tuple
+    """
+    assert isinstance(df_stats, pd.DataFrame)
+    assert {'iso_region', 'month', 'flights', 'cancelled'}.issubset(df_stats.columns)
+
+    months = list(range(1, len(constants.MONTH_LIST) + 1))
+    df_pivot = df_stats.pivot_table(index='month', columns='iso_region', values=['flights', 'cancelled'],
+                                    aggfunc='sum', fill_value=0)
+    df_flights = df_pivot['flights'].reindex(months, fill_value=0)
+    df_cancelled = df_pivot['cancelled'].reindex(index=months, columns=df_flights.columns, fill_value=0)
+    flights = df_flights.to_numpy(dtype=np.float64)
+    rates = np.divide(df_cancelled.to_numpy(dtype=np.float64), flights,
+                      out=np.zeros_like(flights), where=flights > 0)
+    return rates, [str(state) for state in df_flights.columns]
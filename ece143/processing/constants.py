@@ -1,4 +1,6 @@
 # This file defines all of the constant values used in this project.
+import os
+import re
 
 # AIRLINE_FULLNAME_MAP specifies the mapping of the airline code to the original fullname of each airline.
 AIRLINE_FULLNAME_MAP = {
@@ -59,14 +61,75 @@ DIRECTION_DEPARTURE = "DEPARTURE"
 DIRECTION_ARRIVAL = "ARRIVAL"
 
 # The followings specify the constants related to the date and time
-YEAR_LIST=list(range(2009, 2019))
+# DEFAULT_YEAR_LIST is used when the data directory has no yearly flight csv files yet, see YEAR_LIST below.
+DEFAULT_YEAR_LIST = list(range(2009, 2019))
 MONTH_LIST = ['01','02','03','04','05','06','07','08','09','10','11','12']
 MONTH_ENG_LIST = ['January','February','March','April',
                   'May','June','July','August','September',
                   'October','November','December']
 
+# FLIGHT_SCHEMA specifies the compact dtypes used to read the flight csv files. The code columns are read as categoricals,
+# and the integer columns are parsed as float32 and then downcast since the csv files store them as e.g. `1.0`.
+FLIGHT_SCHEMA = {
+    'FL_DATE': 'category',
+    'OP_CARRIER': 'category',
+    'ORIGIN': 'category',
+    'DEST': 'category',
+    'CANCELLATION_CODE': 'category',
+    'CANCELLED': 'int8',
+    'DIVERTED': 'int8',
+    'DEP_DELAY': 'float32',
+    'ARR_DELAY': 'float32',
+    'CARRIER_DELAY': 'float32',
+    'WEATHER_DELAY': 'float32',
+    'NAS_DELAY': 'float32',
+    'SECURITY_DELAY': 'float32',
+    'LATE_AIRCRAFT_DELAY': 'float32',
+    'TAXI_OUT': 'float32',
+    'TAXI_IN': 'float32',
+    'CRS_ELAPSED_TIME': 'float32',
+    'ACTUAL_ELAPSED_TIME': 'float32',
+    'AIR_TIME': 'float32',
+    'DISTANCE': 'float32',
+}
+# DATE_SCHEMA specifies the integer date columns derived from `FL_DATE` when the flights are read, so that the later
+# filters compare integers instead of splitting the date strings. day_of_week is 0 for Monday.
+DATE_SCHEMA = {
+    'year': 'int16',
+    'month': 'int8',
+    'day': 'int8',
+    'day_of_week': 'int8',
+}
+DELAY_REASON_COLS = ['CARRIER_DELAY', 'WEATHER_DELAY', 'NAS_DELAY', 'SECURITY_DELAY', 'LATE_AIRCRAFT_DELAY']
+
 # The followings specify other constants related to the files
 ROOT = './data/'
 AIRPORT_DATA_PATH = ROOT+'airports.csv'
 CLEANED_AIRPORT_DATA_PATH = ROOT+'clean_airports.csv'
 US_REGION_DIVISION_DATA_PATH = ROOT + 'us_regions_division.csv'
+
+# The followings specify the constants related to the columnar flight data cache
+CACHE_ROOT = ROOT + 'cache/'
+USE_FLIGHT_CACHE = True
+# FLIGHT_CHUNK_ROWS is the number of flights read at a time by the analysis that streams the flight files
+FLIGHT_CHUNK_ROWS = 1000000
+
+
+def find_years(root):
+    """
+    This function finds the years of the flight csv files in the given data directory, e.g. ./data/2019.csv.
+    @param root: the data directory
+    @type root: str
+    @return: the sorted years, or DEFAULT_YEAR_LIST if there is no yearly csv file
+    @rtype: list
+    """
+    assert isinstance(root, str)
+
+    if not os.path.isdir(root):
+        return list(DEFAULT_YEAR_LIST)
+    years = sorted(int(name[:4]) for name in os.listdir(root) if re.match(r'^\d{4}\.csv$', name))
+    return years if years else list(DEFAULT_YEAR_LIST)
+
+
+# YEAR_LIST is discovered from the data directory, so a new year of flights is picked up by adding its csv file
+YEAR_LIST = find_years(ROOT)
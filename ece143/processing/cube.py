@@ -0,0 +1,136 @@
+import os
+import numpy as np
+import pandas as pd
+import processing.constants as constants
+from processing.cache import get_cache_path, write_cache, HAS_PARQUET
+from processing.flight import get_flight_data_by_year
+from processing.parallel import map_in_order
+
+# CUBE_KEYS specifies the grain of the aggregate cube for each year.
+CUBE_KEYS = ['month', 'ORIGIN', 'DEST', 'OP_CARRIER']
+# CUBE_MEASURES specifies the aggregated values for each cell of the cube:
+# flights: number of flights, flown: number of flights not cancelled, cancelled: number of cancelled flights,
+# *_delay_sum: sum of the delays of the flights not cancelled, code_*: number of cancellations for each reason.
+# The missing delays, e.g. of the diverted flights, are skipped in the sums like in operations.aggregate, while the
+# flights are still counted in flown, so the averages from the cube are the same as from the raw flights.
+CUBE_MEASURES = ['flights', 'flown', 'cancelled',
+                 'dep_delay_sum', 'arr_delay_sum', 'total_delay_sum',
+                 'code_A', 'code_B', 'code_C', 'code_D']
+CUBE_USED_COLS = ['month', 'OP_CARRIER', 'ORIGIN', 'DEST', 'DEP_DELAY', 'ARR_DELAY', 'CANCELLED',
+                  'CANCELLATION_CODE']
+
+
+def compute_cube(df):
+    """
+    This function aggregates the flight dataFrame into the cube measures at the year x month x origin x dest x carrier
+    grain. The delay sums are computed in float64 so that the sums of the cells are exact.
+    @param df: input flight dataFrame of one year with the columns in CUBE_USED_COLS
+    @type df: pd.DataFrame
+    @return: the cube dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df, pd.DataFrame)
+    assert set(CUBE_USED_COLS).issubset(df.columns)
+
+    # the integer months are mapped to the month strings by the category codes
+    month = pd.Categorical.from_codes(df['month'].to_numpy(dtype=np.int64) - 1, categories=constants.MONTH_LIST)
+    flown = (df['CANCELLED'] != 1).to_numpy()
+    cancelled = (df['CANCELLED'] != 0).to_numpy()
+    dep_delay = df['DEP_DELAY'].to_numpy(dtype=np.float64)
+    arr_delay = df['ARR_DELAY'].to_numpy(dtype=np.float64)
+    code = np.asarray(df['CANCELLATION_CODE'], dtype=object)
+
+    df_cells = pd.DataFrame({
+        'month': month,
+        'ORIGIN': df['ORIGIN'].to_numpy(),
+        'DEST': df['DEST'].to_numpy(),
+        'OP_CARRIER': df['OP_CARRIER'].to_numpy(),
+        'flights': np.ones(len(df), dtype=np.int64),
+        'flown': flown.astype(np.int64),
+        'cancelled': cancelled.astype(np.int64),
+        'dep_delay_sum': np.where(flown, dep_delay, np.nan),
+        'arr_delay_sum': np.where(flown, arr_delay, np.nan),
+        'total_delay_sum': np.where(flown, dep_delay + arr_delay, np.nan),
+    })
+    for reason in ['A', 'B', 'C', 'D']:
+        df_cells['code_' + reason] = (cancelled & (code == reason)).astype(np.int64)
+    df_cube = df_cells.groupby(CUBE_KEYS, observed=True, sort=True)[CUBE_MEASURES].sum().reset_index()
+    df_cube['month'] = df_cube['month'].astype(str)
+    for key in ['ORIGIN', 'DEST', 'OP_CARRIER']:
+        df_cube[key] = df_cube[key].astype(str).astype('category')
+    return df_cube
+
+
+def build_cube(year):
+    """
+    This function builds the aggregate cube of the given year once per version of its source csv file and stores it
+    in the cache directory. Without pyarrow, the cube is computed in memory on every call.
+    @param year: input year
+    @type year: int
+    @return: the cube dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(year, int)
+
+    if not (HAS_PARQUET and constants.USE_FLIGHT_CACHE):
+        return compute_cube(get_flight_data_by_year(year, CUBE_USED_COLS))
+
+    cache_path = get_cache_path(constants.ROOT + str(year) + '.csv', '.cube.parquet', constants.FLIGHT_SCHEMA)
+    if os.path.isfile(cache_path):
+        return pd.read_parquet(cache_path)
+    df_cube = compute_cube(get_flight_data_by_year(year, CUBE_USED_COLS))
+    write_cache(df_cube, cache_path)
+    return df_cube
+
+
+def load_cube(years=None, workers=None):
+    """
+    This function returns the aggregate cube of the given years with a `year` column. The missing cubes are built
+    first, in a pool of worker processes if workers > 1.
+    @param years: the input years, all of the years in constants.YEAR_LIST if it is None
+    @type years: list
+    @param workers: the number of worker processes
+    @type workers: int
+    @return: the cube dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert years is None or isinstance(years, list)
+
+    if years is None:
+        years = constants.YEAR_LIST
+    df_cubes = map_in_order(build_cube, [(year,) for year in years], workers)
+    for year, df_cube in zip(years, df_cubes):
+        df_cube['year'] = year
+    df_cube = pd.concat(df_cubes, ignore_index=True)
+    for key in ['ORIGIN', 'DEST', 'OP_CARRIER']:
+        df_cube[key] = df_cube[key].astype(str).astype('category')
+    return df_cube
+
+
+def rollup(df_cube, keys, measures):
+    """
+    This function sums the given cube measures by the given keys, e.g.
+    rollup(df_cube, ['ORIGIN'], {'flown': 'ORIGIN_COUNT', 'dep_delay_sum': 'DEP_DELAY'})
+    returns the number of flights not cancelled and the total departure delay for each origin airport. The groups
+    whose first measure is zero are dropped, which is the same as counting the raw flights.
+    @param df_cube: input cube dataFrame
+    @type df_cube: pd.DataFrame
+    @param keys: the keys by which we will group the cube
+    @type keys: list
+    @param measures: the mapping of the cube measures to the new column names
+    @type measures: dict
+    @return: the rollup dataFrame sorted by the keys
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df_cube, pd.DataFrame)
+    assert isinstance(keys, list)
+    assert isinstance(measures, dict)
+    assert set(keys).issubset(df_cube.columns)
+    assert set(measures).issubset(CUBE_MEASURES)
+
+    df_rollup = df_cube.groupby(keys, observed=True, sort=True)[list(measures)].sum().reset_index()
+    df_rollup = df_rollup[df_rollup[list(measures)[0]] > 0].reset_index(drop=True)
+    for key in keys:
+        if isinstance(df_rollup[key].dtype, pd.CategoricalDtype):
+            df_rollup[key] = df_rollup[key].astype(str)
+    return df_rollup.rename(columns=measures)
@@ -1,11 +1,16 @@
 import pandas as pd
 import processing.constants as constants
-from processing.operations import read_csv_file
+from processing.cache import read_cached_csv_file, iter_cached_csv_file, read_cached_month, iter_cached_month, \
+    build_month_partitions
+from processing.parallel import map_in_order
+from processing.operations import accumulate
 
 
 def get_flight_data_by_year(year, used_cols=[]):
     """
-    This function get the flight data for the given year and only returns given columns
+    This function get the flight data for the given year and only returns given columns. The data is read through the
+    columnar cache with the compact constants.FLIGHT_SCHEMA dtypes, so only the first call parses the csv file. The
+    integer date columns in constants.DATE_SCHEMA, e.g. `month`, can be used like the other columns.
     @param year: input year
     @type year: int
     @param used_cols: the input columns list
@@ -16,15 +21,46 @@ def get_flight_data_by_year(year, used_cols=[]):
     assert isinstance(year, int)
     assert isinstance(used_cols, list)
 
-    df_year = read_csv_file(constants.ROOT + str(year) + '.csv')
-    if not used_cols:
-        return df_year
-    return df_year[used_cols]
+    return read_cached_csv_file(constants.ROOT + str(year) + '.csv', used_cols, constants.FLIGHT_SCHEMA, True)
+
+
+def iter_flight_data_by_year(year, used_cols=[], chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function is the same as get_flight_data_by_year, but it yields the flight data of the given year in
+    dataFrames of at most chunk_rows rows, so the whole year is never loaded at once.
+    @param year: input year
+    @type year: int
+    @param used_cols: the input columns list
+    @type used_cols: list
+    @param chunk_rows: the maximum number of rows of each chunk
+    @type chunk_rows: int
+    @return: generator of flight dataframes
+    @rtype: generator
+    """
+    assert isinstance(year, int)
+    assert isinstance(used_cols, list)
+
+    return iter_cached_csv_file(constants.ROOT + str(year) + '.csv', used_cols, constants.FLIGHT_SCHEMA, True,
+                                chunk_rows)
+
+
+def build_month_store(workers=None):
+    """
+    This function builds the month-partitioned flight data for all of the years in one pass, so that the later calls of
+    get_flight_data_by_month only read the rows of the given month. With workers > 1, the years are built in a pool of
+    worker processes.
+    @param workers: the number of worker processes
+    @type workers: int
+    """
+    map_in_order(build_month_partitions,
+                 [(constants.ROOT + str(year) + '.csv', constants.FLIGHT_SCHEMA) for year in constants.YEAR_LIST],
+                 workers)
 
 
 def get_flight_data_by_month(i, used_cols):
     """
-    This function get the flight data for the ith month and only returns given columns
+    This function get the flight data for the ith month and only returns given columns. The data is read from the
+    month-partitioned cache of each year, which is built on the first call.
     @param i: the month index
     @type i: int
     @param used_cols: the input columns list
@@ -36,15 +72,36 @@ def get_flight_data_by_month(i, used_cols):
     assert 0 <= i <= 11
     assert isinstance(used_cols, list)
 
-    df_month = pd.DataFrame()
+    df_month = []
     for year in constants.YEAR_LIST:
-        df_year = get_flight_data_by_year(year, used_cols)
+        curr = read_cached_month(constants.ROOT + str(year) + '.csv', constants.MONTH_LIST[i], used_cols,
+                                 constants.FLIGHT_SCHEMA)
         # not cancelled
-        df_year = df_year[df_year['CANCELLED'] != 1]
-        # compute for month column
-        df_year['month'] = df_year['FL_DATE'].str.split('-').str[1]
-        # choose a specific column
-        curr = df_year[df_year['month'] == constants.MONTH_LIST[i]]
+        curr = curr[curr['CANCELLED'] != 1]
         # combine
-        df_month = df_month.append(curr)
-    return df_month
\ No newline at end of file
+        df_month.append(curr)
+    return accumulate(df_month)
+
+
+def iter_flight_data_by_month(i, used_cols, chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function is the same as get_flight_data_by_month, but it yields the flights not cancelled of the ith month of
+    all years in dataFrames of at most chunk_rows rows, so the month is never loaded at once.
+    @param i: the month index
+    @type i: int
+    @param used_cols: the input columns list
+    @type used_cols: list
+    @param chunk_rows: the maximum number of rows of each chunk
+    @type chunk_rows: int
+    @return: generator of flight dataframes
+    @rtype: generator
+    """
+    assert isinstance(i, int)
+    assert 0 <= i <= 11
+    assert isinstance(used_cols, list)
+
+    for year in constants.YEAR_LIST:
+        for curr in iter_cached_month(constants.ROOT + str(year) + '.csv', constants.MONTH_LIST[i], used_cols,
+                                      constants.FLIGHT_SCHEMA, chunk_rows):
+            # not cancelled
+            yield curr[curr['CANCELLED'] != 1]
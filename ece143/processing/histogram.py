@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+import processing.constants as constants
+from processing.cache import iter_cached_csv_file
+from processing.operations import encode_column
+from processing.parallel import map_in_order
+from processing.trace import traced
+
+# The delay histograms count the delays of each cause in fixed bins of HISTOGRAM_BIN_MINUTES minutes: the bin 0 counts
+# the delays <= 0, the bin k counts the delays in ((k - 1) * bin_minutes, k * bin_minutes] up to HISTOGRAM_MAX_MINUTES,
+# and the last bin counts the delays larger than HISTOGRAM_MAX_MINUTES. So the number of delays above any multiple of
+# bin_minutes up to HISTOGRAM_MAX_MINUTES is exact.
+HISTOGRAM_BIN_MINUTES = 1
+HISTOGRAM_MAX_MINUTES = 1440
+
+
+def get_n_bins(bin_minutes, max_minutes):
+    """
+    This function returns the number of bins of the delay histograms, including the bin of the delays <= 0 and the bin
+    of the delays larger than max_minutes.
+    @param bin_minutes: the width of the bins in minutes
+    @type bin_minutes: int
+    @param max_minutes: the largest delay with its own bin, a multiple of bin_minutes
+    @type max_minutes: int
+    @return: the number of bins
+    @rtype: int
+    """
+    assert isinstance(bin_minutes, int) and bin_minutes > 0
+    assert isinstance(max_minutes, int) and max_minutes > 0 and max_minutes % bin_minutes == 0
+
+    return max_minutes // bin_minutes + 2
+
+
+def histogram_chunk(df, counts, groups, by, bin_minutes, max_minutes):
+    """
+    This function adds the delays of the DELAY_REASON_COLS of a chunk of flights to the histograms. The group values
+    are coded by encode_column, and the histograms grow with the new groups.
+    @param df: input chunk with the DELAY_REASON_COLS and the group column
+    @type df: pd.DataFrame
+    @param counts: the histograms so far, of shape (groups, causes, bins)
+    @type counts: np.ndarray
+    @param groups: the group values coded so far
+    @type groups: pd.Index
+    @param by: the group column, all of the flights are in the group 0 if it is None
+    @type by: str
+    @param bin_minutes: the width of the bins in minutes
+    @type bin_minutes: int
+    @param max_minutes: the largest delay with its own bin
+    @type max_minutes: int
+    @return: the updated histograms and groups
+    @rtype: tuple
+    """
+    assert isinstance(df, pd.DataFrame)
+    assert isinstance(counts, np.ndarray) and counts.ndim == 3
+
+    n_causes, n_bins = counts.shape[1], counts.shape[2]
+    if by is None:
+        codes = np.zeros(len(df), dtype=np.int64)
+    else:
+        groups, codes = encode_column(df[by], groups)
+    if len(groups) > counts.shape[0]:
+        counts = np.concatenate([counts, np.zeros((len(groups) - counts.shape[0], n_causes, n_bins),
+                                                  dtype=counts.dtype)])
+
+    delays = df[constants.DELAY_REASON_COLS].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(delays) & (codes >= 0)[:, None]
+    bins = np.clip(np.ceil(delays[valid] / bin_minutes), 0, n_bins - 1).astype(np.int64)
+    rows, causes = np.nonzero(valid)
+    cells = (codes[rows] * n_causes + causes) * n_bins + bins
+    counts += np.bincount(cells, minlength=counts.size).reshape(counts.shape)
+    return counts, groups
+
+
+def histogram_file(csv_file, by=None, bin_minutes=HISTOGRAM_BIN_MINUTES, max_minutes=HISTOGRAM_MAX_MINUTES,
+                   chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function builds the delay histograms of one flight file, reading only the DELAY_REASON_COLS and the group
+    column in chunks of chunk_rows flights. It is a module-level function so that it can run in a worker process.
+    @param csv_file: input flight csv file path
+    @type csv_file: str
+    @param by: the group column, e.g. 'year', 'OP_CARRIER' or 'ORIGIN', the histograms of all flights if it is None
+    @type by: str
+    @param bin_minutes: the width of the bins in minutes
+    @type bin_minutes: int
+    @param max_minutes: the largest delay with its own bin
+    @type max_minutes: int
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: the histograms, see build_delay_histograms
+    @rtype: dict
+    """
+    assert isinstance(csv_file, str)
+
+    used_cols = constants.DELAY_REASON_COLS + ([] if by is None else [by])
+    counts = np.zeros((1 if by is None else 0, len(constants.DELAY_REASON_COLS), get_n_bins(bin_minutes, max_minutes)),
+                      dtype=np.int64)
+    groups = pd.Index([], dtype=object)
+    for df in iter_cached_csv_file(csv_file, used_cols, constants.FLIGHT_SCHEMA, True, chunk_rows):
+        counts, groups = histogram_chunk(df, counts, groups, by, bin_minutes, max_minutes)
+    return {'by': by, 'groups': None if by is None else groups, 'bin_minutes': bin_minutes,
+            'max_minutes': max_minutes, 'counts': counts}
+
+
+def merge_histograms(histograms_list):
+    """
+    This function merges the delay histograms of e.g. different files by adding the counts of the same groups.
+    @param histograms_list: the list of the histograms of histogram_file or build_delay_histograms
+    @type histograms_list: list
+    @return: the merged histograms
+    @rtype: dict
+    """
+    assert isinstance(histograms_list, list) and histograms_list
+    assert len({(histograms['by'], histograms['bin_minutes'], histograms['max_minutes'])
+                for histograms in histograms_list}) == 1, "ERROR! The histograms must have the same groups and bins"
+
+    merged = dict(histograms_list[0])
+    if merged['by'] is None:
+        merged['counts'] = sum(histograms['counts'] for histograms in histograms_list)
+        return merged
+    groups = pd.Index([], dtype=object)
+    for histograms in histograms_list:
+        groups = groups.append(histograms['groups'].difference(groups, sort=False))
+    counts = np.zeros((len(groups),) + merged['counts'].shape[1:], dtype=np.int64)
+    for histograms in histograms_list:
+        np.add.at(counts, groups.get_indexer(histograms['groups']), histograms['counts'])
+    merged['groups'] = groups
+    merged['counts'] = counts
+    return merged
+
+
+@traced
+def build_delay_histograms(data_files=None, by=None, workers=None, bin_minutes=HISTOGRAM_BIN_MINUTES,
+                           max_minutes=HISTOGRAM_MAX_MINUTES, chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function builds the fixed-bin histograms of the delays of each cause in DELAY_REASON_COLS, optionally one for
+    each value of the group column, in one streaming pass over the flight files. With workers > 1, the files are read in
+    a pool of worker processes. Any threshold split is then answered by count_delays without reading the data again.
+    For example, the number of carrier delays above 500 minutes of each year is
+    histograms = build_delay_histograms(by='year')
+    count_delays(histograms, 500)['CARRIER_DELAY']
+    The histograms are the dict of
+    'by': the group column, 'groups': the pd.Index of the group values (None if by is None),
+    'bin_minutes', 'max_minutes': the bins, 'counts': the np.ndarray of shape (groups, causes, bins).
+    @param data_files: the flight csv files, the files of all of the years in constants.YEAR_LIST if it is None
+    @type data_files: list
+    @param by: the group column, e.g. 'year', 'OP_CARRIER' or 'ORIGIN', the histograms of all flights if it is None
+    @type by: str
+    @param workers: the number of worker processes, the files are read in this process if it is None
+    @type workers: int
+    @param bin_minutes: the width of the bins in minutes
+    @type bin_minutes: int
+    @param max_minutes: the largest delay with its own bin, a multiple of bin_minutes
+    @type max_minutes: int
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: the histograms
+    @rtype: dict
+    """
+    assert data_files is None or isinstance(data_files, list)
+    assert by is None or isinstance(by, str)
+
+    if data_files is None:
+        data_files = [constants.ROOT + str(year) + '.csv' for year in constants.YEAR_LIST]
+    results = map_in_order(histogram_file, [(csv_file, by, bin_minutes, max_minutes, chunk_rows)
+                                            for csv_file in data_files], workers)
+    if not results:
+        counts = np.zeros((1 if by is None else 0, len(constants.DELAY_REASON_COLS),
+                           get_n_bins(bin_minutes, max_minutes)), dtype=np.int64)
+        return {'by': by, 'groups': None if by is None else pd.Index([], dtype=object), 'bin_minutes': bin_minutes,
+                'max_minutes': max_minutes, 'counts': counts}
+    return merge_histograms(results)
+
+
+def count_delays(histograms, lower=0, upper=None):
+    """
+    This function counts the delays of each cause in (lower, upper] from the histograms, e.g. count_delays(h, 0) is the
+    number of positive delays and count_delays(h, 0, 500) is the number of delays up to 500 minutes. lower and upper
+    must be multiples of the bin width up to max_minutes.
+    @param histograms: input histograms of build_delay_histograms
+    @type histograms: dict
+    @param lower: the exclusive lower bound in minutes
+    @type lower: int
+    @param upper: the inclusive upper bound in minutes, no upper bound if it is None
+    @type upper: int
+    @return: the counts of each cause, a pd.Series if the histograms are not grouped, otherwise a pd.DataFrame
+             indexed by the groups with one column for each cause
+    @rtype: pd.Series
+    """
+    assert isinstance(histograms, dict)
+    bin_minutes, max_minutes = histograms['bin_minutes'], histograms['max_minutes']
+    for bound in [lower] + ([] if upper is None else [upper]):
+        assert 0 <= bound <= max_minutes and bound % bin_minutes == 0, \
+            "ERROR! The bounds must be multiples of " + str(bin_minutes) + " up to " + str(max_minutes)
+
+    counts = histograms['counts']
+    stop = counts.shape[2] if upper is None else upper // bin_minutes + 1
+    in_range = counts[:, :, lower // bin_minutes + 1:stop].sum(axis=2)
+    if histograms['by'] is None:
+        return pd.Series(in_range[0], index=constants.DELAY_REASON_COLS)
+    return pd.DataFrame(in_range, index=histograms['groups'].rename(histograms['by']),
+                        columns=constants.DELAY_REASON_COLS)
@@ -0,0 +1,307 @@
+import numpy as np
+import pandas as pd
+import processing.constants as constants
+from processing.cube import build_cube
+from processing.flight import iter_flight_data_by_year
+from processing.operations import accumulate, encode_column
+from processing.trace import traced
+
+try:
+    import scipy.sparse as sparse
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+# NETWORK_MEASURES are the values summed for each route (origin, dest), with the same meaning as the cube measures:
+# flights: number of flights, flown: number of flights not cancelled, cancelled: number of cancelled flights,
+# *_delay_sum: sum of the delays of the flights not cancelled.
+NETWORK_MEASURES = ['flights', 'flown', 'cancelled', 'dep_delay_sum', 'arr_delay_sum']
+# NETWORK_GROUPS are the columns by which a route network can be split into one matrix per value
+NETWORK_GROUPS = ['OP_CARRIER', 'month']
+NETWORK_USED_COLS = ['ORIGIN', 'DEST', 'CANCELLED', 'DEP_DELAY', 'ARR_DELAY']
+NETWORK_KEYS = ['group', 'origin', 'dest']
+
+
+def get_route_cells(df, index, by=None):
+    """
+    This function sums the NETWORK_MEASURES of a chunk of flights, or of a cube, by the coded (group, origin, dest).
+    The airport and group values are coded by encode_column, and index is updated in place with the extended indexes.
+    @param df: input flight dataFrame with the columns in NETWORK_USED_COLS, or cube dataFrame
+    @type df: pd.DataFrame
+    @param index: the mapping of 'airports' and 'groups' to the values coded so far
+    @type index: dict
+    @param by: the group column in NETWORK_GROUPS, all of the flights are in the group 0 if it is None
+    @type by: str
+    @return: the dataFrame with the columns NETWORK_KEYS + NETWORK_MEASURES
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df, pd.DataFrame)
+    assert isinstance(index, dict)
+
+    index['airports'], origin = encode_column(df['ORIGIN'], index['airports'])
+    index['airports'], dest = encode_column(df['DEST'], index['airports'])
+    if by is None:
+        group = np.zeros(len(df), dtype=np.int64)
+    else:
+        index['groups'], group = encode_column(df[by], index['groups'])
+
+    if 'flights' in df.columns:
+        measures = {measure: df[measure].to_numpy() for measure in NETWORK_MEASURES}
+    else:
+        flown = (df['CANCELLED'] != 1).to_numpy()
+        measures = {'flights': np.ones(len(df), dtype=np.int64),
+                    'flown': flown.astype(np.int64),
+                    'cancelled': (df['CANCELLED'] != 0).to_numpy().astype(np.int64),
+                    'dep_delay_sum': np.where(flown, df['DEP_DELAY'].to_numpy(dtype=np.float64), np.nan),
+                    'arr_delay_sum': np.where(flown, df['ARR_DELAY'].to_numpy(dtype=np.float64), np.nan)}
+    df_cells = pd.DataFrame(dict(zip(NETWORK_KEYS, [group, origin, dest]), **measures))
+    df_cells = df_cells[(group >= 0) & (origin >= 0) & (dest >= 0)]
+    return df_cells.groupby(NETWORK_KEYS, sort=False).sum().reset_index()
+
+
+def iter_route_cells(years, index, by=None, use_cube=False, chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function yields the route cells of get_route_cells for each chunk of the flight files of the given years, or
+    for the cube of each year.
+    @param years: the input years
+    @type years: list
+    @param index: the mapping of 'airports' and 'groups' to the values coded so far, which is updated in place
+    @type index: dict
+    @param by: the group column in NETWORK_GROUPS
+    @type by: str
+    @param use_cube: whether we read the aggregate cubes instead of the flights
+    @type use_cube: bool
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: generator of the route cells dataFrames
+    @rtype: generator
+    """
+    used_cols = NETWORK_USED_COLS + ([by] if by is not None else [])
+    for year in years:
+        if use_cube:
+            df_cube = build_cube(year)
+            df_cube['month'] = df_cube['month'].astype(np.int8)
+            chunks = [df_cube]
+        else:
+            chunks = iter_flight_data_by_year(year, used_cols, chunk_rows)
+        for df in chunks:
+            yield get_route_cells(df, index, by)
+
+
+def sort_codes(values):
+    """
+    This function sorts the coded values and returns the new code of each old code.
+    @param values: the values in the order of their old codes
+    @type values: pd.Index
+    @return: the sorted values and the array mapping the old codes to the new codes
+    @rtype: tuple
+    """
+    assert isinstance(values, pd.Index)
+
+    order = np.argsort(np.asarray(values), kind='stable')
+    new_codes = np.empty(len(values), dtype=np.int64)
+    new_codes[order] = np.arange(len(values))
+    return values[order], new_codes
+
+
+@traced
+def build_route_network(years=None, by=None, use_cube=False, chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function builds the airport x airport route network of the given years as scipy.sparse matrices, where the
+    entry (i, j) of the matrix of a measure in NETWORK_MEASURES is the sum of that measure over the flights from the
+    ith airport to the jth airport. With by, one matrix is built for each carrier or month. The flight files are
+    streamed in chunks of chunk_rows flights and only the route cells are kept, so the memory is bounded by the chunk
+    size and the number of routes. With use_cube, the matrices are built from the aggregate cubes.
+    For example:
+    network = build_route_network([2018], by='OP_CARRIER')
+    get_top_routes(network, 'cancelled', 10, 'AA')
+    @param years: the input years, all of the years in constants.YEAR_LIST if it is None
+    @type years: list
+    @param by: the group column in NETWORK_GROUPS, 'OP_CARRIER' or 'month', one matrix is built if it is None
+    @type by: str
+    @param use_cube: whether we build from the aggregate cubes
+    @type use_cube: bool
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: the network, i.e. the mapping of 'airports' to the sorted iata codes of the rows and columns, 'by' to by,
+             'groups' to the sorted group values (None without by) and 'matrices' to the mapping of each measure to its
+             csr matrix, or to the list of its csr matrices of the groups with by
+    @rtype: dict
+    """
+    assert HAS_SCIPY, "ERROR! scipy is required for the route network"
+    assert years is None or isinstance(years, list)
+    assert by is None or by in NETWORK_GROUPS
+    assert isinstance(chunk_rows, int) and chunk_rows > 0
+
+    if years is None:
+        years = constants.YEAR_LIST
+    index = {'airports': pd.Index([], dtype=object), 'groups': pd.Index([], dtype=object)}
+    df_cells = accumulate(iter_route_cells(years, index, by, use_cube, chunk_rows), keys=NETWORK_KEYS)
+    if df_cells.empty:
+        df_cells = pd.DataFrame(columns=NETWORK_KEYS + NETWORK_MEASURES, dtype=np.int64)
+
+    airports, airport_codes = sort_codes(index['airports'])
+    origin = airport_codes[df_cells['origin'].to_numpy(dtype=np.int64)]
+    dest = airport_codes[df_cells['dest'].to_numpy(dtype=np.int64)]
+    shape = (len(airports), len(airports))
+    measures = {measure: df_cells[measure].to_numpy(dtype=np.float64 if measure.endswith('_delay_sum') else np.int64)
+                for measure in NETWORK_MEASURES}
+
+    if by is None:
+        matrices = {measure: sparse.csr_matrix((values, (origin, dest)), shape=shape)
+                    for measure, values in measures.items()}
+        return {'airports': airports, 'by': by, 'groups': None, 'matrices': matrices}
+
+    groups, group_codes = sort_codes(index['groups'])
+    group = group_codes[df_cells['group'].to_numpy(dtype=np.int64)]
+    matrices = {measure: [] for measure in NETWORK_MEASURES}
+    for i in range(len(groups)):
+        in_group = group == i
+        for measure, values in measures.items():
+            matrices[measure].append(sparse.csr_matrix((values[in_group], (origin[in_group], dest[in_group])),
+                                                       shape=shape))
+    return {'airports': airports, 'by': by, 'groups': groups, 'matrices': matrices}
+
+
+def get_route_matrix(network, measure='flights', group=None):
+    """
+    This function returns the csr matrix of the given measure of the route network. For a network built with by, it
+    returns the matrix of the given group, or the sum over all groups if group is None.
+    @param network: input route network of build_route_network
+    @type network: dict
+    @param measure: the measure in NETWORK_MEASURES
+    @type measure: str
+    @param group: the carrier or month of the matrix
+    @return: the airport x airport matrix
+    @rtype: sparse.csr_matrix
+    """
+    assert isinstance(network, dict)
+    assert measure in NETWORK_MEASURES
+
+    matrix = network['matrices'][measure]
+    if network['by'] is None:
+        assert group is None, "ERROR! The network has no groups"
+        return matrix
+    if group is not None:
+        assert group in network['groups'], "ERROR! Unknown group"
+        return matrix[network['groups'].get_loc(group)]
+    n_airports = len(network['airports'])
+    total = sparse.csr_matrix((n_airports, n_airports), dtype=matrix[0].dtype if matrix else np.int64)
+    for group_matrix in matrix:
+        total = total + group_matrix
+    return total
+
+
+def get_airport_positions(network, airports):
+    """
+    This function returns the row and column positions of the given airports in the route network.
+    @param network: input route network of build_route_network
+    @type network: dict
+    @param airports: the list of iata codes
+    @type airports: list
+    @return: the positions
+    @rtype: np.ndarray
+    """
+    assert isinstance(network, dict)
+    assert isinstance(airports, list)
+
+    positions = network['airports'].get_indexer(airports)
+    assert (positions >= 0).all(), "ERROR! Unknown airports: %s" % [airports[i] for i in np.flatnonzero(positions < 0)]
+    return positions
+
+
+def get_route_slice(network, origins=None, dests=None, measure='flights', group=None):
+    """
+    This function returns the sub-matrix of the routes from the given origins to the given destinations, whose rows
+    and columns are in the order of origins and dests.
+    @param network: input route network of build_route_network
+    @type network: dict
+    @param origins: the iata codes of the origin airports, all of the airports if it is None
+    @type origins: list
+    @param dests: the iata codes of the destination airports, all of the airports if it is None
+    @type dests: list
+    @param measure: the measure in NETWORK_MEASURES
+    @type measure: str
+    @param group: the carrier or month of the matrix
+    @return: the len(origins) x len(dests) matrix
+    @rtype: sparse.csr_matrix
+    """
+    matrix = get_route_matrix(network, measure, group)
+    if origins is not None:
+        matrix = matrix[get_airport_positions(network, origins), :]
+    if dests is not None:
+        matrix = matrix[:, get_airport_positions(network, dests)]
+    return matrix.tocsr()
+
+
+def get_top_routes(network, measure='flights', n=10, group=None):
+    """
+    This function returns the n routes with the largest values of the given measure, e.g. the busiest routes or the
+    routes with the most cancellations.
+    @param network: input route network of build_route_network
+    @type network: dict
+    @param measure: the measure in NETWORK_MEASURES
+    @type measure: str
+    @param n: the number of routes
+    @type n: int
+    @param group: the carrier or month of the matrix
+    @return: the dataFrame with the columns ['ORIGIN', 'DEST', measure] sorted by the measure
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(n, int) and n > 0
+
+    matrix = get_route_matrix(network, measure, group).tocoo()
+    if matrix.nnz > n:
+        top = np.argpartition(-matrix.data, n - 1)[:n]
+    else:
+        top = np.arange(matrix.nnz)
+    top = top[np.argsort(-matrix.data[top], kind='stable')]
+    return pd.DataFrame({'ORIGIN': np.asarray(network['airports'])[matrix.row[top]],
+                         'DEST': np.asarray(network['airports'])[matrix.col[top]],
+                         measure: matrix.data[top]})
+
+
+def get_airport_degrees(network, measure='flights', group=None):
+    """
+    This function returns the hub metrics of the airports with at least one route: the number of destinations
+    (out_degree), the number of origins (in_degree), the number of distinct airports connected in either direction
+    (degree), and the sums of the given measure over the departing and arriving routes.
+    @param network: input route network of build_route_network
+    @type network: dict
+    @param measure: the measure in NETWORK_MEASURES
+    @type measure: str
+    @param group: the carrier or month of the matrix
+    @return: the dataFrame with the columns ['iata_code', 'out_degree', 'in_degree', 'degree', 'out_' + measure,
+             'in_' + measure] sorted by the degree
+    @rtype: pd.DataFrame
+    """
+    routes = get_route_matrix(network, 'flights', group)
+    routes = (routes > 0).astype(np.int64)
+    values = get_route_matrix(network, measure, group)
+    df_degrees = pd.DataFrame({'iata_code': np.asarray(network['airports']),
+                               'out_degree': routes.getnnz(axis=1),
+                               'in_degree': routes.getnnz(axis=0),
+                               'degree': (routes + routes.T).getnnz(axis=1),
+                               'out_' + measure: np.asarray(values.sum(axis=1)).ravel(),
+                               'in_' + measure: np.asarray(values.sum(axis=0)).ravel()})
+    df_degrees = df_degrees[df_degrees['degree'] > 0]
+    return df_degrees.sort_values(['degree', 'out_' + measure], ascending=False, kind='stable').reset_index(drop=True)
+
+
+def get_average_delay_matrix(network, delay_sum='dep_delay_sum', group=None):
+    """
+    This function returns the average delay of the flights not cancelled on each route. The routes without any flight
+    flown are not stored.
+    @param network: input route network of build_route_network
+    @type network: dict
+    @param delay_sum: 'dep_delay_sum' or 'arr_delay_sum'
+    @type delay_sum: str
+    @param group: the carrier or month of the matrix
+    @return: the airport x airport matrix of the average delays
+    @rtype: sparse.csr_matrix
+    """
+    assert delay_sum in ['dep_delay_sum', 'arr_delay_sum']
+
+    flown = get_route_matrix(network, 'flown', group).astype(np.float64)
+    flown.eliminate_zeros()
+    return get_route_matrix(network, delay_sum, group).multiply(flown.power(-1)).tocsr()
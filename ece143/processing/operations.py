@@ -1,7 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
+from processing import constants
+from processing.trace import traced
 
 
+@traced
 def count(df, key, new_count_key):
     """
     This function takes a pandas DataFrame as an input, count the values in the given key column and return a new
@@ -20,10 +24,13 @@ def count(df, key, new_count_key):
     assert isinstance(new_count_key, str)
     assert key in df.columns
 
-    df_counts = df[key].value_counts().rename_axis(key).reset_index(name=new_count_key)
+    df_counts = df[key].value_counts()
+    # categorical columns also count the unobserved categories
+    df_counts = df_counts[df_counts > 0].rename_axis(key).reset_index(name=new_count_key)
     return df_counts
 
 
+@traced
 def aggregate(df, group_key, agg_key):
     """
     This function takes a dataFrame and aggregates the sum value by the given group_key and agg_key.
@@ -41,13 +48,14 @@ def aggregate(df, group_key, agg_key):
     assert isinstance(agg_key, str)
     assert {group_key, agg_key}.issubset(df.columns)
 
-    df_agg = df.groupby([group_key]) \
-                       .agg({agg_key:sum}) \
+    df_agg = df.groupby([group_key], observed=True) \
+                       .agg({agg_key: 'sum'}) \
                        .rename_axis(group_key) \
                        .reset_index()
     return df_agg
 
 
+@traced
 def merge(df1, df2, key_left, key_right):
     """
     This function takes two dataframes and merges them by the given keys.
@@ -77,6 +85,7 @@ def merge(df1, df2, key_left, key_right):
     return df_merge
 
 
+@traced
 def average(df, key1, key2):
     """
     This function calculates the average value by dividing key1 with key 2.
@@ -97,16 +106,344 @@ def average(df, key1, key2):
     return df
 
 
-def read_csv_file(csv_file):
+@traced
+def count_partitioned(chunks, key, new_count_key):
+    """
+    This function is the same as count, but it counts the values of the key column chunk by chunk, e.g. over the
+    chunks of iter_flight_data_by_year, and sums the partial counts, so the memory is bounded by the chunk size and the
+    number of distinct values. The counts are the same as count of the concatenated chunks, sorted by the count and
+    then by the value.
+    @param chunks: the iterable of the input DataFrames
+    @type chunks: iterable
+    @param key: input key by which we will count the values
+    @type key: str
+    @param new_count_key: column name for the new count column
+    @type new_count_key: str
+    @return: the new value-count dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert not isinstance(chunks, pd.DataFrame)
+    assert isinstance(key, str)
+    assert isinstance(new_count_key, str)
+
+    partials = (count_chunk(df, key, new_count_key) for df in chunks)
+    df_counts = accumulate(partials, keys=[key])
+    if df_counts.empty:
+        return pd.DataFrame(columns=[key, new_count_key])
+    return df_counts.sort_values(key, kind='stable') \
+                    .sort_values(new_count_key, ascending=False, kind='stable') \
+                    .reset_index(drop=True)
+
+
+def count_chunk(df, key, new_count_key):
+    """
+    This function returns the partial counts of the values of the key column in one chunk.
+    @param df: input DataFrame
+    @type df: pd.DataFrame
+    @param key: input key by which we will count the values
+    @type key: str
+    @param new_count_key: column name for the new count column
+    @type new_count_key: str
+    @return: the partial value-count dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df, pd.DataFrame)
+    assert key in df.columns
+
+    df_counts = df[key].value_counts(sort=False)
+    df_counts = df_counts[df_counts > 0]
+    return pd.DataFrame({key: np.asarray(df_counts.index, dtype=object),
+                         new_count_key: df_counts.to_numpy(dtype=np.int64)})
+
+
+@traced
+def aggregate_partitioned(chunks, group_key, agg_key):
+    """
+    This function is the same as aggregate, but it sums the agg_key column by the group_key chunk by chunk and adds up
+    the partial sums. The partial sums are kept in float64 and cast to the dtype of the input column at the end, which
+    is the same as aggregate of the concatenated chunks since the delays are whole minutes.
+    @param chunks: the iterable of the input DataFrames
+    @type chunks: iterable
+    @param group_key: input key by which we will group the data.
+    @type group_key: str
+    @param agg_key: the agg key with which we will aggregate the values.
+    @type agg_key: str
+    @return: new aggregate dataFrame sorted by the group_key
+    @rtype: pd.DataFrame
+    """
+    assert not isinstance(chunks, pd.DataFrame)
+    assert isinstance(group_key, str)
+    assert isinstance(agg_key, str)
+
+    df_agg = count_and_aggregate_partitioned(chunks, group_key, agg_key)
+    return df_agg[[group_key, agg_key]]
+
+
+@traced
+def count_and_aggregate_partitioned(chunks, group_key, agg_key, new_count_key=None):
+    """
+    This function counts the rows and sums the agg_key column by the group_key in one pass over the chunks, which is
+    the same as merge(count(df, group_key, new_count_key), aggregate(df, group_key, agg_key), group_key, group_key) of
+    the concatenated chunks, up to the row order. The mean of each group is then average(df_agg, agg_key,
+    new_count_key), since the sums and the counts are mergeable partial results while the means are not.
+    @param chunks: the iterable of the input DataFrames
+    @type chunks: iterable
+    @param group_key: input key by which we will group the data.
+    @type group_key: str
+    @param agg_key: the agg key with which we will aggregate the values.
+    @type agg_key: str
+    @param new_count_key: column name for the count column, the rows are not counted if it is None
+    @type new_count_key: str
+    @return: the dataFrame with the columns [group_key, new_count_key, agg_key] sorted by the group_key
+    @rtype: pd.DataFrame
+    """
+    assert not isinstance(chunks, pd.DataFrame)
+    assert isinstance(group_key, str)
+    assert isinstance(agg_key, str)
+
+    count_key = new_count_key if new_count_key is not None else '_count'
+    dtypes = []
+
+    def iter_partials():
+        for df in chunks:
+            assert isinstance(df, pd.DataFrame)
+            assert {group_key, agg_key}.issubset(df.columns)
+            dtypes.append(df[agg_key].dtype)
+            df_partial = pd.DataFrame({group_key: df[group_key].to_numpy(),
+                                       count_key: np.ones(len(df), dtype=np.int64),
+                                       agg_key: df[agg_key].to_numpy(dtype=np.float64)}) \
+                           .groupby(group_key, observed=True, sort=False).sum().reset_index()
+            df_partial[group_key] = np.asarray(df_partial[group_key], dtype=object)
+            yield df_partial
+
+    df_agg = accumulate(iter_partials(), keys=[group_key])
+    if df_agg.empty:
+        df_agg = pd.DataFrame(columns=[group_key, count_key, agg_key])
+    df_agg = df_agg.sort_values(group_key, kind='stable').reset_index(drop=True)
+    if dtypes:
+        df_agg[agg_key] = df_agg[agg_key].astype(dtypes[0])
+    if new_count_key is None:
+        return df_agg[[group_key, agg_key]]
+    return df_agg[[group_key, count_key, agg_key]]
+
+
+def merge_partitioned(df1, chunks, key_left, key_right):
+    """
+    This function is the same as merge, but it merges df1 with each chunk of the second dataFrame and yields the merged
+    chunks. Since merge keeps the rows of the second dataFrame in order, the merged chunks are the chunks of merge of
+    the concatenated chunks, so they can be passed on to count_partitioned or aggregate_partitioned.
+    @param df1: input DataFrame 1, e.g. the airport table
+    @type df1: pd.DataFrame
+    @param chunks: the iterable of the chunks of the DataFrame 2
+    @type chunks: iterable
+    @param key_left: merge key in the first dataFrame
+    @type key_left: str
+    @param key_right:  merge key in the second dataFrame
+    @type key_right: str
+    @return: generator of the merged dataFrames
+    @rtype: generator
+    """
+    assert isinstance(df1, pd.DataFrame)
+    assert not isinstance(chunks, pd.DataFrame)
+
+    for df2 in chunks:
+        yield merge(df1, df2, key_left, key_right)
+
+
+@traced
+def accumulate(partials, keys=None, compact_rows=1000000):
+    """
+    This function collects the partial result dataFrames, e.g. one for each year, and concatenates them once, instead
+    of growing a dataFrame with append, which copies everything accumulated so far on every call. If keys is given, the
+    partials are aggregates and the other columns are summed by keys: the pending partials are reduced whenever they
+    have more than compact_rows rows, so a generator of partials is reduced as they arrive.
+    For example:
+    accumulate(df_delay for df_delay in results)
+    accumulate(df_counts_by_year, keys=['iso_region', 'month'])
+    @param partials: the iterable of the partial dataFrames
+    @type partials: iterable
+    @param keys: the group keys of the partial aggregates, the partials are only concatenated if it is None
+    @type keys: list
+    @param compact_rows: the number of pending rows above which the partial aggregates are reduced
+    @type compact_rows: int
+    @return: the concatenated or reduced dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert keys is None or isinstance(keys, list)
+    assert isinstance(compact_rows, int) and compact_rows > 0
+
+    pending = []
+    n_rows = 0
+    limit = compact_rows
+    for df in partials:
+        assert isinstance(df, pd.DataFrame)
+        pending.append(df)
+        n_rows += len(df)
+        if keys is not None and n_rows > limit and len(pending) > 1:
+            pending = [reduce_sum(pending, keys)]
+            n_rows = len(pending[0])
+            # the reduced rows only grow with the distinct keys, so we do not reduce them again on every partial
+            limit = max(compact_rows, 2 * n_rows)
+
+    if not pending:
+        return pd.DataFrame()
+    if keys is None:
+        return pd.concat(pending)
+    return reduce_sum(pending, keys)
+
+
+def reduce_sum(partials, keys):
+    """
+    This function concatenates the partial aggregates and sums the other columns by keys.
+    @param partials: the list of the partial dataFrames
+    @type partials: list
+    @param keys: the group keys
+    @type keys: list
+    @return: the reduced dataFrame with one row for each group
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(partials, list)
+    assert isinstance(keys, list)
+
+    df = pd.concat(partials, ignore_index=True)
+    assert set(keys).issubset(df.columns)
+    return df.groupby(keys, observed=True, sort=False).sum().reset_index()
+
+
+def encode_column(column, index):
+    """
+    This function codes the values of the column as their positions in the index, and appends the values not in the
+    index yet to it, so that the codes of all chunks refer to the same index. A categorical column is looked up once
+    per category. The missing values get -1.
+    @param column: input column, e.g. df['ORIGIN']
+    @type column: pd.Series
+    @param index: the values coded so far
+    @type index: pd.Index
+    @return: the extended index and the codes
+    @rtype: tuple
+    """
+    assert isinstance(column, pd.Series)
+    assert isinstance(index, pd.Index)
+
+    is_categorical = isinstance(column.dtype, pd.CategoricalDtype)
+    values = np.asarray(column.cat.categories if is_categorical else column.dropna().unique())
+    positions = index.get_indexer(values)
+    if (positions < 0).any():
+        index = index.append(pd.Index(values[positions < 0], dtype=object))
+        positions = index.get_indexer(values)
+    if not is_categorical:
+        return index, index.get_indexer(column.to_numpy())
+    category_codes = column.cat.codes.to_numpy()
+    return index, np.where(category_codes >= 0, positions[category_codes], -1)
+
+
+def add_date_columns(df):
+    """
+    This function adds the integer columns in constants.DATE_SCHEMA, i.e. year, month, day and day_of_week, derived
+    from the `FL_DATE` column. Each distinct date is parsed once and the rows are mapped to their date by the category
+    codes, so no string is allocated per row.
+    @param df: input flight DataFrame with the `FL_DATE` column
+    @type df: pd.DataFrame
+    @return: the dataFrame with the date columns
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(df, pd.DataFrame)
+    assert 'FL_DATE' in df.columns
+
+    dates = df['FL_DATE'].astype('category')
+    codes = dates.cat.codes.to_numpy()
+    assert (codes >= 0).all(), "ERROR! FL_DATE has missing values"
+    days = pd.to_datetime(dates.cat.categories.astype(str), format='%Y-%m-%d')
+    values = {'year': days.year, 'month': days.month, 'day': days.day, 'day_of_week': days.dayofweek}
+    for col, dtype in constants.DATE_SCHEMA.items():
+        df[col] = np.asarray(values[col], dtype=dtype)[codes]
+    return df
+
+
+@traced
+def read_csv_file(csv_file, schema=None, usecols=None):
     """
     This function uniforms the read csv file as a common function to make the code cleaner and easy to the future
-    maintenance.
+    maintenance. The schema maps the column names to the compact dtypes, e.g. constants.FLIGHT_SCHEMA. Integer columns
+    are parsed as float32 first and then downcast, so they must not contain NA values.
     :param csv_file: input csv file path
     :type csv_file: str
+    :param schema: the mapping of the column names to the dtypes
+    :type schema: dict
+    :param usecols: the columns to read, all of the columns are read if it is None
+    :type usecols: list
     :return: pd.DataFrame
     """
     assert isinstance(csv_file, str)
     assert csv_file.endswith(".csv")
     assert os.path.isfile(csv_file), "ERROR! The csv file does not exist"
+    assert schema is None or isinstance(schema, dict)
+    assert usecols is None or isinstance(usecols, list)
+
+    if schema is None:
+        df = pd.read_csv(csv_file, usecols=usecols)
+    else:
+        df = downcast_int_columns(pd.read_csv(csv_file, usecols=usecols, dtype=get_read_dtype(schema)), schema)
+    if usecols is not None:
+        df = df[usecols]
+    return df
+
 
-    return pd.read_csv(csv_file)
+def iter_csv_file(csv_file, schema=None, usecols=None, chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function is the same as read_csv_file, but it yields the csv file in dataFrames of at most chunk_rows rows, so
+    that a file larger than the memory can be processed. The categorical columns of each chunk only have the categories
+    seen in that chunk.
+    :param csv_file: input csv file path
+    :type csv_file: str
+    :param schema: the mapping of the column names to the dtypes
+    :type schema: dict
+    :param usecols: the columns to read, all of the columns are read if it is None
+    :type usecols: list
+    :param chunk_rows: the maximum number of rows of each chunk
+    :type chunk_rows: int
+    :return: generator of pd.DataFrame
+    """
+    assert isinstance(csv_file, str)
+    assert csv_file.endswith(".csv")
+    assert os.path.isfile(csv_file), "ERROR! The csv file does not exist"
+    assert schema is None or isinstance(schema, dict)
+    assert usecols is None or isinstance(usecols, list)
+    assert isinstance(chunk_rows, int) and chunk_rows > 0
+
+    read_dtype = None if schema is None else get_read_dtype(schema)
+    with pd.read_csv(csv_file, usecols=usecols, dtype=read_dtype, chunksize=chunk_rows) as reader:
+        for df in reader:
+            if schema is not None:
+                df = downcast_int_columns(df, schema)
+            yield df[usecols] if usecols is not None else df
+
+
+def get_read_dtype(schema):
+    """
+    This function returns the dtypes passed to pd.read_csv for the given schema, where the integer columns are parsed as
+    float32 since the csv files store them as e.g. `1.0`.
+    :param schema: the mapping of the column names to the dtypes
+    :type schema: dict
+    :return: the mapping of the column names to the read dtypes
+    :rtype: dict
+    """
+    assert isinstance(schema, dict)
+
+    return {col: 'float32' if dtype.startswith('int') else dtype for col, dtype in schema.items()}
+
+
+def downcast_int_columns(df, schema):
+    """
+    This function casts the columns parsed as float32 by get_read_dtype to their integer dtypes in the schema in place.
+    :param df: input dataFrame
+    :type df: pd.DataFrame
+    :param schema: the mapping of the column names to the dtypes
+    :type schema: dict
+    :return: the dataFrame
+    :rtype: pd.DataFrame
+    """
+    for col, dtype in schema.items():
+        if dtype.startswith('int') and col in df.columns:
+            df[col] = df[col].astype(dtype)
+    return df
@@ -0,0 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor
+from processing import trace
+
+
+def map_in_order(func, args_list, workers=None):
+    """
+    This function calls func with each of the argument tuples in args_list and returns the results in the same order.
+    If workers is larger than 1, the calls are spread across a pool of that many processes, so func and its arguments
+    must be picklable, e.g. a module-level function. Otherwise, the calls run one after another in this process.
+    For example:
+    map_in_order(get_flight_data_by_year, [(2009, []), (2010, [])], workers=2)
+    @param func: the module-level function to call
+    @type func: function
+    @param args_list: the list of argument tuples
+    @type args_list: list
+    @param workers: the number of worker processes
+    @type workers: int
+    @return: the list of results
+    @rtype: list
+    """
+    assert callable(func)
+    assert isinstance(args_list, list)
+    assert workers is None or (isinstance(workers, int) and workers > 0)
+
+    if not workers or workers == 1 or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+    with ProcessPoolExecutor(max_workers=min(workers, len(args_list))) as executor:
+        if not trace.ENABLED:
+            return list(executor.map(func, *zip(*args_list)))
+        results = []
+        for result, spans in executor.map(trace.run_traced, [func] * len(args_list), *zip(*args_list)):
+            trace.SPANS.extend(spans)
+            results.append(result)
+        return results
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import pandas as pd
+import processing.constants as constants
+from processing.operations import read_csv_file
+
+# REFERENCE_TABLES caches the loaded reference tables of this process, keyed by the file path and the transform name.
+# Each value is a tuple of the file (size, mtime) and the loaded dataFrame.
+REFERENCE_TABLES = {}
+
+
+def load_reference_table(csv_file, transform=None):
+    """
+    This function loads a small reference table such as the airport data once per process. The table is reloaded when
+    the file size or modification time changes. The transform, e.g. extract_us_airport, is applied once after loading.
+    A copy is returned so that the callers can not change the cached table.
+    @param csv_file: input csv file path
+    @type csv_file: str
+    @param transform: the function applied to the loaded dataFrame
+    @type transform: function
+    @return: the reference dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(csv_file, str)
+    assert transform is None or callable(transform)
+
+    key = (os.path.abspath(csv_file), transform.__name__ if transform else None)
+    stat = os.stat(csv_file)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    if key not in REFERENCE_TABLES or REFERENCE_TABLES[key][0] != signature:
+        df = read_csv_file(csv_file)
+        if transform:
+            df = transform(df)
+        REFERENCE_TABLES[key] = (signature, df)
+    return REFERENCE_TABLES[key][1].copy()
+
+
+def clear_reference_tables():
+    """
+    This function clears all of the cached reference tables.
+    """
+    REFERENCE_TABLES.clear()
+
+
+def get_us_airports():
+    """
+    This function returns the cleaned US airport data.
+    @return: the cleaned US airport dataFrame
+    @rtype: pd.DataFrame
+    """
+    return load_reference_table(constants.CLEANED_AIRPORT_DATA_PATH)
+
+
+def get_us_regions():
+    """
+    This function returns the US states and region division data.
+    @return: the US region division dataFrame
+    @rtype: pd.DataFrame
+    """
+    return load_reference_table(constants.US_REGION_DIVISION_DATA_PATH)
+
+
+def get_iata_lookup():
+    """
+    This function returns the lookup arrays from the airport iata code to its state and region. The i-th element of
+    the states and regions arrays belongs to the i-th iata code in the index, so the state of a column of codes is
+    `states[index.get_indexer(codes)]` after removing the -1 (unknown airport) positions. The arrays are built once
+    per version of the reference files and shared by the callers, so the arrays are read-only.
+    @return: iata code index, state array and region array
+    @rtype: tuple
+    """
+    key = ('iata_lookup',)
+    signature = tuple((os.stat(path).st_size, os.stat(path).st_mtime_ns)
+                      for path in [constants.CLEANED_AIRPORT_DATA_PATH, constants.US_REGION_DIVISION_DATA_PATH])
+    if key not in REFERENCE_TABLES or REFERENCE_TABLES[key][0] != signature:
+        df_us_airport = get_us_airports().drop_duplicates('iata_code')
+        us_division = get_us_regions()
+        df_lookup = pd.merge(df_us_airport[['iata_code', 'iso_region']], us_division[['State Code', 'Region']],
+                             left_on='iso_region', right_on='State Code', how='left')
+        lookup = (pd.Index(df_lookup['iata_code']),
+                  df_lookup['iso_region'].to_numpy(dtype=object),
+                  df_lookup['Region'].to_numpy(dtype=object))
+        for values in lookup[1:]:
+            values.setflags(write=False)
+        REFERENCE_TABLES[key] = (signature, lookup)
+    return REFERENCE_TABLES[key][1]
+
+
+def get_airport_positions(codes, iata_index):
+    """
+    This function returns the position in iata_index of each airport code, or -1 for the unknown airports. A categorical
+    column is looked up once per category and mapped to the rows by its category codes.
+    @param codes: input column of airport iata codes, e.g. df['ORIGIN']
+    @type codes: pd.Series
+    @param iata_index: the iata code index of get_iata_lookup
+    @type iata_index: pd.Index
+    @return: the positions
+    @rtype: np.ndarray
+    """
+    assert isinstance(codes, pd.Series)
+    assert isinstance(iata_index, pd.Index)
+
+    if isinstance(codes.dtype, pd.CategoricalDtype):
+        category_positions = iata_index.get_indexer(codes.cat.categories)
+        category_codes = codes.cat.codes.to_numpy()
+        return np.where(category_codes >= 0, category_positions[category_codes], -1)
+    return iata_index.get_indexer(np.asarray(codes, dtype=object))
@@ -0,0 +1,64 @@
+import os
+import processing.constants as constants
+from processing.cache import HAS_PARQUET, get_cache_path, get_stored_schema, build_month_partitions
+from processing.cube import build_cube
+from processing.parallel import map_in_order
+
+
+def get_year_cache_paths(year, with_month=True):
+    """
+    This function returns the paths of the stored partial results of the given year, i.e. the aggregate cube and the
+    month partitions. The paths depend on the signature of the yearly csv file, so they change when the file changes.
+    @param year: input year
+    @type year: int
+    @param with_month: whether we include the month partitions
+    @type with_month: bool
+    @return: the list of the cache file paths
+    @rtype: list
+    """
+    assert isinstance(year, int)
+
+    csv_file = constants.ROOT + str(year) + '.csv'
+    paths = [get_cache_path(csv_file, '.cube.parquet', constants.FLIGHT_SCHEMA)]
+    if with_month:
+        paths.append(get_cache_path(csv_file, '.month.parquet', get_stored_schema(constants.FLIGHT_SCHEMA, True)))
+    return paths
+
+
+def refresh_year(year, with_month=True):
+    """
+    This function scans the csv file of the given year once and stores its partial results. It is a module-level
+    function so that it can run in a worker process.
+    @param year: input year
+    @type year: int
+    @param with_month: whether we also build the month partitions
+    @type with_month: bool
+    """
+    assert isinstance(year, int)
+
+    build_cube(year)
+    if with_month:
+        build_month_partitions(constants.ROOT + str(year) + '.csv', constants.FLIGHT_SCHEMA)
+
+
+def refresh(workers=None, with_month=True):
+    """
+    This function discovers the yearly csv files in the data directory, updates constants.YEAR_LIST, and only scans the
+    years whose csv files are new or changed since their partial results were stored. The years already processed keep
+    their stored cubes and month partitions, so a refresh after a data drop takes time proportional to the new data.
+    Afterwards, the analysis with use_cube=True covers all of the discovered years.
+    @param workers: the number of worker processes
+    @type workers: int
+    @param with_month: whether we also build the month partitions
+    @type with_month: bool
+    @return: the years that were scanned
+    @rtype: list
+    """
+    assert HAS_PARQUET and constants.USE_FLIGHT_CACHE, "ERROR! The stored partial results require the flight cache"
+
+    constants.YEAR_LIST = constants.find_years(constants.ROOT)
+    stale_years = [year for year in constants.YEAR_LIST
+                   if os.path.isfile(constants.ROOT + str(year) + '.csv') and
+                   not all(os.path.isfile(path) for path in get_year_cache_paths(year, with_month))]
+    map_in_order(refresh_year, [(year, with_month) for year in stale_years], workers)
+    return stale_years
@@ -0,0 +1,359 @@
+import numpy as np
+import pandas as pd
+import processing.constants as constants
+from processing.flight import iter_flight_data_by_year
+from processing.operations import accumulate
+from processing.parallel import map_in_order
+from processing.trace import traced
+
+# The quantile sketches keep the number of delays in each logarithmic bucket (gamma^(i-1), gamma^i], where
+# gamma = (1 + SKETCH_RELATIVE_ERROR) / (1 - SKETCH_RELATIVE_ERROR), so every quantile is answered within
+# SKETCH_RELATIVE_ERROR of the true value. The delays are whole minutes, and the values between -1 and 1 are kept in the
+# bucket 0. The sketches of two chunks, years or workers are merged by adding the counts of the same buckets.
+SKETCH_RELATIVE_ERROR = 0.01
+# The distinct count sketches are HyperLogLog sketches with 2^SKETCH_PRECISION registers, whose standard error is
+# 1.04 / sqrt(2^SKETCH_PRECISION), i.e. about 1.6%. They are merged by taking the maximum of the same registers.
+SKETCH_PRECISION = 12
+# QUANTILE_SKETCHES are the (group column, delay column) pairs whose delay distributions are sketched
+QUANTILE_SKETCHES = [('ORIGIN', 'DEP_DELAY'), ('DEST', 'ARR_DELAY'),
+                     ('OP_CARRIER', 'DEP_DELAY'), ('OP_CARRIER', 'ARR_DELAY'),
+                     ('month', 'DEP_DELAY'), ('month', 'ARR_DELAY')]
+# DISTINCT_SKETCHES are the (group column, value columns) pairs whose distinct values are counted, e.g. the distinct
+# routes of each carrier and the distinct destinations of each origin airport
+DISTINCT_SKETCHES = [('OP_CARRIER', ('ORIGIN', 'DEST')), ('ORIGIN', ('DEST',))]
+SKETCH_USED_COLS = ['ORIGIN', 'DEST', 'OP_CARRIER', 'month', 'CANCELLED', 'DEP_DELAY', 'ARR_DELAY']
+
+
+def get_gamma(relative_error):
+    """
+    This function returns the ratio between the bounds of the quantile sketch buckets for the given relative error.
+    @param relative_error: the relative error of the quantiles, between 0 and 1
+    @type relative_error: float
+    @return: the bucket ratio gamma
+    @rtype: float
+    """
+    assert 0 < relative_error < 1
+
+    return (1 + relative_error) / (1 - relative_error)
+
+
+def get_buckets(values, relative_error):
+    """
+    This function returns the quantile sketch bucket of each value: 0 for the values between -1 and 1, i + 1 for the
+    positive values in (gamma^(i-1), gamma^i], and -(i + 1) for the negative values in [-gamma^i, -gamma^(i-1)).
+    @param values: input values
+    @type values: np.ndarray
+    @param relative_error: the relative error of the quantiles
+    @type relative_error: float
+    @return: the buckets
+    @rtype: np.ndarray
+    """
+    assert isinstance(values, np.ndarray)
+
+    magnitude = np.abs(values.astype(np.float64))
+    buckets = np.zeros(len(values), dtype=np.int64)
+    large = magnitude >= 1
+    buckets[large] = np.ceil(np.log(magnitude[large]) / np.log(get_gamma(relative_error))).astype(np.int64) + 1
+    return np.where(values < 0, -buckets, buckets)
+
+
+def get_bucket_values(buckets, relative_error):
+    """
+    This function returns the value represented by each quantile sketch bucket, which is within the relative error of
+    every value in the bucket.
+    @param buckets: input buckets of get_buckets
+    @type buckets: np.ndarray
+    @param relative_error: the relative error of the quantiles
+    @type relative_error: float
+    @return: the values
+    @rtype: np.ndarray
+    """
+    gamma = get_gamma(relative_error)
+    magnitude = 2 * gamma ** (np.abs(buckets) - 1.0) / (gamma + 1)
+    return np.where(buckets == 0, 0.0, np.sign(buckets) * magnitude)
+
+
+def hash_columns(df, cols):
+    """
+    This function returns a 64 bit hash of the values of the given columns of each row. The categorical columns are
+    hashed once per category.
+    @param df: input dataFrame
+    @type df: pd.DataFrame
+    @param cols: the columns to hash
+    @type cols: tuple
+    @return: the hashes
+    @rtype: np.ndarray
+    """
+    assert isinstance(df, pd.DataFrame)
+
+    hashes = None
+    for col in cols:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            category_hashes = pd.util.hash_array(np.asarray(df[col].cat.categories, dtype=object))
+            col_hashes = category_hashes[df[col].cat.codes.to_numpy()]
+        else:
+            col_hashes = pd.util.hash_array(np.asarray(df[col], dtype=object))
+        hashes = col_hashes if hashes is None else pd.util.hash_array(hashes * np.uint64(31) ^ col_hashes)
+    return hashes
+
+
+def count_leading_zeros(values):
+    """
+    This function counts the leading zero bits of each 64 bit value.
+    @param values: input values
+    @type values: np.ndarray of np.uint64
+    @return: the numbers of leading zeros
+    @rtype: np.ndarray
+    """
+    values = values.astype(np.uint64)
+    zeros = np.zeros(len(values), dtype=np.int64)
+    for shift in [32, 16, 8, 4, 2, 1]:
+        empty = (values >> np.uint64(64 - shift)) == 0
+        zeros[empty] += shift
+        values[empty] <<= np.uint64(shift)
+    return zeros + (values == 0)
+
+
+def sketch_quantile_chunk(df, group_key, delay_col, relative_error):
+    """
+    This function returns the partial quantile sketch of the delay column of each group in one chunk, i.e. the number
+    of delays in each bucket.
+    @param df: input chunk of the flights not cancelled
+    @type df: pd.DataFrame
+    @param group_key: the group column
+    @type group_key: str
+    @param delay_col: the delay column
+    @type delay_col: str
+    @param relative_error: the relative error of the quantiles
+    @type relative_error: float
+    @return: the dataFrame with the columns [group_key, 'bucket', 'count']
+    @rtype: pd.DataFrame
+    """
+    delays = df[delay_col].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(delays)
+    df_buckets = pd.DataFrame({group_key: np.asarray(df[group_key], dtype=object)[valid],
+                               'bucket': get_buckets(delays[valid], relative_error),
+                               'count': np.ones(valid.sum(), dtype=np.int64)})
+    return df_buckets.groupby([group_key, 'bucket'], sort=False).sum().reset_index()
+
+
+def sketch_distinct_chunk(df, group_key, value_cols, precision):
+    """
+    This function returns the partial HyperLogLog sketch of the distinct values of the value columns of each group in
+    one chunk, i.e. the largest rank seen by each register.
+    @param df: input chunk
+    @type df: pd.DataFrame
+    @param group_key: the group column
+    @type group_key: str
+    @param value_cols: the value columns, e.g. ('ORIGIN', 'DEST') for the routes
+    @type value_cols: tuple
+    @param precision: the number of bits of the register index
+    @type precision: int
+    @return: the dataFrame with the columns [group_key, 'register', 'rank']
+    @rtype: pd.DataFrame
+    """
+    hashes = hash_columns(df, value_cols)
+    registers = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    ranks = np.minimum(count_leading_zeros(hashes << np.uint64(precision)), 64 - precision) + 1
+    df_ranks = pd.DataFrame({group_key: np.asarray(df[group_key], dtype=object), 'register': registers, 'rank': ranks})
+    return df_ranks.groupby([group_key, 'register'], sort=False)['rank'].max().reset_index()
+
+
+def reduce_distinct(partials, group_key):
+    """
+    This function merges the partial HyperLogLog sketches by the maximum rank of each register.
+    @param partials: the list of the partial sketch dataFrames
+    @type partials: list
+    @param group_key: the group column
+    @type group_key: str
+    @return: the merged sketch dataFrame
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(partials, list)
+
+    if not partials:
+        return pd.DataFrame(columns=[group_key, 'register', 'rank'])
+    df_ranks = pd.concat(partials, ignore_index=True)
+    return df_ranks.groupby([group_key, 'register'], sort=False)['rank'].max().reset_index()
+
+
+def new_sketches(relative_error, precision):
+    """
+    This function returns the empty sketches of QUANTILE_SKETCHES and DISTINCT_SKETCHES.
+    @param relative_error: the relative error of the quantiles
+    @type relative_error: float
+    @param precision: the number of bits of the register index of the distinct counts
+    @type precision: int
+    @return: the sketches
+    @rtype: dict
+    """
+    return {'relative_error': relative_error,
+            'precision': precision,
+            'quantiles': {key: pd.DataFrame(columns=[key[0], 'bucket', 'count']) for key in QUANTILE_SKETCHES},
+            'distinct': {key: pd.DataFrame(columns=[key[0], 'register', 'rank']) for key in DISTINCT_SKETCHES}}
+
+
+def merge_sketches(sketches_list):
+    """
+    This function merges the sketches of e.g. different years into the sketches of all of them.
+    @param sketches_list: the list of the sketches of build_year_sketches or build_sketches
+    @type sketches_list: list
+    @return: the merged sketches
+    @rtype: dict
+    """
+    assert isinstance(sketches_list, list) and sketches_list
+    assert len({(sketches['relative_error'], sketches['precision']) for sketches in sketches_list}) == 1, \
+        "ERROR! The sketches must have the same relative error and precision"
+
+    merged = new_sketches(sketches_list[0]['relative_error'], sketches_list[0]['precision'])
+    for key in QUANTILE_SKETCHES:
+        merged['quantiles'][key] = accumulate((sketches['quantiles'][key] for sketches in sketches_list),
+                                              keys=[key[0], 'bucket'])
+    for key in DISTINCT_SKETCHES:
+        merged['distinct'][key] = reduce_distinct([sketches['distinct'][key] for sketches in sketches_list], key[0])
+    return merged
+
+
+def build_year_sketches(year, relative_error=SKETCH_RELATIVE_ERROR, precision=SKETCH_PRECISION,
+                        chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function builds all of the sketches of the given year in one streaming pass over its flights. The quantile
+    sketches only count the flights not cancelled. It is a module-level function so that it can run in a worker
+    process.
+    @param year: input year
+    @type year: int
+    @param relative_error: the relative error of the quantiles
+    @type relative_error: float
+    @param precision: the number of bits of the register index of the distinct counts
+    @type precision: int
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: the sketches
+    @rtype: dict
+    """
+    assert isinstance(year, int)
+
+    quantile_partials = {key: [] for key in QUANTILE_SKETCHES}
+    distinct_partials = {key: [] for key in DISTINCT_SKETCHES}
+    for df in iter_flight_data_by_year(year, SKETCH_USED_COLS, chunk_rows):
+        df_flown = df[df['CANCELLED'] != 1]
+        for group_key, delay_col in QUANTILE_SKETCHES:
+            quantile_partials[(group_key, delay_col)].append(
+                sketch_quantile_chunk(df_flown, group_key, delay_col, relative_error))
+        for group_key, value_cols in DISTINCT_SKETCHES:
+            distinct_partials[(group_key, value_cols)] = [reduce_distinct(
+                distinct_partials[(group_key, value_cols)] + [sketch_distinct_chunk(df, group_key, value_cols,
+                                                                                    precision)], group_key)]
+
+    sketches = new_sketches(relative_error, precision)
+    for key, partials in quantile_partials.items():
+        if partials:
+            sketches['quantiles'][key] = accumulate(partials, keys=[key[0], 'bucket'])
+    for key, partials in distinct_partials.items():
+        sketches['distinct'][key] = reduce_distinct(partials, key[0])
+    return sketches
+
+
+@traced
+def build_sketches(years=None, workers=None, relative_error=SKETCH_RELATIVE_ERROR, precision=SKETCH_PRECISION,
+                   chunk_rows=constants.FLIGHT_CHUNK_ROWS):
+    """
+    This function builds the delay quantile sketches of QUANTILE_SKETCHES and the distinct count sketches of
+    DISTINCT_SKETCHES of the given years in one streaming pass over the flights, and merges the sketches of the years.
+    With workers > 1, the years are sketched in a pool of worker processes. The sketches only grow with the groups and
+    the buckets, so they can be kept and merged with the sketches of new years by merge_sketches.
+    For example, the median and the 95th percentile of the departure delay of each carrier are
+    sketches = build_sketches()
+    get_quantiles(sketches, 'OP_CARRIER', 'DEP_DELAY', [0.5, 0.95])
+    @param years: the input years, all of the years in constants.YEAR_LIST if it is None
+    @type years: list
+    @param workers: the number of worker processes, the data is sketched in this process if it is None
+    @type workers: int
+    @param relative_error: the relative error of the quantiles
+    @type relative_error: float
+    @param precision: the number of bits of the register index of the distinct counts, between 4 and 16
+    @type precision: int
+    @param chunk_rows: the maximum number of flights read at a time
+    @type chunk_rows: int
+    @return: the sketches
+    @rtype: dict
+    """
+    assert years is None or isinstance(years, list)
+    assert 0 < relative_error < 1
+    assert isinstance(precision, int) and 4 <= precision <= 16
+
+    if years is None:
+        years = constants.YEAR_LIST
+    results = map_in_order(build_year_sketches, [(year, relative_error, precision, chunk_rows) for year in years],
+                           workers)
+    if not results:
+        return new_sketches(relative_error, precision)
+    return merge_sketches(results)
+
+
+def get_quantiles(sketches, group_key, delay_col, quantiles=(0.5, 0.95)):
+    """
+    This function answers the given quantiles of the delay column for each group from the sketches. Each answer is
+    within sketches['relative_error'] of the exact quantile, e.g. 1% of the median delay.
+    @param sketches: input sketches of build_sketches
+    @type sketches: dict
+    @param group_key: the group column, e.g. 'OP_CARRIER'
+    @type group_key: str
+    @param delay_col: the delay column, e.g. 'DEP_DELAY'
+    @type delay_col: str
+    @param quantiles: the quantiles between 0 and 1
+    @type quantiles: list
+    @return: the dataFrame indexed by the groups with the column 'count' and one column for each quantile, e.g. 'p50'
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(sketches, dict)
+    assert (group_key, delay_col) in sketches['quantiles'], "ERROR! The sketch is not built"
+    assert all(0 <= q <= 1 for q in quantiles)
+
+    df_sketch = sketches['quantiles'][(group_key, delay_col)].copy()
+    df_sketch['bucket'] = df_sketch['bucket'].astype(np.int64)
+    df_sketch['count'] = df_sketch['count'].astype(np.int64)
+    df_sketch = df_sketch.sort_values([group_key, 'bucket'], kind='stable').reset_index(drop=True)
+    df_sketch['value'] = get_bucket_values(df_sketch['bucket'].to_numpy(), sketches['relative_error'])
+    cumulative = df_sketch.groupby(group_key, sort=False)['count'].cumsum()
+    total = df_sketch.groupby(group_key, sort=False)['count'].transform('sum')
+
+    df_quantiles = pd.DataFrame({'count': df_sketch.groupby(group_key)['count'].sum()})
+    for q in quantiles:
+        # the value of the rank floor(q * (n - 1)), counting from 0, is in the first bucket whose cumulative count
+        # is larger than the rank
+        rank = np.floor(q * (total - 1))
+        in_rank = df_sketch[cumulative > rank]
+        df_quantiles['p' + format(100 * q, 'g')] = in_rank.groupby(group_key)['value'].first()
+    return df_quantiles
+
+
+def get_distinct_counts(sketches, group_key, value_cols):
+    """
+    This function estimates the number of distinct values of the value columns for each group from the HyperLogLog
+    sketches, e.g. get_distinct_counts(sketches, 'OP_CARRIER', ('ORIGIN', 'DEST')) is the number of routes of each
+    carrier. The standard error is 1.04 / sqrt(2^sketches['precision']).
+    @param sketches: input sketches of build_sketches
+    @type sketches: dict
+    @param group_key: the group column
+    @type group_key: str
+    @param value_cols: the value columns
+    @type value_cols: tuple
+    @return: the estimates indexed by the groups
+    @rtype: pd.Series
+    """
+    assert isinstance(sketches, dict)
+    assert (group_key, tuple(value_cols)) in sketches['distinct'], "ERROR! The sketch is not built"
+
+    n_registers = 2 ** sketches['precision']
+    df_ranks = sketches['distinct'][(group_key, tuple(value_cols))]
+    df_registers = df_ranks.pivot_table(index=group_key, columns='register', values='rank', aggfunc='max') \
+                           .reindex(columns=range(n_registers)).fillna(0)
+    registers = df_registers.to_numpy(dtype=np.float64)
+    alpha = 0.7213 / (1 + 1.079 / n_registers)
+    estimates = alpha * n_registers ** 2 / np.sum(2.0 ** -registers, axis=1)
+    # the small counts are estimated from the number of empty registers
+    empty = np.sum(registers == 0, axis=1)
+    small = (estimates <= 2.5 * n_registers) & (empty > 0)
+    estimates[small] = n_registers * np.log(n_registers / empty[small])
+    return pd.Series(estimates, index=df_registers.index, name='distinct')
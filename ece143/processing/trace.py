@@ -0,0 +1,181 @@
+import atexit
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import pandas as pd
+
+# FLIGHT_TRACE=summary prints a table of the traced stages at exit, FLIGHT_TRACE=chrome writes the spans as a
+# Chrome-trace json file (open it in chrome://tracing or https://ui.perfetto.dev) to FLIGHT_TRACE_FILE.
+TRACE_ENV = 'FLIGHT_TRACE'
+TRACE_FILE_ENV = 'FLIGHT_TRACE_FILE'
+TRACE_MODES = ['summary', 'chrome']
+DEFAULT_TRACE_FILE = './trace.json'
+
+TRACE_MODE = os.environ.get(TRACE_ENV, '').lower()
+assert TRACE_MODE in [''] + TRACE_MODES, "ERROR! %s must be one of %s" % (TRACE_ENV, TRACE_MODES)
+ENABLED = TRACE_MODE != ''
+
+# SPANS stores the finished spans of this process
+SPANS = []
+
+
+def get_rss_mb():
+    """
+    This function returns the current resident set size of this process in MB. Where /proc is not available, it falls
+    back to the peak resident set size.
+    @return: the resident set size in MB
+    @rtype: float
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def count_rows(value):
+    """
+    This function counts the rows of the DataFrames in value, which can be a DataFrame or a tuple, list or dict of them.
+    @param value: the argument or the return value of a traced function
+    @return: the number of rows, or None if value has no DataFrame
+    @rtype: int
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        rows = [count_rows(item) for item in value]
+        rows = [row for row in rows if row is not None]
+        return sum(rows) if rows else None
+    return None
+
+
+def traced(func):
+    """
+    This decorator records a span with the elapsed time, the rows in and out and the memory delta of every call of func
+    when tracing is switched on by the FLIGHT_TRACE environment variable. Otherwise, func is returned unchanged, so it
+    costs nothing.
+    @param func: the function to trace
+    @type func: function
+    @return: the traced function
+    @rtype: function
+    """
+    assert callable(func)
+
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        rss = get_rss_mb()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        end = time.perf_counter()
+        SPANS.append({'name': func.__module__.split('.')[-1] + '.' + func.__name__,
+                      'start': start,
+                      'seconds': end - start,
+                      'rows_in': count_rows(list(args) + list(kwargs.values())),
+                      'rows_out': count_rows(result),
+                      'mem_delta_mb': get_rss_mb() - rss,
+                      'pid': os.getpid()})
+        return result
+    return wrapper
+
+
+def take_spans():
+    """
+    This function removes and returns the spans recorded by this process so far.
+    @return: the list of spans
+    @rtype: list
+    """
+    spans = SPANS[:]
+    del SPANS[:]
+    return spans
+
+
+def run_traced(func, *args):
+    """
+    This function calls func in a worker process and returns its result together with the spans it recorded, so that
+    the parent process can report them.
+    @param func: the module-level function to call
+    @type func: function
+    @return: the result of func and the list of spans
+    @rtype: tuple
+    """
+    result = func(*args)
+    return result, take_spans()
+
+
+def summarize(spans):
+    """
+    This function summarizes the spans by stage name. The times of the outer stages include their inner stages.
+    @param spans: the list of spans
+    @type spans: list
+    @return: the summary with one row per stage, sorted by the total time
+    @rtype: pd.DataFrame
+    """
+    assert isinstance(spans, list)
+
+    df_spans = pd.DataFrame(spans, columns=['name', 'seconds', 'rows_in', 'rows_out', 'mem_delta_mb'])
+    df_summary = df_spans.groupby('name') \
+                         .agg(calls=('seconds', 'size'),
+                              total_s=('seconds', 'sum'),
+                              mean_s=('seconds', 'mean'),
+                              rows_in=('rows_in', 'sum'),
+                              rows_out=('rows_out', 'sum'),
+                              max_mem_delta_mb=('mem_delta_mb', 'max')) \
+                         .sort_values('total_s', ascending=False)
+    df_summary[['rows_in', 'rows_out']] = df_summary[['rows_in', 'rows_out']].astype('int64')
+    return df_summary
+
+
+def write_chrome_trace(spans, trace_file):
+    """
+    This function writes the spans as complete events of the Chrome trace event format.
+    @param spans: the list of spans
+    @type spans: list
+    @param trace_file: the output json file
+    @type trace_file: str
+    """
+    assert isinstance(spans, list)
+    assert isinstance(trace_file, str)
+
+    events = [{'name': span['name'],
+               'ph': 'X',
+               'ts': span['start'] * 1e6,
+               'dur': span['seconds'] * 1e6,
+               'pid': span['pid'],
+               'tid': span['pid'],
+               'args': {'rows_in': span['rows_in'],
+                        'rows_out': span['rows_out'],
+                        'mem_delta_mb': round(span['mem_delta_mb'], 3)}}
+              for span in spans]
+    with open(trace_file, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def report():
+    """
+    This function reports the spans of this process and of its finished workers in the FLIGHT_TRACE mode.
+    """
+    spans = take_spans()
+    if not spans:
+        return
+    if TRACE_MODE == 'chrome':
+        trace_file = os.environ.get(TRACE_FILE_ENV, DEFAULT_TRACE_FILE)
+        write_chrome_trace(spans, trace_file)
+        print('Wrote %d trace spans to %s' % (len(spans), trace_file), file=sys.stderr)
+    else:
+        with pd.option_context('display.width', 200, 'display.max_columns', None,
+                               'display.float_format', '{:.3f}'.format):
+            print(summarize(spans), file=sys.stderr)
+
+
+# worker processes do not run the atexit hooks, their spans are sent back by run_traced instead
+if ENABLED:
+    atexit.register(report)